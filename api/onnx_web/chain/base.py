@@ -1,6 +1,6 @@
 from datetime import timedelta
 from logging import getLogger
-from time import monotonic
+from time import monotonic, perf_counter
 from typing import Any, List, Optional, Protocol, Tuple
 
 from PIL import Image
@@ -119,6 +119,7 @@ class ChainPipeline:
                 kwargs.keys(),
             )
 
+            stage_start = perf_counter()
             if (
                 image.width > stage_params.tile_size
                 or image.height > stage_params.tile_size
@@ -129,15 +130,16 @@ class ChainPipeline:
                 )
 
                 def stage_tile(tile: Image.Image, _dims) -> Image.Image:
-                    tile = stage_pipe(
-                        job,
-                        server,
-                        stage_params,
-                        params,
-                        tile,
-                        callback=callback,
-                        **kwargs
-                    )
+                    with server.timings.timer("tile", name):
+                        tile = stage_pipe(
+                            job,
+                            server,
+                            stage_params,
+                            params,
+                            tile,
+                            callback=callback,
+                            **kwargs
+                        )
 
                     if is_debug():
                         save_image(server, "last-tile.png", tile)
@@ -163,6 +165,7 @@ class ChainPipeline:
                     **kwargs
                 )
 
+            server.timings.record("stage", (name,), perf_counter() - stage_start)
             logger.debug(
                 "finished stage %s, result size: %sx%s", name, image.width, image.height
             )
@@ -52,6 +52,7 @@ def blend_inpaint(
         fill=fill_color,
         noise_source=noise_source,
         mask_filter=mask_filter,
+        seed=params.seed,
     )
 
     if is_debug():
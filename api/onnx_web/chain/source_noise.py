@@ -14,7 +14,7 @@ def source_noise(
     _job: WorkerContext,
     _server: ServerContext,
     _stage: StageParams,
-    _params: ImageParams,
+    params: ImageParams,
     source: Image.Image,
     *,
     size: Size,
@@ -28,7 +28,7 @@ def source_noise(
     if source is not None:
         logger.warn("a source image was passed to a noise stage, but will be discarded")
 
-    output = noise_source(source, (size.width, size.height), (0, 0))
+    output = noise_source(source, (size.width, size.height), (0, 0), seed=params.seed)
 
     logger.info("final output image size: %sx%s", output.width, output.height)
     return output
@@ -62,6 +62,7 @@ def upscale_outpaint(
         fill=fill_color,
         noise_source=noise_source,
         mask_filter=mask_filter,
+        seed=params.seed,
     )
 
     full_latents = get_latents_from_seed(params.seed, Size(*full_size))
@@ -10,9 +10,12 @@ from ..params import DeviceParams, ImageParams, StageParams, UpscaleParams
 from ..server import ServerContext
 from ..utils import run_gc
 from ..worker import WorkerContext
+from .utils import process_tile_grid
 
 logger = getLogger(__name__)
 
+TILE_SIZE = 64
+
 
 def load_swinir(
     server: ServerContext,
@@ -66,55 +69,21 @@ def upscale_swinir(
     device = job.get_device()
     swinir = load_swinir(server, stage, upscale, device)
 
-    # TODO: add support for other sizes
-    tile_size = (64, 64)
-    tile_x = source.width // tile_size[0]
-    tile_y = source.height // tile_size[1]
+    def upscale_tiles(tiles: np.ndarray, _dims) -> np.ndarray:
+        # the model expects BGR
+        logger.info("SwinIR input shape: %s", tiles.shape)
+        output = swinir(np.ascontiguousarray(tiles[:, ::-1]))
+        return output[:, ::-1]
 
-    # TODO: add support for grayscale (1-channel) images
-    image = np.array(source) / 255.0
-    image = image[:, :, [2, 1, 0]].astype(np.float32).transpose((2, 0, 1))
-    image = np.expand_dims(image, axis=0)
-    logger.info("SwinIR input shape: %s", image.shape)
+    upscale_tiles.batch_limit = swinir.batch_limit
 
-    scale = upscale.outscale
-    dest = np.zeros(
-        (image.shape[0], image.shape[1], image.shape[2] * scale, image.shape[3] * scale)
+    output = process_tile_grid(
+        source,
+        TILE_SIZE,
+        upscale.outscale,
+        [upscale_tiles],
+        batch_memory=server.tile_batch_memory,
     )
-    logger.info("SwinIR output shape: %s", dest.shape)
-
-    for x in range(tile_x):
-        for y in range(tile_y):
-            xt = x * tile_size[0]
-            yt = y * tile_size[1]
-
-            ix1 = xt
-            ix2 = xt + tile_size[0]
-            iy1 = yt
-            iy2 = yt + tile_size[1]
-            logger.info(
-                "running SwinIR on tile: (%s, %s, %s, %s) -> (%s, %s, %s, %s)",
-                ix1,
-                ix2,
-                iy1,
-                iy2,
-                ix1 * scale,
-                ix2 * scale,
-                iy1 * scale,
-                iy2 * scale,
-            )
-
-            dest[
-                :,
-                :,
-                ix1 * scale : ix2 * scale,
-                iy1 * scale : iy2 * scale,
-            ] = swinir(image[:, :, ix1:ix2, iy1:iy2])
-
-    dest = np.clip(np.squeeze(dest, axis=0), 0, 1)
-    dest = dest[[2, 1, 0], :, :].transpose((1, 2, 0))
-    dest = (dest * 255.0).round().astype(np.uint8)
-
-    output = Image.fromarray(dest, "RGB")
+
     logger.info("output image size: %s x %s", output.width, output.height)
     return output
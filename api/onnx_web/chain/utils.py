@@ -1,6 +1,7 @@
+from functools import lru_cache
 from logging import getLogger
 from math import ceil
-from typing import List, Protocol, Tuple
+from typing import List, Protocol, Tuple, Union
 
 import numpy as np
 from PIL import Image
@@ -12,6 +13,9 @@ from ..params import TileOrder
 
 logger = getLogger(__name__)
 
+# bytes of input and output pixels for each batch of tiles
+DEFAULT_BATCH_MEMORY = 2**24
+
 
 class TileCallback(Protocol):
     """
@@ -25,6 +29,70 @@ class TileCallback(Protocol):
         pass
 
 
+class BatchTileCallback(Protocol):
+    """
+    Definition for a tile job function that can run on many tiles at once. Tiles are stacked into a single NCHW array
+    of RGB values in the range [0, 1], and the output should have the same layout.
+    """
+
+    batch_limit: int  # the most tiles the model can run at once, 0 for no limit
+
+    def __call__(
+        self, tiles: np.ndarray, dims: List[Tuple[int, int, int]]
+    ) -> np.ndarray:
+        """
+        Run this stage against a batch of tiles.
+        """
+        pass
+
+
+AnyTileCallback = Union[TileCallback, BatchTileCallback]
+
+
+def is_batch_callback(callback: AnyTileCallback) -> bool:
+    return hasattr(callback, "batch_limit")
+
+
+def get_batch_size(
+    filters: List[AnyTileCallback], tile: int, scale: int, memory: int
+) -> int:
+    """
+    Get the number of tiles to run together, within a memory budget for their float32 pixels and the limit of each
+    batch filter. If none of the filters support batches, tiles will be run one at a time.
+    """
+    limits = [f.batch_limit for f in filters if is_batch_callback(f)]
+    if len(limits) == 0:
+        return 1
+
+    tile_bytes = 3 * 4 * tile * tile * (1 + scale * scale)
+    size = max(1, memory // tile_bytes)
+    for limit in limits:
+        if limit > 0:
+            size = min(size, limit)
+
+    return size
+
+
+def run_tile_filter(
+    filter: AnyTileCallback,
+    images: List[Image.Image],
+    dims: List[Tuple[int, int, int]],
+) -> List[Image.Image]:
+    if not is_batch_callback(filter):
+        return [filter(image, tile_dims) for image, tile_dims in zip(images, dims)]
+
+    tiles = np.stack(
+        [np.asarray(image.convert("RGB"), dtype=np.float32) for image in images]
+    )
+    tiles = tiles.transpose((0, 3, 1, 2)) / 255.0
+
+    output = filter(tiles, dims)
+    output = np.clip(output, 0, 1).transpose((0, 2, 3, 1))
+    output = (output * 255.0).round().astype(np.uint8)
+
+    return [Image.fromarray(tile, "RGB") for tile in output]
+
+
 def complete_tile(
     source: Image.Image,
     tile: int,
@@ -62,51 +130,82 @@ def get_tile_grads(
     return (grad_x, grad_y)
 
 
-def blend_tiles(
-    tiles: List[Tuple[int, int, Image.Image]],
-    scale: int,
-    width: int,
-    height: int,
+@lru_cache(maxsize=64)
+def get_tile_ramp(
+    length: int,
     tile: int,
-    overlap: float,
-):
-    adj_tile = int(float(tile) * (1.0 - overlap))
-    logger.trace(
-        "adjusting tile size from %s to %s based on %s overlap", tile, adj_tile, overlap
-    )
+    adj_tile: int,
+    scale: int,
+    start_edge: bool,
+    end_edge: bool,
+) -> np.ndarray:
+    """
+    Get the blending weights along one axis of a tile. Ramps are shared between tiles, so they must not be modified.
+    """
+    grad = [1 if start_edge else 0, 1, 1, 1 if end_edge else 0]
 
-    scaled_size = (height * scale, width * scale, 3)
-    count = np.zeros(scaled_size)
-    value = np.zeros(scaled_size)
+    # sort gradient points
+    p1 = adj_tile * scale
+    p2 = (tile - adj_tile) * scale
+    points = [0, min(p1, p2), max(p1, p2), tile * scale]
+    logger.trace("tile gradient: %s, %s", points, grad)
 
-    for left, top, tile_image in tiles:
-        # histogram equalization
-        equalized = np.array(tile_image).astype(np.float32)
-        mask = np.ones_like(equalized[:, :, 0])
+    ramp = np.interp(np.arange(length), points, grad).astype(np.float32)
+    ramp.setflags(write=False)
+    return ramp
 
-        if adj_tile < tile:
-            # sort gradient points
-            p1 = adj_tile * scale
-            p2 = (tile - adj_tile) * scale
-            points = [0, min(p1, p2), max(p1, p2), tile * scale]
 
-            # gradient blending
-            grad_x, grad_y = get_tile_grads(left, top, adj_tile, width, height)
-            logger.trace("tile gradients: %s, %s, %s", points, grad_x, grad_y)
+class TileBlender:
+    """
+    Accumulate weighted tiles into a preallocated output image as they are finished.
+    """
 
-            mult_x = [np.interp(i, points, grad_x) for i in range(tile * scale)]
-            mult_y = [np.interp(i, points, grad_y) for i in range(tile * scale)]
+    adj_tile: int
+    count: np.ndarray
+    height: int
+    overlap: float
+    scale: int
+    tile: int
+    value: np.ndarray
+    width: int
+
+    def __init__(
+        self,
+        scale: int,
+        width: int,
+        height: int,
+        tile: int,
+        overlap: float,
+    ) -> None:
+        self.scale = scale
+        self.width = width
+        self.height = height
+        self.tile = tile
+        self.overlap = overlap
+
+        self.adj_tile = int(float(tile) * (1.0 - overlap))
+        logger.trace(
+            "adjusting tile size from %s to %s based on %s overlap",
+            tile,
+            self.adj_tile,
+            overlap,
+        )
 
-            mask = ((mask * mult_x).T * mult_y).T
-            for c in range(3):
-                equalized[:, :, c] = equalized[:, :, c] * mask
+        self.count = np.zeros((height * scale, width * scale), dtype=np.float32)
+        self.value = np.zeros((height * scale, width * scale, 3), dtype=np.float32)
 
-        scaled_top = top * scale
-        scaled_left = left * scale
+    def add(self, left: int, top: int, tile_image: Image.Image) -> None:
+        if tile_image.mode != "RGB":
+            tile_image = tile_image.convert("RGB")
 
-        # equalized size may be wrong/too much
-        scaled_bottom = min(scaled_top + equalized.shape[0], scaled_size[0])
-        scaled_right = min(scaled_left + equalized.shape[1], scaled_size[1])
+        scaled_top = top * self.scale
+        scaled_left = left * self.scale
+
+        # tile size may be wrong/too much
+        scaled_bottom = min(scaled_top + tile_image.height, self.value.shape[0])
+        scaled_right = min(scaled_left + tile_image.width, self.value.shape[1])
+        tile_height = scaled_bottom - scaled_top
+        tile_width = scaled_right - scaled_left
         logger.trace(
             "tile broadcast shapes: %s, %s, %s, %s",
             scaled_top,
@@ -115,30 +214,73 @@ def blend_tiles(
             scaled_right,
         )
 
-        # accumulation
-        value[scaled_top:scaled_bottom, scaled_left:scaled_right, :] += equalized[
-            0 : scaled_bottom - scaled_top, 0 : scaled_right - scaled_left, :
-        ]
-        count[scaled_top:scaled_bottom, scaled_left:scaled_right, :] += np.repeat(
-            mask[
-                0 : scaled_bottom - scaled_top,
-                0 : scaled_right - scaled_left,
-                np.newaxis,
-            ],
-            3,
-            axis=2,
+        if tile_height <= 0 or tile_width <= 0:
+            return
+
+        pixels = np.asarray(tile_image, dtype=np.float32)[:tile_height, :tile_width]
+        value = self.value[scaled_top:scaled_bottom, scaled_left:scaled_right]
+        count = self.count[scaled_top:scaled_bottom, scaled_left:scaled_right]
+
+        if self.adj_tile >= self.tile:
+            value += pixels
+            count += 1
+            return
+
+        # gradient blending
+        grad_x, grad_y = get_tile_grads(
+            left, top, self.adj_tile, self.width, self.height
         )
+        ramp_x = get_tile_ramp(
+            tile_image.width,
+            self.tile,
+            self.adj_tile,
+            self.scale,
+            grad_x[0] == 1,
+            grad_x[3] == 1,
+        )[:tile_width]
+        ramp_y = get_tile_ramp(
+            tile_image.height,
+            self.tile,
+            self.adj_tile,
+            self.scale,
+            grad_y[0] == 1,
+            grad_y[3] == 1,
+        )[:tile_height]
+
+        # the mask is separable, so apply each axis without building the full mask
+        pixels *= ramp_y[:, np.newaxis, np.newaxis]
+        pixels *= ramp_x[np.newaxis, :, np.newaxis]
+        value += pixels
+        count += ramp_y[:, np.newaxis] * ramp_x[np.newaxis, :]
+
+    def result(self) -> Image.Image:
+        count = self.count[:, :, np.newaxis]
+        np.divide(self.value, count, out=self.value, where=(count > 0))
+        return Image.fromarray(self.value.astype(np.uint8))
 
-    pixels = np.where(count > 0, value / count, value)
-    return Image.fromarray(np.uint8(pixels))
+
+def blend_tiles(
+    tiles: List[Tuple[int, int, Image.Image]],
+    scale: int,
+    width: int,
+    height: int,
+    tile: int,
+    overlap: float,
+):
+    blender = TileBlender(scale, width, height, tile, overlap)
+    for left, top, tile_image in tiles:
+        blender.add(left, top, tile_image)
+
+    return blender.result()
 
 
 def process_tile_grid(
     source: Image.Image,
     tile: int,
     scale: int,
-    filters: List[TileCallback],
+    filters: List[AnyTileCallback],
     overlap: float = 0.0,
+    batch_memory: int = DEFAULT_BATCH_MEMORY,
     **kwargs,
 ) -> Image.Image:
     width, height = source.size
@@ -148,31 +290,45 @@ def process_tile_grid(
     tiles_y = ceil(height / adj_tile)
     total = tiles_x * tiles_y
 
-    tiles: List[Tuple[int, int, Image.Image]] = []
-
-    for y in range(tiles_y):
-        for x in range(tiles_x):
-            idx = (y * tiles_x) + x
-            left = x * adj_tile
-            top = y * adj_tile
-            logger.info("processing tile %s of %s, %s.%s", idx + 1, total, y, x)
+    batch_size = get_batch_size(filters, tile, scale, batch_memory)
+    if batch_size > 1:
+        logger.debug("processing tiles in batches of %s", batch_size)
+
+    blender = TileBlender(scale, width, height, tile, overlap)
+    coords = [
+        (x * adj_tile, y * adj_tile) for y in range(tiles_y) for x in range(tiles_x)
+    ]
+
+    for start in range(0, total, batch_size):
+        batch = coords[start : start + batch_size]
+        images = []
+        for idx, (left, top) in enumerate(batch, start=start):
+            logger.info(
+                "processing tile %s of %s, %s.%s",
+                idx + 1,
+                total,
+                idx // tiles_x,
+                idx % tiles_x,
+            )
 
             tile_image = source.crop((left, top, left + tile, top + tile))
-            tile_image = complete_tile(tile_image, tile)
+            images.append(complete_tile(tile_image, tile))
 
-            for filter in filters:
-                tile_image = filter(tile_image, (left, top, tile))
+        dims = [(left, top, tile) for left, top in batch]
+        for filter in filters:
+            images = run_tile_filter(filter, images, dims)
 
-            tiles.append((left, top, tile_image))
+        for (left, top), tile_image in zip(batch, images):
+            blender.add(left, top, tile_image)
 
-    return blend_tiles(tiles, scale, width, height, tile, overlap)
+    return blender.result()
 
 
 def process_tile_spiral(
     source: Image.Image,
     tile: int,
     scale: int,
-    filters: List[TileCallback],
+    filters: List[AnyTileCallback],
     overlap: float = 0.5,
     **kwargs,
 ) -> Image.Image:
@@ -185,8 +341,8 @@ def process_tile_spiral(
     image = Image.new("RGB", (width * scale, height * scale))
     image.paste(source, (0, 0, width, height))
 
-    tiles: List[Tuple[int, int, Image.Image]] = []
-    tiles.append((0, 0, source))
+    blender = TileBlender(scale, width, height, tile, overlap)
+    blender.add(0, 0, source)
 
     # tile tuples is source, multiply by scale for dest
     counter = 0
@@ -200,13 +356,14 @@ def process_tile_spiral(
         tile_image = image.crop((left, top, left + tile, top + tile))
         tile_image = complete_tile(tile_image, tile)
 
+        # each tile includes the previous results, so they cannot be batched
         for filter in filters:
-            tile_image = filter(tile_image, (left, top, tile))
+            [tile_image] = run_tile_filter(filter, [tile_image], [(left, top, tile)])
 
         image.paste(tile_image, (left * scale, top * scale))
-        tiles.append((left, top, tile_image))
+        blender.add(left, top, tile_image)
 
-    return blend_tiles(tiles, scale, width, height, tile, overlap)
+    return blender.result()
 
 
 def process_tile_order(
@@ -214,7 +371,7 @@ def process_tile_order(
     source: Image.Image,
     tile: int,
     scale: int,
-    filters: List[TileCallback],
+    filters: List[AnyTileCallback],
     **kwargs,
 ) -> Image.Image:
     if order == TileOrder.grid:
@@ -1,11 +1,11 @@
 from argparse import ArgumentParser
 from logging import getLogger
 from os import path
-from typing import Dict, List, Literal, Tuple, Union
+from typing import Callable, Dict, List, Literal, Optional, Tuple, Union
 
 import numpy as np
 import torch
-from onnx import ModelProto, load, numpy_helper
+from onnx import ModelProto, NodeProto, TensorProto, load, numpy_helper
 from onnx.checker import check_model
 from onnx.external_data_helper import (
     convert_model_to_external_data,
@@ -19,6 +19,8 @@ from ..utils import ConversionContext, load_tensor
 
 logger = getLogger(__name__)
 
+LORA_BATCH_ELEMENTS = 2**26  # 256MB of float32 deltas per batched matmul
+
 
 def sum_weights(a: np.ndarray, b: np.ndarray) -> np.ndarray:
     logger.trace("summing weights with shapes: %s + %s", a.shape, b.shape)
@@ -43,9 +45,9 @@ def sum_weights(a: np.ndarray, b: np.ndarray) -> np.ndarray:
     return hr + lr
 
 
-def buffer_external_data_tensors(
+def buffer_external_data_arrays(
     model: ModelProto,
-) -> Tuple[ModelProto, List[Tuple[str, OrtValue]]]:
+) -> Tuple[ModelProto, List[Tuple[str, np.ndarray]]]:
     external_data = []
     for tensor in model.graph.initializer:
         name = tensor.name
@@ -53,8 +55,7 @@ def buffer_external_data_tensors(
         logger.trace("externalizing tensor: %s", name)
         if tensor.HasField("raw_data"):
             npt = numpy_helper.to_array(tensor)
-            orv = OrtValue.ortvalue_from_numpy(npt)
-            external_data.append((name, orv))
+            external_data.append((name, npt))
             # mimic set_external_data
             set_external_data(tensor, location="foo.bin")
             tensor.name = name
@@ -63,6 +64,16 @@ def buffer_external_data_tensors(
     return (model, external_data)
 
 
+def buffer_external_data_tensors(
+    model: ModelProto,
+) -> Tuple[ModelProto, List[Tuple[str, OrtValue]]]:
+    (model, external_data) = buffer_external_data_arrays(model)
+    return (
+        model,
+        [(name, OrtValue.ortvalue_from_numpy(npt)) for name, npt in external_data],
+    )
+
+
 def fix_initializer_name(key: str):
     # lora_unet_up_blocks_3_attentions_2_transformer_blocks_0_attn2_to_out_0.lora_down.weight
     # lora, unet, up_block.3.attentions.2.transformer_blocks.0.attn2.to_out.0
@@ -84,17 +95,187 @@ def kernel_slice(x: int, y: int, shape: Tuple[int, int, int, int]) -> Tuple[int,
     )
 
 
-def blend_loras(
-    _conversion: ServerContext,
-    base_name: Union[str, ModelProto],
+def add_weights(blended: Dict[str, np.ndarray], key: str, weights: np.ndarray) -> None:
+    if key in blended:
+        blended[key] = sum_weights(blended[key], weights)
+    else:
+        blended[key] = weights
+
+
+def get_lora_factors(
+    down_weight: torch.Tensor,
+    up_weight: torch.Tensor,
+    mid_weight: Optional[torch.Tensor],
+) -> Optional[Tuple[torch.Tensor, torch.Tensor, Tuple[int, ...]]]:
+    """
+    Flatten the up and down weights for a LoRA node into matrices, so the delta can be computed with a single
+    matmul, returning the shape of the delta.
+    """
+    if len(down_weight.size()) == 2:
+        # nn.Linear
+        return (up_weight, down_weight, (up_weight.shape[0], down_weight.shape[1]))
+
+    if len(down_weight.size()) != 4:
+        return None
+
+    kernel = down_weight.shape[-2:]
+    if mid_weight is not None:
+        kernel = mid_weight.shape[-2:]
+
+    up_matrix = up_weight.squeeze(3).squeeze(2)
+    delta_shape = (up_weight.shape[0], down_weight.shape[1], *kernel)
+
+    if kernel == (1, 1):
+        # nn.Conv2d 1x1
+        return (up_matrix, down_weight.squeeze(3).squeeze(2), delta_shape)
+
+    if kernel == (3, 3) and mid_weight is not None:
+        # nn.Conv2d 3x3 with CP decomp, fold the mid weights into the down weights
+        down_matrix = torch.einsum(
+            "r s w h, s i -> r i w h", mid_weight, down_weight.squeeze(3).squeeze(2)
+        )
+        return (up_matrix, down_matrix.flatten(1), delta_shape)
+
+    if kernel == (3, 3) and up_weight.shape[-2:] == (1, 1):
+        # nn.Conv2d 3x3
+        return (up_matrix, down_weight.flatten(1), delta_shape)
+
+    return None
+
+
+def blend_conv_slices(down_weight: torch.Tensor, up_weight: torch.Tensor) -> np.ndarray:
+    """
+    Blend a Conv 3x3 node with kernels in both the up and down weights, one kernel position at a time.
+    """
+    kernel = down_weight.shape[-2:]
+    weights = torch.zeros((up_weight.shape[0], down_weight.shape[1], *kernel))
+
+    for w in range(kernel[0]):
+        for h in range(kernel[1]):
+            down_w, down_h = kernel_slice(w, h, down_weight.shape)
+            up_w, up_h = kernel_slice(w, h, up_weight.shape)
+
+            weights[:, :, w, h] = (
+                up_weight[:, :, up_w, up_h] @ down_weight[:, :, down_w, down_h]
+            )
+
+    return weights.numpy()
+
+
+def get_batches(count: int, elements: int) -> List[Tuple[int, int]]:
+    """
+    Split a group into batches that will produce at most LORA_BATCH_ELEMENTS values each.
+    """
+    batch = max(1, LORA_BATCH_ELEMENTS // max(1, elements))
+    return [(i, min(i + batch, count)) for i in range(0, count, batch)]
+
+
+def compose_lora_factors(
+    blended: Dict[str, np.ndarray],
+    factors: Dict[str, List[Tuple[torch.Tensor, torch.Tensor, Tuple[int, ...]]]],
+) -> None:
+    """
+    Compute the deltas for all of the LoRA nodes. The factors from each LoRA are concatenated along their rank,
+    so the deltas from all of the LoRAs are summed by the same matmul, and keys with the same shape are batched.
+    """
+    groups: Dict[
+        Tuple[int, int, int],
+        List[Tuple[str, torch.Tensor, torch.Tensor, Tuple[int, ...]]],
+    ] = {}
+
+    for base_key, key_factors in factors.items():
+        # LoRAs with different kernel shapes for the same key cannot be concatenated
+        by_columns: Dict[
+            int, List[Tuple[torch.Tensor, torch.Tensor, Tuple[int, ...]]]
+        ] = {}
+        for factor in key_factors:
+            by_columns.setdefault(factor[1].shape[1], []).append(factor)
+
+        for columns, column_factors in by_columns.items():
+            up_matrix = torch.cat([up for up, _down, _shape in column_factors], dim=1)
+            down_matrix = torch.cat(
+                [down for _up, down, _shape in column_factors], dim=0
+            )
+            delta_shape = max((shape for _up, _down, shape in column_factors), key=len)
+
+            group_key = (up_matrix.shape[0], up_matrix.shape[1], columns)
+            groups.setdefault(group_key, []).append(
+                (base_key, up_matrix, down_matrix, delta_shape)
+            )
+
+    logger.debug(
+        "composing %s LoRA nodes in %s groups",
+        sum(len(group) for group in groups.values()),
+        len(groups),
+    )
+
+    for (rows, rank, columns), group in groups.items():
+        logger.trace(
+            "composing %s LoRA nodes with shape (%s, %s) @ (%s, %s)",
+            len(group),
+            rows,
+            rank,
+            rank,
+            columns,
+        )
+        for start, end in get_batches(len(group), rows * columns):
+            batch = group[start:end]
+            deltas = torch.bmm(
+                torch.stack([up for _key, up, _down, _shape in batch]),
+                torch.stack([down for _key, _up, down, _shape in batch]),
+            ).numpy()
+
+            for (base_key, _up, _down, delta_shape), delta in zip(batch, deltas):
+                add_weights(blended, base_key, delta.reshape(delta_shape))
+
+
+def compose_loha_factors(
+    blended: Dict[str, np.ndarray],
+    products: List[
+        Tuple[str, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, float]
+    ],
+) -> None:
+    """
+    Compute the deltas for all of the LoHA nodes, batching the nodes with the same shapes. The Hadamard product
+    does not distribute over the rank, so each LoRA is composed separately.
+    """
+    groups: Dict[
+        Tuple[torch.Size, ...],
+        List[Tuple[str, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, float]],
+    ] = {}
+    for product in products:
+        group_key = tuple(weight.shape for weight in product[1:5])
+        groups.setdefault(group_key, []).append(product)
+
+    logger.debug("composing %s LoHA nodes in %s groups", len(products), len(groups))
+
+    for group_key, group in groups.items():
+        rows, columns = group_key[0][0], group_key[1][1]
+        for start, end in get_batches(len(group), rows * columns):
+            batch = group[start:end]
+            w1a, w1b, w2a, w2b = [
+                torch.stack([product[i] for product in batch]) for i in range(1, 5)
+            ]
+            scales = torch.tensor([product[5] for product in batch]).reshape(-1, 1, 1)
+            deltas = (torch.bmm(w1a, w1b) * torch.bmm(w2a, w2b) * scales).numpy()
+
+            for product, delta in zip(batch, deltas):
+                add_weights(blended, product[0], delta)
+
+
+def blend_lora_weights(
     loras: List[Tuple[str, float]],
     model_type: Literal["text_encoder", "unet"],
-):
+) -> Dict[str, np.ndarray]:
+    """
+    Compose the weights of one or more LoRAs, returning the combined delta for each base key.
+
+    The factors for every node are collected from all of the LoRAs first, then composed in batches.
+    """
     # always load to CPU for blending
     device = torch.device("cpu")
     dtype = torch.float32
 
-    base_model = base_name if isinstance(base_name, ModelProto) else load(base_name)
     lora_models = [load_tensor(name, map_location=device) for name, _weight in loras]
 
     if model_type == "text_encoder":
@@ -103,6 +284,11 @@ def blend_loras(
         lora_prefix = f"lora_{model_type}_"
 
     blended: Dict[str, np.ndarray] = {}
+    factors: Dict[str, List[Tuple[torch.Tensor, torch.Tensor, Tuple[int, ...]]]] = {}
+    products: List[
+        Tuple[str, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, float]
+    ] = []
+
     for (lora_name, lora_weight), lora_model in zip(loras, lora_models):
         logger.debug("blending LoRA from %s with weight of %s", lora_name, lora_weight)
         if lora_model is None:
@@ -138,7 +324,8 @@ def blend_loras(
                 t2_weight = lora_model.get(t2_key, None)
 
                 dim = w1b_weight.size()[0]
-                alpha = lora_model.get(alpha_key, dim).to(dtype).numpy()
+                alpha = float(lora_model.get(alpha_key, dim))
+                scale = lora_weight * alpha / dim
 
                 if t1_weight is not None and t2_weight is not None:
                     t1_weight = t1_weight.to(dtype=dtype)
@@ -165,29 +352,20 @@ def blend_loras(
                         w2b_weight,
                         w2a_weight,
                     )
-                    weights = weights_1 * weights_2
-                    np_weights = weights.numpy() * (alpha / dim)
-                else:
-                    logger.trace(
-                        "blending weights for LoHA node: (%s @ %s) * (%s @ %s)",
-                        w1a_weight.shape,
-                        w1b_weight.shape,
-                        w2a_weight.shape,
-                        w2b_weight.shape,
-                    )
-                    weights = (w1a_weight @ w1b_weight) * (w2a_weight @ w2b_weight)
-                    np_weights = weights.numpy() * (alpha / dim)
-
-                np_weights *= lora_weight
-                if base_key in blended:
-                    logger.trace(
-                        "summing LoHA weights: %s + %s",
-                        blended[base_key].shape,
-                        np_weights.shape,
+                    add_weights(
+                        blended, base_key, (weights_1 * weights_2).numpy() * scale
                     )
-                    blended[base_key] += sum_weights(blended[base_key], np_weights)
                 else:
-                    blended[base_key] = np_weights
+                    products.append(
+                        (
+                            base_key,
+                            w1a_weight,
+                            w1b_weight,
+                            w2a_weight,
+                            w2b_weight,
+                            scale,
+                        )
+                    )
             elif ".lora_down" in key and lora_prefix in key:
                 # LoRA or LoCON
                 base_key = key[: key.index(".lora_down")].replace(lora_prefix, "")
@@ -207,112 +385,48 @@ def blend_loras(
                     mid_weight = lora_model[mid_key].to(dtype=dtype)
 
                 dim = down_weight.size()[0]
-                alpha = lora_model.get(alpha_key, dim)
-
-                if not isinstance(alpha, int):
-                    alpha = alpha.to(dtype).numpy()
-
-                kernel = down_weight.shape[-2:]
-                if mid_weight is not None:
-                    kernel = mid_weight.shape[-2:]
-
-                if len(down_weight.size()) == 2:
-                    # blend for nn.Linear
-                    logger.trace(
-                        "blending weights for Linear node: (%s @ %s) * %s",
-                        down_weight.shape,
-                        up_weight.shape,
-                        alpha,
+                alpha = float(lora_model.get(alpha_key, dim))
+                scale = lora_weight * alpha / dim
+
+                lora_factors = get_lora_factors(down_weight, up_weight, mid_weight)
+                if lora_factors is not None:
+                    up_matrix, down_matrix, delta_shape = lora_factors
+                    factors.setdefault(base_key, []).append(
+                        (up_matrix * scale, down_matrix, delta_shape)
                     )
-                    weights = up_weight @ down_weight
-                    np_weights = weights.numpy() * (alpha / dim)
-                elif len(down_weight.size()) == 4 and kernel == (
-                    1,
-                    1,
+                elif (
+                    len(down_weight.size()) == 4
+                    and mid_weight is None
+                    and down_weight.shape[-2:] == (3, 3)
                 ):
-                    # blend for nn.Conv2d 1x1
-                    logger.trace(
-                        "blending weights for Conv 1x1 node: %s, %s, %s",
-                        down_weight.shape,
-                        up_weight.shape,
-                        alpha,
-                    )
-                    weights = (
-                        (
-                            up_weight.squeeze(3).squeeze(2)
-                            @ down_weight.squeeze(3).squeeze(2)
-                        )
-                        .unsqueeze(2)
-                        .unsqueeze(3)
+                    add_weights(
+                        blended,
+                        base_key,
+                        blend_conv_slices(down_weight, up_weight) * scale,
                     )
-                    np_weights = weights.numpy() * (alpha / dim)
-                elif len(down_weight.size()) == 4 and kernel == (
-                    3,
-                    3,
-                ):
-                    if mid_weight is not None:
-                        # blend for nn.Conv2d 3x3 with CP decomp
-                        logger.trace(
-                            "composing weights for Conv 3x3 node: %s, %s, %s, %s",
-                            down_weight.shape,
-                            up_weight.shape,
-                            mid_weight.shape,
-                            alpha,
-                        )
-                        weights = torch.zeros(
-                            (up_weight.shape[0], down_weight.shape[1], *kernel)
-                        )
-
-                        for w in range(kernel[0]):
-                            for h in range(kernel[1]):
-                                weights[:, :, w, h] = (
-                                    up_weight.squeeze(3).squeeze(2)
-                                    @ mid_weight[:, :, w, h]
-                                ) @ down_weight.squeeze(3).squeeze(2)
-
-                        np_weights = weights.numpy() * (alpha / dim)
-                    else:
-                        # blend for nn.Conv2d 3x3
-                        logger.trace(
-                            "blending weights for Conv 3x3 node: %s, %s, %s",
-                            down_weight.shape,
-                            up_weight.shape,
-                            alpha,
-                        )
-                        weights = torch.zeros(
-                            (up_weight.shape[0], down_weight.shape[1], *kernel)
-                        )
-
-                        for w in range(kernel[0]):
-                            for h in range(kernel[1]):
-                                down_w, down_h = kernel_slice(w, h, down_weight.shape)
-                                up_w, up_h = kernel_slice(w, h, up_weight.shape)
-
-                                weights[:, :, w, h] = (
-                                    up_weight[:, :, up_w, up_h]
-                                    @ down_weight[:, :, down_w, down_h]
-                                )
-
-                        np_weights = weights.numpy() * (alpha / dim)
                 else:
                     logger.warning(
                         "unknown LoRA node type at %s: %s",
                         base_key,
                         up_weight.shape[-2:],
                     )
-                    continue
 
-                np_weights *= lora_weight
-                if base_key in blended:
-                    logger.trace(
-                        "summing weights: %s + %s",
-                        blended[base_key].shape,
-                        np_weights.shape,
-                    )
-                    blended[base_key] = sum_weights(blended[base_key], np_weights)
-                else:
-                    blended[base_key] = np_weights
+    compose_lora_factors(blended, factors)
+    compose_loha_factors(blended, products)
+
+    return blended
 
+
+def blend_initializers(
+    base_model: ModelProto,
+    blended: Dict[str, np.ndarray],
+    get_weights: Callable[[str], np.ndarray],
+) -> Dict[str, np.ndarray]:
+    """
+    Find the initializers for each blended key and add the LoRA weights to them, returning the updated
+    initializers by name. The original weights are provided by `get_weights`, so the initializers in the
+    base model may have been moved to external data.
+    """
     logger.trace(
         "updating %s of %s initializers: %s",
         len(blended.keys()),
@@ -320,14 +434,24 @@ def blend_loras(
         list(blended.keys()),
     )
 
-    fixed_initializer_names = [
-        fix_initializer_name(node.name) for node in base_model.graph.initializer
-    ]
-    logger.trace("fixed initializer names: %s", fixed_initializer_names)
+    # index the graph once, keeping the first node for any duplicate names
+    fixed_initializers: Dict[str, TensorProto] = {}
+    for initializer in base_model.graph.initializer:
+        fixed_initializers.setdefault(
+            fix_initializer_name(initializer.name), initializer
+        )
+
+    fixed_nodes: Dict[str, NodeProto] = {}
+    for node in base_model.graph.node:
+        fixed_nodes.setdefault(fix_node_name(node.name), node)
 
-    fixed_node_names = [fix_node_name(node.name) for node in base_model.graph.node]
-    logger.trace("fixed node names: %s", fixed_node_names)
+    logger.trace(
+        "indexed %s initializers and %s nodes",
+        len(fixed_initializers),
+        len(fixed_nodes),
+    )
 
+    updated: Dict[str, np.ndarray] = {}
     unmatched_keys = []
     for base_key, weights in blended.items():
         conv_key = base_key + "_Conv"
@@ -337,20 +461,18 @@ def blend_loras(
         logger.trace(
             "key %s has conv: %s, matmul: %s",
             base_key,
-            conv_key in fixed_node_names,
-            matmul_key in fixed_node_names,
+            conv_key in fixed_nodes,
+            matmul_key in fixed_nodes,
         )
 
-        if conv_key in fixed_node_names or gemm_key in fixed_node_names:
-            if conv_key in fixed_node_names:
-                conv_idx = fixed_node_names.index(conv_key)
-                conv_node = base_model.graph.node[conv_idx]
+        if conv_key in fixed_nodes or gemm_key in fixed_nodes:
+            if conv_key in fixed_nodes:
+                conv_node = fixed_nodes[conv_key]
                 logger.trace(
                     "found conv node %s using %s", conv_node.name, conv_node.input
                 )
             else:
-                conv_idx = fixed_node_names.index(gemm_key)
-                conv_node = base_model.graph.node[conv_idx]
+                conv_node = fixed_nodes[gemm_key]
                 logger.trace(
                     "found gemm node %s using %s", conv_node.name, conv_node.input
                 )
@@ -359,12 +481,11 @@ def blend_loras(
             weight_name = [n for n in conv_node.input if ".weight" in n][0]
             weight_name = fix_initializer_name(weight_name)
 
-            weight_idx = fixed_initializer_names.index(weight_name)
-            weight_node = base_model.graph.initializer[weight_idx]
+            weight_node = fixed_initializers[weight_name]
             logger.trace("found weight initializer: %s", weight_node.name)
 
             # blending
-            onnx_weights = numpy_helper.to_array(weight_node)
+            onnx_weights = get_weights(weight_node.name)
             logger.trace(
                 "found blended weights for conv: %s, %s",
                 onnx_weights.shape,
@@ -373,11 +494,13 @@ def blend_loras(
 
             if onnx_weights.shape[-2:] == (1, 1):
                 if weights.shape[-2:] == (1, 1):
-                    blended = onnx_weights.squeeze((3, 2)) + weights.squeeze((3, 2))
+                    updated_weights = onnx_weights.squeeze((3, 2)) + weights.squeeze(
+                        (3, 2)
+                    )
                 else:
-                    blended = onnx_weights.squeeze((3, 2)) + weights
+                    updated_weights = onnx_weights.squeeze((3, 2)) + weights
 
-                blended = np.expand_dims(blended, (2, 3))
+                updated_weights = np.expand_dims(updated_weights, (2, 3))
             else:
                 if onnx_weights.shape != weights.shape:
                     logger.warning(
@@ -385,21 +508,14 @@ def blend_loras(
                         onnx_weights.shape,
                         weights.shape,
                     )
-                    blended = onnx_weights + weights.reshape(onnx_weights.shape)
+                    updated_weights = onnx_weights + weights.reshape(onnx_weights.shape)
                 else:
-                    blended = onnx_weights + weights
+                    updated_weights = onnx_weights + weights
 
-            logger.trace("blended weight shape: %s", blended.shape)
-
-            # replace the original initializer
-            updated_node = numpy_helper.from_array(
-                blended.astype(onnx_weights.dtype), weight_node.name
-            )
-            del base_model.graph.initializer[weight_idx]
-            base_model.graph.initializer.insert(weight_idx, updated_node)
-        elif matmul_key in fixed_node_names:
-            weight_idx = fixed_node_names.index(matmul_key)
-            weight_node = base_model.graph.node[weight_idx]
+            logger.trace("blended weight shape: %s", updated_weights.shape)
+            updated[weight_node.name] = updated_weights.astype(onnx_weights.dtype)
+        elif matmul_key in fixed_nodes:
+            weight_node = fixed_nodes[matmul_key]
             logger.trace(
                 "found matmul node %s using %s", weight_node.name, weight_node.input
             )
@@ -407,44 +523,107 @@ def blend_loras(
             # find the MatMul initializer
             matmul_name = [n for n in weight_node.input if "MatMul" in n][0]
 
-            matmul_idx = fixed_initializer_names.index(matmul_name)
-            matmul_node = base_model.graph.initializer[matmul_idx]
+            matmul_node = fixed_initializers[matmul_name]
             logger.trace("found matmul initializer: %s", matmul_node.name)
 
             # blending
-            onnx_weights = numpy_helper.to_array(matmul_node)
+            onnx_weights = get_weights(matmul_node.name)
             logger.trace(
                 "found blended weights for matmul: %s, %s",
                 weights.shape,
                 onnx_weights.shape,
             )
 
-            blended = onnx_weights + weights.transpose()
-            logger.trace("blended weight shape: %s", blended.shape)
-
-            # replace the original initializer
-            updated_node = numpy_helper.from_array(
-                blended.astype(onnx_weights.dtype), matmul_node.name
-            )
-            del base_model.graph.initializer[matmul_idx]
-            base_model.graph.initializer.insert(matmul_idx, updated_node)
+            updated_weights = onnx_weights + weights.transpose()
+            logger.trace("blended weight shape: %s", updated_weights.shape)
+            updated[matmul_node.name] = updated_weights.astype(onnx_weights.dtype)
         else:
             unmatched_keys.append(base_key)
 
+    if len(unmatched_keys) > 0:
+        logger.warning("could not find nodes for some keys: %s", unmatched_keys)
+
+    return updated
+
+
+def blend_loras(
+    _conversion: ServerContext,
+    base_name: Union[str, ModelProto],
+    loras: List[Tuple[str, float]],
+    model_type: Literal["text_encoder", "unet"],
+):
+    base_model = base_name if isinstance(base_name, ModelProto) else load(base_name)
+    blended = blend_lora_weights(loras, model_type)
+
+    initializers = {node.name: node for node in base_model.graph.initializer}
+
+    def get_weights(name: str) -> np.ndarray:
+        return numpy_helper.to_array(initializers[name])
+
+    updated = blend_initializers(base_model, blended, get_weights)
+
+    # replace the original initializers in place
+    for name, weights in updated.items():
+        initializers[name].CopyFrom(numpy_helper.from_array(weights, name))
+
     logger.debug(
-        "node counts: %s -> %s, %s -> %s",
-        len(fixed_initializer_names),
+        "updated %s of %s initializers",
+        len(updated),
         len(base_model.graph.initializer),
-        len(fixed_node_names),
-        len(base_model.graph.node),
     )
 
-    if len(unmatched_keys) > 0:
-        logger.warning("could not find nodes for some keys: %s", unmatched_keys)
-
     return base_model
 
 
+class LoraBase:
+    """
+    Base model for incremental LoRA blending. The initializers are kept in memory and shared between
+    sessions, so only the initializers affected by each set of LoRAs need to be blended.
+    """
+
+    model: ModelProto
+    model_bytes: bytes
+    arrays: Dict[str, np.ndarray]
+    values: Dict[str, OrtValue]
+
+    def __init__(self, base_name: Union[str, ModelProto]) -> None:
+        base_model = base_name if isinstance(base_name, ModelProto) else load(base_name)
+        (self.model, external_data) = buffer_external_data_arrays(base_model)
+        self.model_bytes = self.model.SerializeToString()
+        self.arrays = dict(external_data)
+        self.values = {
+            name: OrtValue.ortvalue_from_numpy(npt) for name, npt in external_data
+        }
+
+
+def blend_loras_incremental(
+    _conversion: ServerContext,
+    base: LoraBase,
+    loras: List[Tuple[str, float]],
+    model_type: Literal["text_encoder", "unet"],
+) -> Tuple[List[Tuple[str, OrtValue]], int]:
+    """
+    Blend LoRAs with a resident base model, returning the external initializers for a new session,
+    reusing the base values for any initializer that was not changed, and the size of the changed ones.
+    """
+    blended = blend_lora_weights(loras, model_type)
+    updated = blend_initializers(base.model, blended, base.arrays.__getitem__)
+    logger.debug(
+        "updating %s of %s initializers for incremental blending",
+        len(updated),
+        len(base.values),
+    )
+
+    external_data = []
+    for name, value in base.values.items():
+        if name in updated:
+            external_data.append((name, OrtValue.ortvalue_from_numpy(updated[name])))
+        else:
+            external_data.append((name, value))
+
+    return (external_data, sum(npt.nbytes for npt in updated.values()))
+
+
 if __name__ == "__main__":
     context = ConversionContext.from_environ()
     parser = ArgumentParser()
@@ -98,8 +98,8 @@ def convert_upscaling_swinir(
     input_names = ["input"]
     output_names = ["output"]
     dynamic_axes = {
-        "input": {2: "h", 3: "w"},
-        "output": {2: "h", 3: "w"},
+        "input": {0: "batch", 2: "h", 3: "w"},
+        "output": {0: "batch", 2: "h", 3: "w"},
     }
 
     logger.info("exporting ONNX model to %s", dest)
@@ -0,0 +1,220 @@
+from hashlib import sha256
+from logging import getLogger
+from os import getpid, listdir, makedirs, path, rename, scandir, utime
+from shutil import rmtree
+from typing import List, Optional, Tuple
+
+from onnx import ModelProto, TensorProto
+from transformers import CLIPTokenizer
+
+from ..constants import ONNX_MODEL, ONNX_WEIGHTS
+from ..convert.utils import resolve_tensor
+from ..server import ServerContext
+from ..server.hash_index import get_hash_index
+from ..torch_before_ort import OrtValue
+
+logger = getLogger(__name__)
+
+BLEND_CACHE_DIR = "blend"
+BLEND_CACHE_VERSION = 1
+BLEND_TOKENIZER_DIR = "tokenizer"
+EXTERNAL_DATA_ALIGNMENT = (
+    2**16
+)  # allocation granularity on Windows, a multiple of the page size elsewhere
+
+
+def get_blend_root(server: ServerContext) -> str:
+    return path.join(server.cache_path, BLEND_CACHE_DIR)
+
+
+def hash_base_model(sha, model_path: str) -> None:
+    """
+    Fingerprint the base model files by name, size, and modification time, since hashing the full
+    UNet weights would take longer than blending them.
+    """
+    if not path.isdir(model_path):
+        sha.update(model_path.encode("utf-8"))
+        return
+
+    for name in sorted(listdir(model_path)):
+        stat = stat_file(path.join(model_path, name))
+        if stat is not None:
+            sha.update(f"{name}:{stat[0]}:{stat[1]}".encode("utf-8"))
+
+
+def stat_file(file: str) -> Optional[Tuple[int, int]]:
+    if not path.isfile(file):
+        return None
+
+    return (path.getsize(file), int(path.getmtime(file)))
+
+
+def hash_network(server: ServerContext, network_path: str) -> str:
+    tensor_path = resolve_tensor(network_path)
+    if tensor_path is None:
+        if path.isfile(network_path):
+            tensor_path = network_path
+        else:
+            logger.warning("unable to find network to hash: %s", network_path)
+            return "missing"
+
+    return get_hash_index(server).hash(tensor_path)
+
+
+def get_blend_key(
+    server: ServerContext,
+    model_path: str,
+    inversions: Optional[List[Tuple[str, float]]] = None,
+    loras: Optional[List[Tuple[str, float]]] = None,
+) -> str:
+    """
+    Build a content-addressed key for a blended model from the base model and the hashes and weights
+    of each additional network.
+    """
+    sha = sha256()
+    sha.update(f"v{BLEND_CACHE_VERSION}".encode("utf-8"))
+    hash_base_model(sha, model_path)
+
+    for name, weight in inversions or []:
+        inversion_hash = hash_network(
+            server, path.join(server.model_path, "inversion", name)
+        )
+        sha.update(f"inversion:{name}:{inversion_hash}:{weight}".encode("utf-8"))
+
+    for name, weight in loras or []:
+        lora_hash = hash_network(server, path.join(server.model_path, "lora", name))
+        sha.update(f"lora:{lora_hash}:{weight}".encode("utf-8"))
+
+    return sha.hexdigest()
+
+
+def load_blend_cache(server: ServerContext, key: str) -> Optional[str]:
+    """
+    Find a previously blended model in the cache, returning the path to its directory.
+    """
+    blend_path = path.join(get_blend_root(server), key)
+    if not path.exists(path.join(blend_path, ONNX_MODEL)):
+        logger.debug("blended model not found in cache: %s", key)
+        return None
+
+    # update the access time for LRU eviction
+    utime(blend_path)
+    logger.debug("found blended model in cache: %s", blend_path)
+    return blend_path
+
+
+def write_external_data(
+    model: ModelProto,
+    external_data: List[Tuple[str, OrtValue]],
+    model_path: str,
+) -> None:
+    """
+    Write initializers that have been buffered with `buffer_external_data_tensors` into a single
+    external data file next to the model, aligning each one so it can be mapped into memory.
+
+    The buffered values are not modified, so the model can still be loaded from memory if writing fails.
+    """
+    offsets = {}
+    with open(path.join(model_path, ONNX_WEIGHTS), "wb") as f:
+        for name, value in external_data:
+            data = value.numpy().tobytes()
+            padding = -f.tell() % EXTERNAL_DATA_ALIGNMENT
+            f.write(b"\0" * padding)
+            offsets[name] = (f.tell(), len(data))
+            f.write(data)
+
+    for tensor in model.graph.initializer:
+        if tensor.name in offsets:
+            offset, length = offsets[tensor.name]
+            del tensor.external_data[:]
+            tensor.data_location = TensorProto.EXTERNAL
+            for key, value in [
+                ("location", ONNX_WEIGHTS),
+                ("offset", offset),
+                ("length", length),
+            ]:
+                entry = tensor.external_data.add()
+                entry.key = key
+                entry.value = str(value)
+
+    with open(path.join(model_path, ONNX_MODEL), "wb") as f:
+        f.write(model.SerializeToString())
+
+
+def save_blend_cache(
+    server: ServerContext,
+    key: str,
+    model: ModelProto,
+    external_data: List[Tuple[str, OrtValue]],
+    tokenizer: Optional[CLIPTokenizer] = None,
+) -> Optional[str]:
+    """
+    Save a blended model to the cache, with its initializers in a single external data file, so later
+    loads can map the weights directly from disk.
+    """
+    blend_root = get_blend_root(server)
+    blend_path = path.join(blend_root, key)
+    temp_path = path.join(blend_root, f".{key}-{getpid()}")
+
+    try:
+        makedirs(temp_path, exist_ok=True)
+        write_external_data(model, external_data, temp_path)
+
+        if tokenizer is not None:
+            tokenizer.save_pretrained(path.join(temp_path, BLEND_TOKENIZER_DIR))
+
+        # another worker may have saved the same blend in the meantime
+        if path.exists(blend_path):
+            logger.debug("blended model was already cached: %s", key)
+            rmtree(temp_path, ignore_errors=True)
+        else:
+            rename(temp_path, blend_path)
+            logger.info("saved blended model to cache: %s", blend_path)
+    except Exception:
+        logger.exception("error saving blended model to cache")
+        rmtree(temp_path, ignore_errors=True)
+        return None
+
+    prune_blend_cache(server, keep=key)
+    return blend_path
+
+
+def get_dir_size(dir_path: str) -> int:
+    return sum(
+        entry.stat().st_size for entry in scandir(dir_path) if entry.is_file()
+    ) + sum(get_dir_size(entry.path) for entry in scandir(dir_path) if entry.is_dir())
+
+
+def prune_blend_cache(server: ServerContext, keep: Optional[str] = None) -> int:
+    """
+    Remove the least recently used blends until the cache is under the size limit.
+    """
+    blend_root = get_blend_root(server)
+    if not path.exists(blend_root):
+        return 0
+
+    entries = []
+    for entry in scandir(blend_root):
+        if entry.is_dir() and not entry.name.startswith("."):
+            entries.append(
+                (entry.stat().st_mtime, entry.name, get_dir_size(entry.path))
+            )
+
+    entries.sort()
+    total = sum(size for _mtime, _name, size in entries)
+    removed = 0
+
+    for _mtime, name, size in entries:
+        if total <= server.blend_cache_limit:
+            break
+
+        if name == keep:
+            continue
+
+        logger.info("removing blended model from cache: %s, %s bytes", name, size)
+        rmtree(path.join(blend_root, name), ignore_errors=True)
+        total -= size
+        removed += 1
+
+    logger.debug("blend cache is using %s of %s bytes", total, server.blend_cache_limit)
+    return removed
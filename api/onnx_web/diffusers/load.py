@@ -1,18 +1,39 @@
+from copy import copy
 from logging import getLogger
 from os import path
-from typing import Any, List, Optional, Tuple
+from time import perf_counter
+from typing import Any, List, Literal, Optional, Tuple
 
-from onnx import load_model
+from onnx import ModelProto, load_model
 from transformers import CLIPTokenizer
 
 from ..constants import ONNX_MODEL
-from ..convert.diffusion.lora import blend_loras, buffer_external_data_tensors
+from ..convert.diffusion.lora import (
+    LoraBase,
+    blend_loras,
+    blend_loras_incremental,
+    buffer_external_data_tensors,
+)
 from ..convert.diffusion.textual_inversion import blend_textual_inversions
 from ..diffusers.pipelines.upscale import OnnxStableDiffusionUpscalePipeline
 from ..diffusers.utils import expand_prompt
 from ..params import DeviceParams, ImageParams
 from ..server import ServerContext
+from ..server.model_cache import freeze_key, measure_model_size
 from ..utils import run_gc
+from .blend_cache import (
+    BLEND_TOKENIZER_DIR,
+    get_blend_key,
+    load_blend_cache,
+    save_blend_cache,
+)
+from .numpy_schedulers import (
+    NumpyDDIMScheduler,
+    NumpyDPMSolverMultistepScheduler,
+    NumpyEulerAncestralDiscreteScheduler,
+    NumpyEulerDiscreteScheduler,
+    NumpyUniPCMultistepScheduler,
+)
 from .patches.unet import UNetWrapper
 from .patches.vae import VAEWrapper
 from .pipelines.controlnet import OnnxStableDiffusionControlNetPipeline
@@ -73,6 +94,15 @@ pipeline_schedulers = {
     "unipc-multi": UniPCMultistepScheduler,
 }
 
+# run the per-step math with numpy instead of torch when the numpy-schedulers optimization is set
+numpy_schedulers = {
+    "ddim": NumpyDDIMScheduler,
+    "dpm-multi": NumpyDPMSolverMultistepScheduler,
+    "euler": NumpyEulerDiscreteScheduler,
+    "euler-a": NumpyEulerAncestralDiscreteScheduler,
+    "unipc-multi": NumpyUniPCMultistepScheduler,
+}
+
 
 def get_available_pipelines() -> List[str]:
     return list(available_pipelines.keys())
@@ -87,9 +117,20 @@ def get_scheduler_name(scheduler: Any) -> Optional[str]:
         if scheduler == v or scheduler == v.__name__:
             return k
 
+    for k, v in numpy_schedulers.items():
+        if scheduler == v or scheduler == v.__name__:
+            return k
+
     return None
 
 
+def get_scheduler_type(server: ServerContext, scheduler: str) -> Any:
+    if scheduler in numpy_schedulers and "numpy-schedulers" in server.optimizations:
+        return numpy_schedulers[scheduler]
+
+    return pipeline_schedulers[scheduler]
+
+
 def load_pipeline(
     server: ServerContext,
     params: ImageParams,
@@ -117,9 +158,24 @@ def load_pipeline(
         loras,
     )
     scheduler_key = (params.scheduler, model)
-    scheduler_type = pipeline_schedulers[params.scheduler]
+    scheduler_type = get_scheduler_type(server, params.scheduler)
+    unet_type = (
+        "cnet" if pipeline == "controlnet" and params.control is not None else "unet"
+    )
+    incremental = "onnx-incremental-lora" in server.optimizations and len(loras) > 0
 
+    load_start = perf_counter()
     cache_pipe = server.cache.get("diffusion", pipe_key)
+    cache_state = "miss" if cache_pipe is None else "hit"
+
+    if cache_pipe is None and incremental:
+        cache_pipe = load_incremental_pipeline(
+            server, device, pipe_key, unet_type, inversions, loras, torch_dtype
+        )
+        if cache_pipe is not None:
+            cache_scheduler = server.cache.get("scheduler", scheduler_key)
+            if cache_scheduler is not None:
+                cache_pipe.scheduler = cache_scheduler
 
     if cache_pipe is not None:
         logger.debug("reusing existing diffusion pipeline")
@@ -162,7 +218,9 @@ def load_pipeline(
 
         # shared components
         text_encoder = None
-        unet_type = "unet"
+
+        # initializers passed to sessions as external data are not part of the session models
+        external_size = 0
 
         # ControlNet component
         if pipeline == "controlnet" and params.control is not None:
@@ -178,102 +236,125 @@ def load_pipeline(
                 )
             )
 
-            unet_type = "cnet"
+        # check the blend cache before blending any additional networks
+        text_encoder_key = None
+        text_encoder_cache = None
+        unet_key = None
+        unet_cache = None
+
+        if server.blend_cache_limit > 0 and not incremental:
+            if len(inversions) > 0 or len(loras) > 0:
+                text_encoder_key = get_blend_key(
+                    server,
+                    path.join(model, "text_encoder"),
+                    inversions=inversions,
+                    loras=loras,
+                )
+                text_encoder_cache = load_blend_cache(server, text_encoder_key)
 
-        # Textual Inversion blending
-        if inversions is not None and len(inversions) > 0:
-            logger.debug("blending Textual Inversions from %s", inversions)
-            inversion_names, inversion_weights = zip(*inversions)
+            if len(loras) > 0:
+                unet_key = get_blend_key(
+                    server, path.join(model, unet_type), loras=loras
+                )
+                unet_cache = load_blend_cache(server, unet_key)
 
-            inversion_models = [
-                path.join(server.model_path, "inversion", name)
-                for name in inversion_names
-            ]
-            text_encoder = load_model(path.join(model, "text_encoder", ONNX_MODEL))
-            tokenizer = CLIPTokenizer.from_pretrained(
-                model,
-                subfolder="tokenizer",
-                torch_dtype=torch_dtype,
+        if incremental:
+            text_encoder_base, tokenizer = load_lora_base(
+                server, model, "text_encoder", inversions, torch_dtype
             )
-            text_encoder, tokenizer = blend_textual_inversions(
-                server,
-                text_encoder,
-                tokenizer,
-                list(
-                    zip(
-                        inversion_models,
-                        inversion_weights,
-                        inversion_names,
-                        [None] * len(inversion_models),
-                    )
-                ),
+            if tokenizer is not None:
+                components["tokenizer"] = tokenizer
+
+            logger.info("blending text encoder with LoRA models: %s", loras)
+            components["text_encoder"], text_encoder_size = load_incremental_model(
+                server, device, text_encoder_base, loras, "text_encoder"
             )
+            external_size += text_encoder_size
+        elif text_encoder_cache is not None:
+            logger.debug("loading blended text encoder from %s", text_encoder_cache)
+            if len(inversions) > 0:
+                components["tokenizer"] = CLIPTokenizer.from_pretrained(
+                    text_encoder_cache,
+                    subfolder=BLEND_TOKENIZER_DIR,
+                    torch_dtype=torch_dtype,
+                )
 
-            components["tokenizer"] = tokenizer
+            components["text_encoder"] = OnnxRuntimeModel(
+                OnnxRuntimeModel.load_model(
+                    path.join(text_encoder_cache, ONNX_MODEL),
+                    provider=device.ort_provider("text-encoder"),
+                    sess_options=device.sess_options(),
+                )
+            )
+        else:
+            tokenizer = None
 
-            # should be pretty small and should not need external data
-            if loras is None or len(loras) == 0:
-                components["text_encoder"] = OnnxRuntimeModel(
-                    OnnxRuntimeModel.load_model(
-                        text_encoder.SerializeToString(),
-                        provider=device.ort_provider("text-encoder"),
-                        sess_options=device.sess_options(),
-                    )
+            # Textual Inversion blending
+            if len(inversions) > 0:
+                text_encoder, tokenizer = blend_text_encoder_inversions(
+                    server, model, inversions, torch_dtype
                 )
+                components["tokenizer"] = tokenizer
 
-        # LoRA blending
-        if loras is not None and len(loras) > 0:
-            lora_names, lora_weights = zip(*loras)
-            lora_models = [
-                path.join(server.model_path, "lora", name) for name in lora_names
-            ]
-            logger.info(
-                "blending base model %s with LoRA models: %s", model, lora_models
-            )
+            # LoRA blending
+            if len(loras) > 0:
+                logger.info("blending text encoder with LoRA models: %s", loras)
+                text_encoder = text_encoder or path.join(
+                    model, "text_encoder", ONNX_MODEL
+                )
+                text_encoder = blend_loras(
+                    server,
+                    text_encoder,
+                    get_lora_models(server, loras),
+                    "text_encoder",
+                )
 
-            # blend and load text encoder
-            text_encoder = text_encoder or path.join(model, "text_encoder", ONNX_MODEL)
-            text_encoder = blend_loras(
-                server,
-                text_encoder,
-                list(zip(lora_models, lora_weights)),
-                "text_encoder",
-            )
-            (text_encoder, text_encoder_data) = buffer_external_data_tensors(
-                text_encoder
+            if text_encoder is not None:
+                components["text_encoder"], text_encoder_size = load_blended_model(
+                    server,
+                    device,
+                    text_encoder,
+                    "text-encoder",
+                    cache_key=text_encoder_key,
+                    tokenizer=tokenizer,
+                )
+                external_size += text_encoder_size
+
+        if incremental:
+            unet_base, _tokenizer = load_lora_base(
+                server, model, unet_type, [], torch_dtype
             )
-            text_encoder_names, text_encoder_values = zip(*text_encoder_data)
-            text_encoder_opts = device.sess_options(cache=False)
-            text_encoder_opts.add_external_initializers(
-                list(text_encoder_names), list(text_encoder_values)
+
+            logger.info("blending base model %s with LoRA models: %s", model, loras)
+            components["unet"], unet_size = load_incremental_model(
+                server, device, unet_base, loras, "unet"
             )
-            components["text_encoder"] = OnnxRuntimeModel(
+            external_size += unet_size
+        elif unet_cache is not None:
+            logger.debug("loading blended UNet from %s", unet_cache)
+            components["unet"] = OnnxRuntimeModel(
                 OnnxRuntimeModel.load_model(
-                    text_encoder.SerializeToString(),
-                    provider=device.ort_provider("text-encoder"),
-                    sess_options=text_encoder_opts,
+                    path.join(unet_cache, ONNX_MODEL),
+                    provider=device.ort_provider("unet"),
+                    sess_options=device.sess_options(),
                 )
             )
-
-            # blend and load unet
-            unet = path.join(model, unet_type, ONNX_MODEL)
+        elif len(loras) > 0:
+            logger.info("blending base model %s with LoRA models: %s", model, loras)
             blended_unet = blend_loras(
                 server,
-                unet,
-                list(zip(lora_models, lora_weights)),
+                path.join(model, unet_type, ONNX_MODEL),
+                get_lora_models(server, loras),
                 "unet",
             )
-            (unet_model, unet_data) = buffer_external_data_tensors(blended_unet)
-            unet_names, unet_values = zip(*unet_data)
-            unet_opts = device.sess_options(cache=False)
-            unet_opts.add_external_initializers(list(unet_names), list(unet_values))
-            components["unet"] = OnnxRuntimeModel(
-                OnnxRuntimeModel.load_model(
-                    unet_model.SerializeToString(),
-                    provider=device.ort_provider("unet"),
-                    sess_options=unet_opts,
-                )
+            components["unet"], unet_size = load_blended_model(
+                server,
+                device,
+                blended_unet,
+                "unet",
+                cache_key=unet_key,
             )
+            external_size += unet_size
 
         # make sure a UNet has been loaded
         if "unet" not in components:
@@ -342,7 +423,12 @@ def load_pipeline(
         optimize_pipeline(server, pipe)
         patch_pipeline(server, pipe, pipeline, pipeline_class, params)
 
-        server.cache.set("diffusion", pipe_key, pipe)
+        server.cache.set(
+            "diffusion",
+            pipe_key,
+            pipe,
+            size=measure_model_size(pipe) + external_size,
+        )
         server.cache.set("scheduler", scheduler_key, components["scheduler"])
 
     if hasattr(pipe, "vae_decoder"):
@@ -350,17 +436,230 @@ def load_pipeline(
     if hasattr(pipe, "vae_encoder"):
         pipe.vae_encoder.set_tiled(tiled=params.tiled_vae)
 
+    # prompt embeddings depend on the networks that have been blended into the text encoder
+    pipe.prompt_cache = server.prompt_cache
+    pipe.text_encoder_key = freeze_key(
+        (model, device.device, device.provider, inversions, loras)
+    )
+
     # update panorama params
     if pipeline == "panorama":
         latent_window = params.tiles // 8
         latent_stride = params.stride // 8
 
         pipe.set_window_size(latent_window, latent_stride)
+        pipe.set_view_batch(server.view_batch_pixels)
         if hasattr(pipe, "vae_decoder"):
             pipe.vae_decoder.set_window_size(latent_window, params.overlap)
         if hasattr(pipe, "vae_encoder"):
             pipe.vae_encoder.set_window_size(latent_window, params.overlap)
 
+    server.timings.record(
+        "load_pipeline", (pipeline, cache_state), perf_counter() - load_start
+    )
+    return pipe
+
+
+def get_lora_models(
+    server: ServerContext, loras: List[Tuple[str, float]]
+) -> List[Tuple[str, float]]:
+    return [
+        (path.join(server.model_path, "lora", name), weight) for name, weight in loras
+    ]
+
+
+def load_blended_model(
+    server: ServerContext,
+    device: DeviceParams,
+    model: ModelProto,
+    model_type: str,
+    cache_key: Optional[str] = None,
+    tokenizer: Optional[CLIPTokenizer] = None,
+) -> Tuple[OnnxRuntimeModel, int]:
+    """
+    Load a blended model, from the blend cache if it can be saved there, or from memory otherwise.
+
+    Returns the model and the size of the external data that was loaded from memory.
+    """
+    (bare_model, external_data) = buffer_external_data_tensors(model)
+
+    if cache_key is not None:
+        cache_path = save_blend_cache(
+            server, cache_key, bare_model, external_data, tokenizer=tokenizer
+        )
+        if cache_path is not None:
+            logger.debug("loading blended %s from %s", model_type, cache_path)
+            return (
+                OnnxRuntimeModel(
+                    OnnxRuntimeModel.load_model(
+                        path.join(cache_path, ONNX_MODEL),
+                        provider=device.ort_provider(model_type),
+                        sess_options=device.sess_options(),
+                    )
+                ),
+                0,
+            )
+
+    external_names, external_values = zip(*external_data)
+    external_opts = device.sess_options(cache=False)
+    external_opts.add_external_initializers(list(external_names), list(external_values))
+    return (
+        OnnxRuntimeModel(
+            OnnxRuntimeModel.load_model(
+                bare_model.SerializeToString(),
+                provider=device.ort_provider(model_type),
+                sess_options=external_opts,
+            )
+        ),
+        measure_model_size(external_values),
+    )
+
+
+def blend_text_encoder_inversions(
+    server: ServerContext,
+    model: str,
+    inversions: List[Tuple[str, float]],
+    torch_dtype: Any,
+) -> Tuple[ModelProto, CLIPTokenizer]:
+    logger.debug("blending Textual Inversions from %s", inversions)
+    inversion_names, inversion_weights = zip(*inversions)
+
+    inversion_models = [
+        path.join(server.model_path, "inversion", name) for name in inversion_names
+    ]
+    text_encoder = load_model(path.join(model, "text_encoder", ONNX_MODEL))
+    tokenizer = CLIPTokenizer.from_pretrained(
+        model,
+        subfolder="tokenizer",
+        torch_dtype=torch_dtype,
+    )
+    return blend_textual_inversions(
+        server,
+        text_encoder,
+        tokenizer,
+        list(
+            zip(
+                inversion_models,
+                inversion_weights,
+                inversion_names,
+                [None] * len(inversion_models),
+            )
+        ),
+    )
+
+
+def load_lora_base(
+    server: ServerContext,
+    model: str,
+    model_dir: str,
+    inversions: List[Tuple[str, float]],
+    torch_dtype: Any,
+) -> Tuple[LoraBase, Optional[CLIPTokenizer]]:
+    """
+    Load a base model for incremental LoRA blending, with any Textual Inversions already blended in,
+    and keep its initializers in the model cache.
+    """
+    base_key = (model, model_dir, inversions)
+    cache_base = server.cache.get("lora-base", base_key)
+    if cache_base is not None:
+        return cache_base
+
+    tokenizer = None
+    if len(inversions) > 0:
+        base_model, tokenizer = blend_text_encoder_inversions(
+            server, model, inversions, torch_dtype
+        )
+    else:
+        base_model = path.join(model, model_dir, ONNX_MODEL)
+
+    logger.debug("loading base model for incremental LoRA blending: %s", base_key)
+    base = LoraBase(base_model)
+    server.cache.set(
+        "lora-base",
+        base_key,
+        (base, tokenizer),
+        size=len(base.model_bytes) + measure_model_size(list(base.arrays.values())),
+    )
+    return (base, tokenizer)
+
+
+def load_incremental_model(
+    server: ServerContext,
+    device: DeviceParams,
+    base: LoraBase,
+    loras: List[Tuple[str, float]],
+    model_type: Literal["text_encoder", "unet"],
+) -> Tuple[OnnxRuntimeModel, int]:
+    """
+    Blend LoRAs with a resident base model and load a session that shares the unchanged initializers.
+
+    Returns the model and the size of the initializers that were changed.
+    """
+    external_data, updated_size = blend_loras_incremental(
+        server, base, get_lora_models(server, loras), model_type
+    )
+
+    external_names, external_values = zip(*external_data)
+    external_opts = device.sess_options(cache=False)
+    external_opts.add_external_initializers(list(external_names), list(external_values))
+    return (
+        OnnxRuntimeModel(
+            OnnxRuntimeModel.load_model(
+                base.model_bytes,
+                provider=device.ort_provider(model_type.replace("_", "-")),
+                sess_options=external_opts,
+            )
+        ),
+        updated_size,
+    )
+
+
+def load_incremental_pipeline(
+    server: ServerContext,
+    device: DeviceParams,
+    pipe_key: Tuple,
+    unet_type: str,
+    inversions: List[Tuple[str, float]],
+    loras: List[Tuple[str, float]],
+    torch_dtype: Any,
+) -> Optional[StableDiffusionPipeline]:
+    """
+    Create a pipeline for a new set of LoRAs from a cached pipeline for the same model, blending a new
+    text encoder and UNet while reusing the other components.
+    """
+    base_key = freeze_key(pipe_key[:-1])
+    base_pipe = server.cache.find("diffusion", lambda key: key[:-1] == base_key)
+    if base_pipe is None:
+        logger.debug("no cached pipeline found for incremental LoRA blending")
+        return None
+
+    model = pipe_key[1]
+    logger.info("blending cached pipeline for %s with LoRA models: %s", model, loras)
+
+    text_encoder_base, _tokenizer = load_lora_base(
+        server, model, "text_encoder", inversions, torch_dtype
+    )
+    text_encoder, text_encoder_size = load_incremental_model(
+        server, device, text_encoder_base, loras, "text_encoder"
+    )
+
+    unet_base, _tokenizer = load_lora_base(server, model, unet_type, [], torch_dtype)
+    unet, unet_size = load_incremental_model(server, device, unet_base, loras, "unet")
+
+    # the VAE, scheduler, and tokenizer are shared with the cached pipeline
+    pipe = copy(base_pipe)
+    pipe.text_encoder = text_encoder
+    pipe.unet = UNetWrapper(server, unet)
+
+    if "_encode_prompt" in base_pipe.__dict__:
+        pipe._encode_prompt = expand_prompt.__get__(pipe, type(pipe))
+
+    server.cache.set(
+        "diffusion",
+        pipe_key,
+        pipe,
+        size=measure_model_size([text_encoder, unet]) + text_encoder_size + unet_size,
+    )
     return pipe
 
 
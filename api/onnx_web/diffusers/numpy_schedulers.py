@@ -0,0 +1,866 @@
+from logging import getLogger
+from typing import Any, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+from diffusers.schedulers.scheduling_ddim import DDIMSchedulerOutput
+from diffusers.schedulers.scheduling_euler_ancestral_discrete import (
+    EulerAncestralDiscreteSchedulerOutput,
+)
+from diffusers.schedulers.scheduling_euler_discrete import (
+    EulerDiscreteSchedulerOutput,
+)
+from diffusers.schedulers.scheduling_utils import SchedulerOutput
+from diffusers.utils import randn_tensor
+
+from .version_safe_diffusers import (
+    DDIMScheduler,
+    DPMSolverMultistepScheduler,
+    EulerAncestralDiscreteScheduler,
+    EulerDiscreteScheduler,
+    UniPCMultistepScheduler,
+)
+
+logger = getLogger(__name__)
+
+Sample = Union[np.ndarray, torch.Tensor]
+
+
+def to_numpy(value: Any) -> np.ndarray:
+    if isinstance(value, torch.Tensor):
+        return value.cpu().numpy()
+
+    return np.asarray(value)
+
+
+def like_input(value: np.ndarray, like: Any) -> Sample:
+    """
+    Return the results in the same type as the inputs, so the pipelines that wrap their latents in tensors
+    can keep unwrapping them. Both conversions share memory with the array.
+    """
+    if isinstance(like, torch.Tensor):
+        return torch.from_numpy(np.ascontiguousarray(value))
+
+    return value
+
+
+def randn_numpy(
+    shape: Tuple[int, ...], dtype: Any, generator: Any = None
+) -> np.ndarray:
+    if generator is None:
+        return np.random.standard_normal(shape).astype(dtype)
+
+    if isinstance(generator, (np.random.Generator, np.random.RandomState)):
+        return generator.standard_normal(shape).astype(dtype)
+
+    # draw from torch generators the same way diffusers does, so seeds produce the same images
+    return (
+        randn_tensor(shape, generator=generator, dtype=torch.float32)
+        .numpy()
+        .astype(dtype)
+    )
+
+
+def broadcast_to_sample(values: np.ndarray, sample: np.ndarray) -> np.ndarray:
+    values = values.flatten()
+    return values.reshape(values.shape + (1,) * (sample.ndim - 1))
+
+
+class NumpySchedulerMixin:
+    """
+    Run the per-step math of a diffusers scheduler with numpy. The timesteps are still calculated by the
+    original scheduler, once per job, and copied into arrays that are used for each step.
+    """
+
+    np_timesteps: np.ndarray
+    np_alphas_cumprod: np.ndarray
+
+    def set_timesteps(self, num_inference_steps: int, device: Any = None) -> None:
+        super().set_timesteps(num_inference_steps, device=device)
+        self.np_timesteps = to_numpy(self.timesteps)
+        self.np_alphas_cumprod = to_numpy(self.alphas_cumprod).astype(np.float32)
+
+    def get_step_index(self, timestep: Any) -> Optional[int]:
+        step_index = np.flatnonzero(self.np_timesteps == to_numpy(timestep))
+        if len(step_index) == 0:
+            return None
+
+        return int(step_index[0])
+
+    def threshold_sample(self, sample: np.ndarray) -> np.ndarray:
+        dtype = sample.dtype
+        batch_size, channels, height, width = sample.shape
+        if dtype not in (np.float32, np.float64):
+            sample = sample.astype(np.float32)
+
+        sample = sample.reshape(batch_size, channels * height * width)
+        s = np.quantile(np.abs(sample), self.config.dynamic_thresholding_ratio, axis=1)
+        s = np.clip(s, 1, self.config.sample_max_value).astype(sample.dtype)
+        s = np.expand_dims(s, 1)
+        sample = np.clip(sample, -s, s) / s
+
+        return sample.reshape(batch_size, channels, height, width).astype(dtype)
+
+    def add_noise(
+        self, original_samples: Sample, noise: Sample, timesteps: Any
+    ) -> Sample:
+        samples = to_numpy(original_samples)
+        alphas_cumprod = to_numpy(self.alphas_cumprod).astype(samples.dtype)
+        alpha_prod = alphas_cumprod[to_numpy(timesteps).astype(np.int64)]
+
+        sqrt_alpha_prod = broadcast_to_sample(alpha_prod**0.5, samples)
+        sqrt_one_minus_alpha_prod = broadcast_to_sample(
+            (1 - alpha_prod) ** 0.5, samples
+        )
+        noisy_samples = (
+            sqrt_alpha_prod * samples + sqrt_one_minus_alpha_prod * to_numpy(noise)
+        )
+
+        return like_input(noisy_samples, original_samples)
+
+
+class NumpyDDIMScheduler(NumpySchedulerMixin, DDIMScheduler):
+    np_final_alpha_cumprod: np.float32
+
+    def set_timesteps(self, num_inference_steps: int, device: Any = None) -> None:
+        super().set_timesteps(num_inference_steps, device=device)
+        self.np_final_alpha_cumprod = np.float32(to_numpy(self.final_alpha_cumprod))
+
+    def scale_model_input(
+        self, sample: Sample, timestep: Optional[int] = None
+    ) -> Sample:
+        return sample
+
+    def step(
+        self,
+        model_output: Sample,
+        timestep: int,
+        sample: Sample,
+        eta: float = 0.0,
+        use_clipped_model_output: bool = False,
+        generator=None,
+        variance_noise: Optional[Sample] = None,
+        return_dict: bool = True,
+    ) -> Union[DDIMSchedulerOutput, Tuple]:
+        if self.num_inference_steps is None:
+            raise ValueError(
+                "Number of inference steps is 'None', you need to run 'set_timesteps' after creating the scheduler"
+            )
+
+        like = sample
+        model_output = to_numpy(model_output)
+        sample = to_numpy(sample)
+
+        timestep = int(timestep)
+        prev_timestep = (
+            timestep - self.config.num_train_timesteps // self.num_inference_steps
+        )
+
+        alpha_prod_t = self.np_alphas_cumprod[timestep]
+        alpha_prod_t_prev = (
+            self.np_alphas_cumprod[prev_timestep]
+            if prev_timestep >= 0
+            else self.np_final_alpha_cumprod
+        )
+        beta_prod_t = 1 - alpha_prod_t
+
+        if self.config.prediction_type == "epsilon":
+            pred_original_sample = (
+                sample - beta_prod_t**0.5 * model_output
+            ) / alpha_prod_t**0.5
+            pred_epsilon = model_output
+        elif self.config.prediction_type == "sample":
+            pred_original_sample = model_output
+            pred_epsilon = (
+                sample - alpha_prod_t**0.5 * pred_original_sample
+            ) / beta_prod_t**0.5
+        elif self.config.prediction_type == "v_prediction":
+            pred_original_sample = (
+                alpha_prod_t**0.5 * sample - beta_prod_t**0.5 * model_output
+            )
+            pred_epsilon = (
+                alpha_prod_t**0.5 * model_output + beta_prod_t**0.5 * sample
+            )
+        else:
+            raise ValueError(
+                f"prediction_type given as {self.config.prediction_type} must be one of `epsilon`, `sample`, or"
+                " `v_prediction`"
+            )
+
+        if self.config.thresholding:
+            pred_original_sample = self.threshold_sample(pred_original_sample)
+        elif self.config.clip_sample:
+            pred_original_sample = np.clip(
+                pred_original_sample,
+                -self.config.clip_sample_range,
+                self.config.clip_sample_range,
+            )
+
+        beta_prod_t_prev = 1 - alpha_prod_t_prev
+        variance = (beta_prod_t_prev / beta_prod_t) * (
+            1 - alpha_prod_t / alpha_prod_t_prev
+        )
+        std_dev_t = eta * variance**0.5
+
+        if use_clipped_model_output:
+            pred_epsilon = (
+                sample - alpha_prod_t**0.5 * pred_original_sample
+            ) / beta_prod_t**0.5
+
+        pred_sample_direction = (
+            1 - alpha_prod_t_prev - std_dev_t**2
+        ) ** 0.5 * pred_epsilon
+        prev_sample = (
+            alpha_prod_t_prev**0.5 * pred_original_sample + pred_sample_direction
+        )
+
+        if eta > 0:
+            if variance_noise is not None and generator is not None:
+                raise ValueError(
+                    "Cannot pass both generator and variance_noise. Please make sure that either `generator` or"
+                    " `variance_noise` stays `None`."
+                )
+
+            if variance_noise is None:
+                variance_noise = randn_numpy(
+                    model_output.shape, model_output.dtype, generator
+                )
+
+            prev_sample = prev_sample + std_dev_t * to_numpy(variance_noise)
+
+        prev_sample = like_input(prev_sample, like)
+        if not return_dict:
+            return (prev_sample,)
+
+        return DDIMSchedulerOutput(
+            prev_sample=prev_sample,
+            pred_original_sample=like_input(pred_original_sample, like),
+        )
+
+
+class NumpyEulerSchedulerMixin(NumpySchedulerMixin):
+    np_sigmas: np.ndarray
+
+    def set_timesteps(self, num_inference_steps: int, device: Any = None) -> None:
+        super().set_timesteps(num_inference_steps, device=device)
+        self.np_sigmas = to_numpy(self.sigmas)
+
+    def check_timestep(self, timestep: Any) -> None:
+        if isinstance(timestep, (int, torch.IntTensor, torch.LongTensor)):
+            raise ValueError(
+                "Passing integer indices (e.g. from `enumerate(timesteps)`) as timesteps to `step()` is not"
+                " supported. Make sure to pass one of the `scheduler.timesteps` as a timestep."
+            )
+
+        if not self.is_scale_input_called:
+            logger.warning(
+                "the scale_model_input function should be called before step to ensure correct denoising"
+            )
+
+    def get_sigma_index(self, timestep: Any) -> int:
+        step_index = self.get_step_index(timestep)
+        if step_index is None:
+            raise ValueError(
+                f"timestep {timestep} is not one of the scheduler timesteps"
+            )
+
+        return step_index
+
+    def scale_model_input(self, sample: Sample, timestep: Any) -> Sample:
+        sigma = self.np_sigmas[self.get_sigma_index(timestep)]
+        self.is_scale_input_called = True
+
+        return like_input(to_numpy(sample) / (sigma**2 + 1) ** 0.5, sample)
+
+    def add_noise(
+        self, original_samples: Sample, noise: Sample, timesteps: Any
+    ) -> Sample:
+        samples = to_numpy(original_samples)
+        sigmas = to_numpy(self.sigmas).astype(samples.dtype)
+        schedule_timesteps = to_numpy(self.timesteps)
+
+        step_indices = [
+            int(np.flatnonzero(schedule_timesteps == t)[0])
+            for t in to_numpy(timesteps).flatten()
+        ]
+        sigma = broadcast_to_sample(sigmas[step_indices], samples)
+
+        return like_input(samples + to_numpy(noise) * sigma, original_samples)
+
+
+class NumpyEulerDiscreteScheduler(NumpyEulerSchedulerMixin, EulerDiscreteScheduler):
+    def step(
+        self,
+        model_output: Sample,
+        timestep: Any,
+        sample: Sample,
+        s_churn: float = 0.0,
+        s_tmin: float = 0.0,
+        s_tmax: float = float("inf"),
+        s_noise: float = 1.0,
+        generator=None,
+        return_dict: bool = True,
+    ) -> Union[EulerDiscreteSchedulerOutput, Tuple]:
+        self.check_timestep(timestep)
+        step_index = self.get_sigma_index(timestep)
+
+        like = sample
+        model_output = to_numpy(model_output)
+        sample = to_numpy(sample)
+
+        sigma = self.np_sigmas[step_index]
+        gamma = (
+            min(s_churn / (len(self.np_sigmas) - 1), 2**0.5 - 1)
+            if s_tmin <= sigma <= s_tmax
+            else 0.0
+        )
+        sigma_hat = sigma * (gamma + 1)
+
+        # the noise is only used with churn, so it does not need to be drawn otherwise
+        if gamma > 0:
+            eps = (
+                randn_numpy(model_output.shape, model_output.dtype, generator) * s_noise
+            )
+            sample = sample + eps * (sigma_hat**2 - sigma**2) ** 0.5
+
+        if self.config.prediction_type in ["original_sample", "sample"]:
+            pred_original_sample = model_output
+        elif self.config.prediction_type == "epsilon":
+            pred_original_sample = sample - sigma_hat * model_output
+        elif self.config.prediction_type == "v_prediction":
+            pred_original_sample = model_output * (-sigma / (sigma**2 + 1) ** 0.5) + (
+                sample / (sigma**2 + 1)
+            )
+        else:
+            raise ValueError(
+                f"prediction_type given as {self.config.prediction_type} must be one of `epsilon`, or"
+                " `v_prediction`"
+            )
+
+        derivative = (sample - pred_original_sample) / sigma_hat
+        dt = self.np_sigmas[step_index + 1] - sigma_hat
+        prev_sample = like_input(sample + derivative * dt, like)
+
+        if not return_dict:
+            return (prev_sample,)
+
+        return EulerDiscreteSchedulerOutput(
+            prev_sample=prev_sample,
+            pred_original_sample=like_input(pred_original_sample, like),
+        )
+
+
+class NumpyEulerAncestralDiscreteScheduler(
+    NumpyEulerSchedulerMixin, EulerAncestralDiscreteScheduler
+):
+    def step(
+        self,
+        model_output: Sample,
+        timestep: Any,
+        sample: Sample,
+        generator=None,
+        return_dict: bool = True,
+    ) -> Union[EulerAncestralDiscreteSchedulerOutput, Tuple]:
+        self.check_timestep(timestep)
+        step_index = self.get_sigma_index(timestep)
+
+        like = sample
+        model_output = to_numpy(model_output)
+        sample = to_numpy(sample)
+
+        sigma = self.np_sigmas[step_index]
+        if self.config.prediction_type == "epsilon":
+            pred_original_sample = sample - sigma * model_output
+        elif self.config.prediction_type == "v_prediction":
+            pred_original_sample = model_output * (-sigma / (sigma**2 + 1) ** 0.5) + (
+                sample / (sigma**2 + 1)
+            )
+        elif self.config.prediction_type == "sample":
+            raise NotImplementedError("prediction_type not implemented yet: sample")
+        else:
+            raise ValueError(
+                f"prediction_type given as {self.config.prediction_type} must be one of `epsilon`, or"
+                " `v_prediction`"
+            )
+
+        sigma_from = sigma
+        sigma_to = self.np_sigmas[step_index + 1]
+        sigma_up = (
+            sigma_to**2 * (sigma_from**2 - sigma_to**2) / sigma_from**2
+        ) ** 0.5
+        sigma_down = (sigma_to**2 - sigma_up**2) ** 0.5
+
+        derivative = (sample - pred_original_sample) / sigma
+        dt = sigma_down - sigma
+        prev_sample = sample + derivative * dt
+
+        noise = randn_numpy(model_output.shape, model_output.dtype, generator)
+        prev_sample = like_input(prev_sample + noise * sigma_up, like)
+
+        if not return_dict:
+            return (prev_sample,)
+
+        return EulerAncestralDiscreteSchedulerOutput(
+            prev_sample=prev_sample,
+            pred_original_sample=like_input(pred_original_sample, like),
+        )
+
+
+class NumpyMultistepSchedulerMixin(NumpySchedulerMixin):
+    np_alpha_t: np.ndarray
+    np_sigma_t: np.ndarray
+    np_lambda_t: np.ndarray
+
+    def set_timesteps(self, num_inference_steps: int, device: Any = None) -> None:
+        super().set_timesteps(num_inference_steps, device=device)
+        self.np_timesteps = self.np_timesteps.astype(np.int64)
+        self.np_alpha_t = to_numpy(self.alpha_t)
+        self.np_sigma_t = to_numpy(self.sigma_t)
+        self.np_lambda_t = to_numpy(self.lambda_t)
+
+    def scale_model_input(self, sample: Sample, *args, **kwargs) -> Sample:
+        return sample
+
+    def get_multistep_index(self, timestep: Any) -> Tuple[int, int, int]:
+        """
+        Get the step index and the current and previous timesteps, using the last step for unknown timesteps.
+        """
+        if self.num_inference_steps is None:
+            raise ValueError(
+                "Number of inference steps is 'None', you need to run 'set_timesteps' after creating the scheduler"
+            )
+
+        step_index = self.get_step_index(timestep)
+        if step_index is None:
+            step_index = len(self.np_timesteps) - 1
+
+        last_step = len(self.np_timesteps) - 1
+        prev_timestep = (
+            0 if step_index == last_step else int(self.np_timesteps[step_index + 1])
+        )
+
+        return step_index, int(timestep), prev_timestep
+
+    def convert_predict_x0(
+        self, model_output: np.ndarray, timestep: int, sample: np.ndarray
+    ) -> np.ndarray:
+        if self.config.prediction_type == "epsilon":
+            alpha_t, sigma_t = self.np_alpha_t[timestep], self.np_sigma_t[timestep]
+            x0_pred = (sample - sigma_t * model_output) / alpha_t
+        elif self.config.prediction_type == "sample":
+            x0_pred = model_output
+        elif self.config.prediction_type == "v_prediction":
+            alpha_t, sigma_t = self.np_alpha_t[timestep], self.np_sigma_t[timestep]
+            x0_pred = alpha_t * sample - sigma_t * model_output
+        else:
+            raise ValueError(
+                f"prediction_type given as {self.config.prediction_type} must be one of `epsilon`, `sample`, or"
+                " `v_prediction`"
+            )
+
+        if self.config.thresholding:
+            x0_pred = self.threshold_sample(x0_pred)
+
+        return x0_pred
+
+    def convert_predict_epsilon(
+        self, model_output: np.ndarray, timestep: int, sample: np.ndarray
+    ) -> np.ndarray:
+        if self.config.prediction_type == "epsilon":
+            return model_output
+        elif self.config.prediction_type == "sample":
+            alpha_t, sigma_t = self.np_alpha_t[timestep], self.np_sigma_t[timestep]
+            return (sample - alpha_t * model_output) / sigma_t
+        elif self.config.prediction_type == "v_prediction":
+            alpha_t, sigma_t = self.np_alpha_t[timestep], self.np_sigma_t[timestep]
+            return alpha_t * model_output + sigma_t * sample
+        else:
+            raise ValueError(
+                f"prediction_type given as {self.config.prediction_type} must be one of `epsilon`, `sample`, or"
+                " `v_prediction`"
+            )
+
+
+class NumpyDPMSolverMultistepScheduler(
+    NumpyMultistepSchedulerMixin, DPMSolverMultistepScheduler
+):
+    def convert_model_output(
+        self, model_output: np.ndarray, timestep: int, sample: np.ndarray
+    ) -> np.ndarray:
+        if self.config.algorithm_type == "dpmsolver++":
+            return self.convert_predict_x0(model_output, timestep, sample)
+
+        return self.convert_predict_epsilon(model_output, timestep, sample)
+
+    def dpm_solver_first_order_update(
+        self,
+        model_output: np.ndarray,
+        timestep: int,
+        prev_timestep: int,
+        sample: np.ndarray,
+    ) -> np.ndarray:
+        lambda_t, lambda_s = self.np_lambda_t[prev_timestep], self.np_lambda_t[timestep]
+        alpha_t, alpha_s = self.np_alpha_t[prev_timestep], self.np_alpha_t[timestep]
+        sigma_t, sigma_s = self.np_sigma_t[prev_timestep], self.np_sigma_t[timestep]
+        h = lambda_t - lambda_s
+
+        if self.config.algorithm_type == "dpmsolver++":
+            return (sigma_t / sigma_s) * sample - (
+                alpha_t * (np.exp(-h) - 1.0)
+            ) * model_output
+
+        return (alpha_t / alpha_s) * sample - (
+            sigma_t * (np.exp(h) - 1.0)
+        ) * model_output
+
+    def multistep_dpm_solver_second_order_update(
+        self,
+        model_output_list: List[np.ndarray],
+        timestep_list: List[int],
+        prev_timestep: int,
+        sample: np.ndarray,
+    ) -> np.ndarray:
+        t, s0, s1 = prev_timestep, timestep_list[-1], timestep_list[-2]
+        m0, m1 = model_output_list[-1], model_output_list[-2]
+        lambda_t, lambda_s0, lambda_s1 = (
+            self.np_lambda_t[t],
+            self.np_lambda_t[s0],
+            self.np_lambda_t[s1],
+        )
+        alpha_t, alpha_s0 = self.np_alpha_t[t], self.np_alpha_t[s0]
+        sigma_t, sigma_s0 = self.np_sigma_t[t], self.np_sigma_t[s0]
+        h, h_0 = lambda_t - lambda_s0, lambda_s0 - lambda_s1
+        r0 = h_0 / h
+        D0, D1 = m0, (1.0 / r0) * (m0 - m1)
+
+        if self.config.algorithm_type == "dpmsolver++":
+            if self.config.solver_type == "midpoint":
+                return (
+                    (sigma_t / sigma_s0) * sample
+                    - (alpha_t * (np.exp(-h) - 1.0)) * D0
+                    - 0.5 * (alpha_t * (np.exp(-h) - 1.0)) * D1
+                )
+
+            return (
+                (sigma_t / sigma_s0) * sample
+                - (alpha_t * (np.exp(-h) - 1.0)) * D0
+                + (alpha_t * ((np.exp(-h) - 1.0) / h + 1.0)) * D1
+            )
+
+        if self.config.solver_type == "midpoint":
+            return (
+                (alpha_t / alpha_s0) * sample
+                - (sigma_t * (np.exp(h) - 1.0)) * D0
+                - 0.5 * (sigma_t * (np.exp(h) - 1.0)) * D1
+            )
+
+        return (
+            (alpha_t / alpha_s0) * sample
+            - (sigma_t * (np.exp(h) - 1.0)) * D0
+            - (sigma_t * ((np.exp(h) - 1.0) / h - 1.0)) * D1
+        )
+
+    def multistep_dpm_solver_third_order_update(
+        self,
+        model_output_list: List[np.ndarray],
+        timestep_list: List[int],
+        prev_timestep: int,
+        sample: np.ndarray,
+    ) -> np.ndarray:
+        t, s0, s1, s2 = (
+            prev_timestep,
+            timestep_list[-1],
+            timestep_list[-2],
+            timestep_list[-3],
+        )
+        m0, m1, m2 = model_output_list[-1], model_output_list[-2], model_output_list[-3]
+        lambda_t, lambda_s0, lambda_s1, lambda_s2 = (
+            self.np_lambda_t[t],
+            self.np_lambda_t[s0],
+            self.np_lambda_t[s1],
+            self.np_lambda_t[s2],
+        )
+        alpha_t, alpha_s0 = self.np_alpha_t[t], self.np_alpha_t[s0]
+        sigma_t, sigma_s0 = self.np_sigma_t[t], self.np_sigma_t[s0]
+        h, h_0, h_1 = lambda_t - lambda_s0, lambda_s0 - lambda_s1, lambda_s1 - lambda_s2
+        r0, r1 = h_0 / h, h_1 / h
+        D0 = m0
+        D1_0, D1_1 = (1.0 / r0) * (m0 - m1), (1.0 / r1) * (m1 - m2)
+        D1 = D1_0 + (r0 / (r0 + r1)) * (D1_0 - D1_1)
+        D2 = (1.0 / (r0 + r1)) * (D1_0 - D1_1)
+
+        if self.config.algorithm_type == "dpmsolver++":
+            return (
+                (sigma_t / sigma_s0) * sample
+                - (alpha_t * (np.exp(-h) - 1.0)) * D0
+                + (alpha_t * ((np.exp(-h) - 1.0) / h + 1.0)) * D1
+                - (alpha_t * ((np.exp(-h) - 1.0 + h) / h**2 - 0.5)) * D2
+            )
+
+        return (
+            (alpha_t / alpha_s0) * sample
+            - (sigma_t * (np.exp(h) - 1.0)) * D0
+            - (sigma_t * ((np.exp(h) - 1.0) / h - 1.0)) * D1
+            - (sigma_t * ((np.exp(h) - 1.0 - h) / h**2 - 0.5)) * D2
+        )
+
+    def step(
+        self,
+        model_output: Sample,
+        timestep: int,
+        sample: Sample,
+        return_dict: bool = True,
+    ) -> Union[SchedulerOutput, Tuple]:
+        step_index, timestep, prev_timestep = self.get_multistep_index(timestep)
+
+        like = sample
+        sample = to_numpy(sample)
+
+        num_timesteps = len(self.np_timesteps)
+        lower_order = self.config.lower_order_final and num_timesteps < 15
+        lower_order_final = lower_order and step_index == num_timesteps - 1
+        lower_order_second = lower_order and step_index == num_timesteps - 2
+
+        model_output = self.convert_model_output(
+            to_numpy(model_output), timestep, sample
+        )
+        for i in range(self.config.solver_order - 1):
+            self.model_outputs[i] = self.model_outputs[i + 1]
+        self.model_outputs[-1] = model_output
+
+        if (
+            self.config.solver_order == 1
+            or self.lower_order_nums < 1
+            or lower_order_final
+        ):
+            prev_sample = self.dpm_solver_first_order_update(
+                model_output, timestep, prev_timestep, sample
+            )
+        elif (
+            self.config.solver_order == 2
+            or self.lower_order_nums < 2
+            or lower_order_second
+        ):
+            timestep_list = [int(self.np_timesteps[step_index - 1]), timestep]
+            prev_sample = self.multistep_dpm_solver_second_order_update(
+                self.model_outputs, timestep_list, prev_timestep, sample
+            )
+        else:
+            timestep_list = [
+                int(self.np_timesteps[step_index - 2]),
+                int(self.np_timesteps[step_index - 1]),
+                timestep,
+            ]
+            prev_sample = self.multistep_dpm_solver_third_order_update(
+                self.model_outputs, timestep_list, prev_timestep, sample
+            )
+
+        if self.lower_order_nums < self.config.solver_order:
+            self.lower_order_nums += 1
+
+        prev_sample = like_input(prev_sample, like)
+        if not return_dict:
+            return (prev_sample,)
+
+        return SchedulerOutput(prev_sample=prev_sample)
+
+
+class NumpyUniPCMultistepScheduler(
+    NumpyMultistepSchedulerMixin, UniPCMultistepScheduler
+):
+    def convert_model_output(
+        self, model_output: np.ndarray, timestep: int, sample: np.ndarray
+    ) -> np.ndarray:
+        if self.predict_x0:
+            return self.convert_predict_x0(model_output, timestep, sample)
+
+        return self.convert_predict_epsilon(model_output, timestep, sample)
+
+    def get_bh_coefficients(
+        self, timestep: int, order: int
+    ) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray], Any, Any, Any]:
+        """
+        Get the shared terms of the UniPC predictor and corrector, from the previous model outputs.
+        """
+        timestep_list = self.timestep_list
+        model_output_list = self.model_outputs
+        s0, t = timestep_list[-1], timestep
+        m0 = model_output_list[-1]
+
+        lambda_t, lambda_s0 = self.np_lambda_t[t], self.np_lambda_t[s0]
+        h = lambda_t - lambda_s0
+
+        rks = []
+        D1s = []
+        for i in range(1, order):
+            si = timestep_list[-(i + 1)]
+            mi = model_output_list[-(i + 1)]
+            rk = (self.np_lambda_t[si] - lambda_s0) / h
+            rks.append(rk)
+            D1s.append((mi - m0) / rk)
+
+        rks.append(1.0)
+        rks = np.array(rks, dtype=np.float32)
+
+        hh = -h if self.predict_x0 else h
+        h_phi_1 = np.expm1(hh)
+        h_phi_k = h_phi_1 / hh - 1
+
+        if self.config.solver_type == "bh1":
+            B_h = hh
+        elif self.config.solver_type == "bh2":
+            B_h = np.expm1(hh)
+        else:
+            raise NotImplementedError()
+
+        R = []
+        b = []
+        factorial_i = 1
+        for i in range(1, order + 1):
+            R.append(np.power(rks, i - 1))
+            b.append(h_phi_k * factorial_i / B_h)
+            factorial_i *= i + 1
+            h_phi_k = h_phi_k / hh - 1 / factorial_i
+
+        R = np.stack(R)
+        b = np.array(b, dtype=np.float32)
+        D1s = np.stack(D1s, axis=1) if len(D1s) > 0 else None
+
+        return R, b, D1s, h_phi_1, B_h, m0
+
+    def get_bh_base(
+        self, timestep: int, x: np.ndarray, m0: np.ndarray, h_phi_1: Any
+    ) -> np.ndarray:
+        s0, t = self.timestep_list[-1], timestep
+        alpha_t, alpha_s0 = self.np_alpha_t[t], self.np_alpha_t[s0]
+        sigma_t, sigma_s0 = self.np_sigma_t[t], self.np_sigma_t[s0]
+
+        if self.predict_x0:
+            return (sigma_t / sigma_s0) * x - (alpha_t * h_phi_1) * m0
+
+        return (alpha_t / alpha_s0) * x - (sigma_t * h_phi_1) * m0
+
+    def get_bh_scale(self, timestep: int, B_h: Any) -> Any:
+        if self.predict_x0:
+            return self.np_alpha_t[timestep] * B_h
+
+        return self.np_sigma_t[timestep] * B_h
+
+    def multistep_uni_p_bh_update(
+        self,
+        model_output: np.ndarray,
+        prev_timestep: int,
+        sample: np.ndarray,
+        order: int,
+    ) -> np.ndarray:
+        if self.solver_p:
+            s0 = self.timestep_list[-1]
+            x_t = self.solver_p.step(
+                torch.from_numpy(model_output), s0, torch.from_numpy(sample)
+            ).prev_sample
+            return to_numpy(x_t)
+
+        R, b, D1s, h_phi_1, B_h, m0 = self.get_bh_coefficients(prev_timestep, order)
+        x_t_ = self.get_bh_base(prev_timestep, sample, m0, h_phi_1)
+
+        if D1s is None:
+            return x_t_.astype(sample.dtype)
+
+        if order == 2:
+            rhos_p = np.array([0.5], dtype=sample.dtype)
+        else:
+            rhos_p = np.linalg.solve(R[:-1, :-1], b[:-1]).astype(np.float32)
+
+        pred_res = np.einsum("k,bkchw->bchw", rhos_p, D1s)
+        x_t = x_t_ - self.get_bh_scale(prev_timestep, B_h) * pred_res
+        return x_t.astype(sample.dtype)
+
+    def multistep_uni_c_bh_update(
+        self,
+        this_model_output: np.ndarray,
+        this_timestep: int,
+        last_sample: np.ndarray,
+        this_sample: np.ndarray,
+        order: int,
+    ) -> np.ndarray:
+        R, b, D1s, h_phi_1, B_h, m0 = self.get_bh_coefficients(this_timestep, order)
+        x_t_ = self.get_bh_base(this_timestep, last_sample, m0, h_phi_1)
+
+        if order == 1:
+            rhos_c = np.array([0.5], dtype=last_sample.dtype)
+        else:
+            rhos_c = np.linalg.solve(R, b).astype(np.float32)
+
+        if D1s is not None:
+            corr_res = np.einsum("k,bkchw->bchw", rhos_c[:-1], D1s)
+        else:
+            corr_res = 0
+
+        D1_t = this_model_output - m0
+        x_t = x_t_ - self.get_bh_scale(this_timestep, B_h) * (
+            corr_res + rhos_c[-1] * D1_t
+        )
+        return x_t.astype(last_sample.dtype)
+
+    def step(
+        self,
+        model_output: Sample,
+        timestep: int,
+        sample: Sample,
+        return_dict: bool = True,
+    ) -> Union[SchedulerOutput, Tuple]:
+        step_index, timestep, prev_timestep = self.get_multistep_index(timestep)
+
+        like = sample
+        model_output = to_numpy(model_output)
+        sample = to_numpy(sample)
+
+        use_corrector = (
+            step_index > 0
+            and step_index - 1 not in self.disable_corrector
+            and self.last_sample is not None
+        )
+
+        model_output_convert = self.convert_model_output(model_output, timestep, sample)
+        if use_corrector:
+            sample = self.multistep_uni_c_bh_update(
+                this_model_output=model_output_convert,
+                this_timestep=timestep,
+                last_sample=self.last_sample,
+                this_sample=sample,
+                order=self.this_order,
+            )
+
+        for i in range(self.config.solver_order - 1):
+            self.model_outputs[i] = self.model_outputs[i + 1]
+            self.timestep_list[i] = self.timestep_list[i + 1]
+
+        self.model_outputs[-1] = model_output_convert
+        self.timestep_list[-1] = timestep
+
+        if self.config.lower_order_final:
+            this_order = min(
+                self.config.solver_order, len(self.np_timesteps) - step_index
+            )
+        else:
+            this_order = self.config.solver_order
+
+        self.this_order = min(this_order, self.lower_order_nums + 1)
+        assert self.this_order > 0
+
+        self.last_sample = sample
+        prev_sample = self.multistep_uni_p_bh_update(
+            model_output=model_output,
+            prev_timestep=prev_timestep,
+            sample=sample,
+            order=self.this_order,
+        )
+
+        if self.lower_order_nums < self.config.solver_order:
+            self.lower_order_nums += 1
+
+        prev_sample = like_input(prev_sample, like)
+        if not return_dict:
+            return (prev_sample,)
+
+        return SchedulerOutput(prev_sample=prev_sample)
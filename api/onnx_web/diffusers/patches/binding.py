@@ -0,0 +1,140 @@
+from logging import getLogger
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from diffusers.pipelines.onnx_utils import ORT_TO_NP_TYPE
+from onnxruntime import InferenceSession, OrtValue
+
+logger = getLogger(__name__)
+
+# schedulers like PNDM keep the last few model outputs, so output buffers are not reused right away
+BINDING_OUTPUT_BUFFERS = 5
+BINDING_CONSTANT_LIMIT = 8
+
+DEVICE_PROVIDERS = {
+    "CUDAExecutionProvider": "cuda",
+    "ROCMExecutionProvider": "cuda",
+}
+
+
+class SessionBinding:
+    """
+    Run an ONNX session through IOBinding. Inputs that stay the same between steps, like the prompt embeddings,
+    are converted and copied to the device once, and outputs are written into preallocated buffers that are
+    reused across steps.
+    """
+
+    session: InferenceSession
+    device_type: str
+    device_id: int
+    input_types: Dict[str, Any]
+    output_types: Dict[str, Any]
+    output_shapes: Dict[str, List[Any]]  # int or symbolic dims, from the model
+
+    inputs: Dict[str, np.ndarray]  # bound arrays, kept until the next step
+
+    constants: Dict[
+        Tuple[str, int], Tuple[np.ndarray, OrtValue]
+    ]  # input, id -> source, bound value
+    outputs: Dict[
+        Tuple[str, Tuple[int, ...]], List[np.ndarray]
+    ]  # output, shape -> buffers
+    output_index: int
+
+    def __init__(self, session: InferenceSession) -> None:
+        self.session = session
+        self.binding = session.io_binding()
+
+        provider = session.get_providers()[0]
+        self.device_type = DEVICE_PROVIDERS.get(provider, "cpu")
+        self.device_id = 0
+        if self.device_type != "cpu":
+            options = session.get_provider_options().get(provider, {})
+            self.device_id = int(options.get("device_id", 0))
+
+        self.input_types = {
+            input.name: ORT_TO_NP_TYPE[input.type] for input in session.get_inputs()
+        }
+        self.output_types = {
+            output.name: ORT_TO_NP_TYPE[output.type] for output in session.get_outputs()
+        }
+        self.output_shapes = {
+            output.name: output.shape for output in session.get_outputs()
+        }
+
+        self.inputs = {}
+        self.constants = {}
+        self.outputs = {}
+        self.output_index = 0
+
+    def convert(self, name: str, value: np.ndarray) -> np.ndarray:
+        dtype = self.input_types.get(name, value.dtype)
+        if value.dtype != dtype:
+            logger.trace("converting %s input from %s to %s", name, value.dtype, dtype)
+            value = value.astype(dtype)
+
+        return np.ascontiguousarray(value)
+
+    def bind_input(self, name: str, value: np.ndarray) -> None:
+        """
+        Bind an input that changes every step. On the CPU, this does not copy the array.
+        """
+        value = self.convert(name, value)
+        self.inputs[name] = value
+        self.binding.bind_cpu_input(name, value)
+
+    def bind_constant(self, name: str, value: np.ndarray) -> None:
+        """
+        Bind an input that is used for many steps, converting and copying it to the device the first time.
+        """
+        key = (name, id(value))
+        if key not in self.constants:
+            if len(self.constants) >= BINDING_CONSTANT_LIMIT:
+                self.clear_constants()
+
+            bound = OrtValue.ortvalue_from_numpy(
+                self.convert(name, value), self.device_type, self.device_id
+            )
+            # keep the source array, so its id cannot be reused while the entry exists
+            self.constants[key] = (value, bound)
+
+        _source, bound = self.constants[key]
+        self.binding.bind_ortvalue_input(name, bound)
+
+    def clear_constants(self) -> None:
+        self.constants.clear()
+
+    def get_output(self, name: str, shape: Tuple[int, ...]) -> np.ndarray:
+        key = (name, tuple(shape))
+        if key not in self.outputs:
+            logger.debug("allocating output buffers for %s: %s", name, shape)
+            self.outputs[key] = [
+                np.empty(shape, dtype=self.output_types[name])
+                for _i in range(BINDING_OUTPUT_BUFFERS)
+            ]
+
+        return self.outputs[key][self.output_index % BINDING_OUTPUT_BUFFERS]
+
+    def run(self, output_shapes: Dict[str, Tuple[int, ...]]) -> List[np.ndarray]:
+        """
+        Run the session with the bound inputs, writing each output into the next free buffer.
+
+        The results are views of those buffers and will be overwritten after BINDING_OUTPUT_BUFFERS more runs,
+        so callers that keep them for longer must copy them.
+        """
+        results = []
+        for name in self.output_types.keys():
+            output = self.get_output(name, output_shapes[name])
+            self.binding.bind_output(
+                name,
+                device_type="cpu",
+                device_id=0,
+                element_type=output.dtype,
+                shape=output.shape,
+                buffer_ptr=output.ctypes.data,
+            )
+            results.append(output)
+
+        self.output_index += 1
+        self.session.run_with_iobinding(self.binding)
+        return results
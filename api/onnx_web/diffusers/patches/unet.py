@@ -1,15 +1,17 @@
 from logging import getLogger
-from typing import List, Optional
+from typing import Any, List, Optional, Tuple
 
 import numpy as np
 from diffusers import OnnxRuntimeModel
 
 from ...server import ServerContext
+from .binding import SessionBinding
 
 logger = getLogger(__name__)
 
 
 class UNetWrapper(object):
+    binding: Optional[SessionBinding] = None
     prompt_embeds: Optional[List[np.ndarray]] = None
     prompt_index: int = 0
     server: ServerContext
@@ -23,6 +25,9 @@ class UNetWrapper(object):
         self.server = server
         self.wrapped = wrapped
 
+        if "onnx-iobinding" in server.optimizations:
+            self.binding = get_unet_binding(wrapped)
+
     def __call__(
         self,
         sample: np.ndarray = None,
@@ -43,6 +48,18 @@ class UNetWrapper(object):
             encoder_hidden_states = self.prompt_embeds[step_index]
             self.prompt_index += 1
 
+        if self.binding is not None:
+            try:
+                with self.server.timings.timer("session", "unet"):
+                    return self.run_binding(
+                        sample, timestep, encoder_hidden_states, **kwargs
+                    )
+            except Exception:
+                logger.exception(
+                    "error running UNet with IOBinding, using session inputs instead"
+                )
+                self.binding = None
+
         if sample.dtype != timestep.dtype:
             logger.trace("converting UNet sample to timestep dtype")
             sample = sample.astype(timestep.dtype)
@@ -51,12 +68,41 @@ class UNetWrapper(object):
             logger.trace("converting UNet hidden states to timestep dtype")
             encoder_hidden_states = encoder_hidden_states.astype(timestep.dtype)
 
-        return self.wrapped(
-            sample=sample,
-            timestep=timestep,
-            encoder_hidden_states=encoder_hidden_states,
-            **kwargs,
-        )
+        with self.server.timings.timer("session", "unet"):
+            return self.wrapped(
+                sample=sample,
+                timestep=timestep,
+                encoder_hidden_states=encoder_hidden_states,
+                **kwargs,
+            )
+
+    def run_binding(
+        self,
+        sample: np.ndarray,
+        timestep: np.ndarray,
+        encoder_hidden_states: np.ndarray,
+        **kwargs,
+    ) -> List[np.ndarray]:
+        """
+        Run the UNet through IOBinding. The hidden states are usually the same array for every step, so they
+        are only converted and copied to the device once.
+
+        The outputs are views of the binding's output buffers, which are reused after a few steps. Pipelines that
+        keep the noise predictions for longer, like the panorama views, must copy them.
+        """
+        self.binding.bind_input("sample", sample)
+        self.binding.bind_input("timestep", timestep)
+        self.binding.bind_constant("encoder_hidden_states", encoder_hidden_states)
+
+        for name, value in kwargs.items():
+            self.binding.bind_input(name, value)
+
+        output_shapes = {
+            name: get_output_shape(shape, sample.shape)
+            for name, shape in self.binding.output_shapes.items()
+        }
+
+        return self.binding.run(output_shapes)
 
     def __getattr__(self, attr):
         return getattr(self.wrapped, attr)
@@ -67,3 +113,33 @@ class UNetWrapper(object):
         )
         self.prompt_embeds = prompt_embeds
         self.prompt_index = 0
+
+        if self.binding is not None:
+            self.binding.clear_constants()
+
+
+def get_unet_binding(wrapped: OnnxRuntimeModel) -> Optional[SessionBinding]:
+    session = getattr(wrapped, "model", None)
+    if session is None or not hasattr(session, "io_binding"):
+        logger.debug("UNet is not an ONNX session, cannot use IOBinding")
+        return None
+
+    if len(session.get_outputs()) != 1:
+        logger.debug("UNet has more than one output, cannot use IOBinding")
+        return None
+
+    logger.debug("using IOBinding for UNet")
+    return SessionBinding(session)
+
+
+def get_output_shape(
+    output_shape: List[Any], sample_shape: Tuple[int, ...]
+) -> Tuple[int, ...]:
+    """
+    Resolve the symbolic dims of a UNet output, usually the batch and spatial dims, from the sample. Fixed dims,
+    like the output channels, come from the model.
+    """
+    return tuple(
+        dim if isinstance(dim, int) else sample_shape[i]
+        for i, dim in enumerate(output_shape)
+    )
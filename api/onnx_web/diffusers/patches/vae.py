@@ -1,8 +1,8 @@
+from functools import lru_cache
 from logging import getLogger
-from typing import Union
+from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
-import torch
 from diffusers import OnnxRuntimeModel
 from diffusers.models.autoencoder_kl import AutoencoderKLOutput
 from diffusers.models.vae import DecoderOutput
@@ -15,6 +15,16 @@ logger = getLogger(__name__)
 LATENT_CHANNELS = 4
 
 
+@lru_cache(maxsize=16)
+def get_blend_ramp(blend_extent: int, length: int, dtype: np.dtype) -> np.ndarray:
+    """
+    Get the weights of the current tile for each row or column of the blended edge.
+    """
+    ramp = (np.arange(length) / blend_extent).astype(dtype)
+    ramp.setflags(write=False)
+    return ramp
+
+
 class VAEWrapper(object):
     def __init__(
         self,
@@ -72,30 +82,128 @@ class VAEWrapper(object):
                 return self.tiled_encode(sample, **kwargs)
         else:
             if self.decoder:
-                return self.wrapped(latent_sample=latent_sample)
+                return self.run_wrapped(latent_sample=latent_sample)
             else:
-                return self.wrapped(sample=sample)
+                return self.run_wrapped(sample=sample)
 
     def __getattr__(self, attr):
         return getattr(self.wrapped, attr)
 
-    def blend_v(self, a, b, blend_extent):
-        for y in range(min(a.shape[2], b.shape[2], blend_extent)):
-            b[:, :, y, :] = a[:, :, -blend_extent + y, :] * (1 - y / blend_extent) + b[
-                :, :, y, :
-            ] * (y / blend_extent)
+    def run_wrapped(self, **kwargs):
+        model = "vae_decoder" if self.decoder else "vae_encoder"
+        with self.server.timings.timer("session", model):
+            return self.wrapped(**kwargs)
+
+    def blend_v(self, a: np.ndarray, b: np.ndarray, blend_extent: int) -> np.ndarray:
+        extent = min(a.shape[2], b.shape[2], blend_extent)
+        if extent <= 0:
+            return b
+
+        ramp = get_blend_ramp(blend_extent, extent, b.dtype)[:, np.newaxis]
+        start = a.shape[2] - blend_extent
+        b[:, :, :extent, :] = a[:, :, start : start + extent, :] * (1 - ramp) + (
+            b[:, :, :extent, :] * ramp
+        )
         return b
 
-    def blend_h(self, a, b, blend_extent):
-        for x in range(min(a.shape[3], b.shape[3], blend_extent)):
-            b[:, :, :, x] = a[:, :, :, -blend_extent + x] * (1 - x / blend_extent) + b[
-                :, :, :, x
-            ] * (x / blend_extent)
+    def blend_h(self, a: np.ndarray, b: np.ndarray, blend_extent: int) -> np.ndarray:
+        extent = min(a.shape[3], b.shape[3], blend_extent)
+        if extent <= 0:
+            return b
+
+        ramp = get_blend_ramp(blend_extent, extent, b.dtype)
+        start = a.shape[3] - blend_extent
+        b[:, :, :, :extent] = a[:, :, :, start : start + extent] * (1 - ramp) + (
+            b[:, :, :, :extent] * ramp
+        )
         return b
 
-    @torch.no_grad()
+    def run_tiles(self, tiles: List[np.ndarray], input_name: str) -> List[np.ndarray]:
+        """
+        Run the wrapped model on each tile, batching tiles with the same shape together.
+        """
+        batch_size = max(1, self.server.vae_batch_size)
+
+        groups: Dict[Tuple[int, ...], List[int]] = {}
+        for i, tile in enumerate(tiles):
+            groups.setdefault(tile.shape, []).append(i)
+
+        results: List[Optional[np.ndarray]] = [None] * len(tiles)
+        for shape, indices in groups.items():
+            for start in range(0, len(indices), batch_size):
+                batch = indices[start : start + batch_size]
+                logger.trace("running VAE on %s tiles with shape %s", len(batch), shape)
+
+                inputs = np.concatenate([tiles[i] for i in batch], axis=0)
+                outputs = self.run_wrapped(**{input_name: inputs})[0]
+                for i, output in zip(batch, np.split(outputs, len(batch), axis=0)):
+                    results[i] = output
+
+        return results
+
+    def blend_tiles(
+        self, rows: List[List[np.ndarray]], blend_extent: int, row_limit: int
+    ) -> np.ndarray:
+        """
+        Blend each tile with the tiles above and to the left, then copy it into the output.
+        """
+        heights = [min(row[0].shape[2], row_limit) for row in rows]
+        widths = [min(tile.shape[3], row_limit) for tile in rows[0]]
+
+        first = rows[0][0]
+        output = np.empty(
+            (first.shape[0], first.shape[1], sum(heights), sum(widths)),
+            dtype=first.dtype,
+        )
+
+        top = 0
+        for i, row in enumerate(rows):
+            left = 0
+            for j, tile in enumerate(row):
+                # blend the above tile and the left tile into the current tile
+                if i > 0:
+                    tile = self.blend_v(rows[i - 1][j], tile, blend_extent)
+                if j > 0:
+                    tile = self.blend_h(row[j - 1], tile, blend_extent)
+
+                output[:, :, top : top + heights[i], left : left + widths[j]] = tile[
+                    :, :, : heights[i], : widths[j]
+                ]
+                left += widths[j]
+
+            # the previous row is no longer needed
+            if i > 0:
+                rows[i - 1] = []
+
+            top += heights[i]
+
+        return output
+
+    def tiled_run(
+        self,
+        x: np.ndarray,
+        input_name: str,
+        tile_size: int,
+        overlap_size: int,
+        blend_extent: int,
+        row_limit: int,
+    ) -> np.ndarray:
+        # split the input into overlapping tiles
+        coords = [
+            (i, j)
+            for i in range(0, x.shape[2], overlap_size)
+            for j in range(0, x.shape[3], overlap_size)
+        ]
+        tiles = [x[:, :, i : i + tile_size, j : j + tile_size] for i, j in coords]
+        results = self.run_tiles(tiles, input_name)
+
+        columns = len(range(0, x.shape[3], overlap_size))
+        rows = [results[i : i + columns] for i in range(0, len(results), columns)]
+
+        return self.blend_tiles(rows, blend_extent, row_limit)
+
     def tiled_encode(
-        self, x: torch.FloatTensor, return_dict: bool = True
+        self, x: np.ndarray, return_dict: bool = True
     ) -> AutoencoderKLOutput:
         r"""Encode a batch of images using a tiled encoder.
         Args:
@@ -104,53 +212,34 @@ class VAEWrapper(object):
         different from non-tiled encoding due to each tile using a different encoder. To avoid tiling artifacts, the
         tiles overlap and are blended together to form a smooth output. You may still see tile-sized changes in the
         look of the output, but they should be much less noticeable.
-            x (`torch.FloatTensor`): Input batch of images. return_dict (`bool`, *optional*, defaults to `True`):
+            x (`np.ndarray`): Input batch of images. return_dict (`bool`, *optional*, defaults to `True`):
                 Whether or not to return a [`AutoencoderKLOutput`] instead of a plain tuple.
         """
-        if isinstance(x, np.ndarray):
-            x = torch.from_numpy(x)
+        if not isinstance(x, np.ndarray):
+            x = x.numpy()
 
         overlap_size = int(self.tile_sample_min_size * (1 - self.tile_overlap_factor))
         blend_extent = int(self.tile_latent_min_size * self.tile_overlap_factor)
         row_limit = self.tile_latent_min_size - blend_extent
 
         # Split the image into 512x512 tiles and encode them separately.
-        rows = []
-        for i in range(0, x.shape[2], overlap_size):
-            row = []
-            for j in range(0, x.shape[3], overlap_size):
-                tile = x[
-                    :,
-                    :,
-                    i : i + self.tile_sample_min_size,
-                    j : j + self.tile_sample_min_size,
-                ]
-                tile = torch.from_numpy(self.wrapped(sample=tile.numpy())[0])
-                row.append(tile)
-            rows.append(row)
-        result_rows = []
-        for i, row in enumerate(rows):
-            result_row = []
-            for j, tile in enumerate(row):
-                # blend the above tile and the left tile
-                # to the current tile and add the current tile to the result row
-                if i > 0:
-                    tile = self.blend_v(rows[i - 1][j], tile, blend_extent)
-                if j > 0:
-                    tile = self.blend_h(row[j - 1], tile, blend_extent)
-                result_row.append(tile[:, :, :row_limit, :row_limit])
-            result_rows.append(torch.cat(result_row, dim=3))
+        moments = self.tiled_run(
+            x,
+            "sample",
+            self.tile_sample_min_size,
+            overlap_size,
+            blend_extent,
+            row_limit,
+        )
 
-        moments = torch.cat(result_rows, dim=2).numpy()
         if not return_dict:
             return (moments,)
 
         return AutoencoderKLOutput(latent_dist=moments)
 
-    @torch.no_grad()
     def tiled_decode(
-        self, z: torch.FloatTensor, return_dict: bool = True
-    ) -> Union[DecoderOutput, torch.FloatTensor]:
+        self, z: np.ndarray, return_dict: bool = True
+    ) -> Union[DecoderOutput, np.ndarray]:
         r"""Decode a batch of images using a tiled decoder.
         Args:
         When this option is enabled, the VAE will split the input tensor into tiles to compute decoding in several
@@ -158,12 +247,12 @@ class VAEWrapper(object):
         different from non-tiled decoding due to each tile using a different decoder. To avoid tiling artifacts, the
         tiles overlap and are blended together to form a smooth output. You may still see tile-sized changes in the
         look of the output, but they should be much less noticeable.
-            z (`torch.FloatTensor`): Input batch of latent vectors. return_dict (`bool`, *optional*, defaults to
+            z (`np.ndarray`): Input batch of latent vectors. return_dict (`bool`, *optional*, defaults to
             `True`):
                 Whether or not to return a [`DecoderOutput`] instead of a plain tuple.
         """
-        if isinstance(z, np.ndarray):
-            z = torch.from_numpy(z)
+        if not isinstance(z, np.ndarray):
+            z = z.numpy()
 
         overlap_size = int(self.tile_latent_min_size * (1 - self.tile_overlap_factor))
         blend_extent = int(self.tile_sample_min_size * self.tile_overlap_factor)
@@ -171,35 +260,14 @@ class VAEWrapper(object):
 
         # Split z into overlapping 64x64 tiles and decode them separately.
         # The tiles have an overlap to avoid seams between tiles.
-        rows = []
-        for i in range(0, z.shape[2], overlap_size):
-            row = []
-            for j in range(0, z.shape[3], overlap_size):
-                tile = z[
-                    :,
-                    :,
-                    i : i + self.tile_latent_min_size,
-                    j : j + self.tile_latent_min_size,
-                ]
-                decoded = torch.from_numpy(self.wrapped(latent_sample=tile.numpy())[0])
-                row.append(decoded)
-            rows.append(row)
-
-        result_rows = []
-        for i, row in enumerate(rows):
-            result_row = []
-            for j, tile in enumerate(row):
-                # blend the above tile and the left tile
-                # to the current tile and add the current tile to the result row
-                if i > 0:
-                    tile = self.blend_v(rows[i - 1][j], tile, blend_extent)
-                if j > 0:
-                    tile = self.blend_h(row[j - 1], tile, blend_extent)
-                result_row.append(tile[:, :, :row_limit, :row_limit])
-            result_rows.append(torch.cat(result_row, dim=3))
-
-        dec = torch.cat(result_rows, dim=2)
-        dec = dec.numpy()
+        dec = self.tiled_run(
+            z,
+            "latent_sample",
+            self.tile_latent_min_size,
+            overlap_size,
+            blend_extent,
+            row_limit,
+        )
 
         if not return_dict:
             return (dec,)
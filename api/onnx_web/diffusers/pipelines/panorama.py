@@ -13,7 +13,7 @@
 # limitations under the License.
 
 import inspect
-from typing import Callable, List, Optional, Union
+from typing import Callable, Dict, List, Optional, Union
 
 import numpy as np
 import PIL
@@ -26,6 +26,8 @@ from diffusers.schedulers import DDIMScheduler, LMSDiscreteScheduler, PNDMSchedu
 from diffusers.utils import PIL_INTERPOLATION, deprecate, logging
 from transformers import CLIPImageProcessor, CLIPTokenizer
 
+from ...server.context import DEFAULT_VIEW_BATCH_PIXELS
+
 logger = logging.get_logger(__name__)
 
 
@@ -115,6 +117,7 @@ class OnnxStableDiffusionPanoramaPipeline(DiffusionPipeline):
 
         self.window = window or DEFAULT_WINDOW
         self.stride = stride or DEFAULT_STRIDE
+        self.view_batch_pixels = DEFAULT_VIEW_BATCH_PIXELS
 
         if (
             hasattr(scheduler.config, "steps_offset")
@@ -369,6 +372,141 @@ class OnnxStableDiffusionPanoramaPipeline(DiffusionPipeline):
         )
         return views
 
+    def get_views_count(self, latents: np.ndarray, views) -> np.ndarray:
+        # the views do not change between steps, so they only need to be counted once
+        count = np.zeros_like(latents)
+        for h_start, h_end, w_start, w_end in views:
+            count[:, :, h_start:h_end, w_start:w_end] += 1
+
+        return count
+
+    def get_view_batch(self, batch_size: int, do_classifier_free_guidance: bool) -> int:
+        samples = batch_size * (2 if do_classifier_free_guidance else 1)
+        view_pixels = samples * (self.window * 8) ** 2
+        return max(1, self.view_batch_pixels // view_pixels)
+
+    def get_view_embeds(
+        self,
+        prompt_embeds: np.ndarray,
+        view_count: int,
+        batch_size: int,
+        do_classifier_free_guidance: bool,
+    ) -> Dict[int, np.ndarray]:
+        """
+        Repeat the prompt embeddings for each batch of views, keyed by the number of views in the batch. These
+        are the same for every step, so they only need to be built and copied to the device once for each image.
+        """
+        view_batch = self.get_view_batch(batch_size, do_classifier_free_guidance)
+        embeds = np.split(prompt_embeds, 2 if do_classifier_free_guidance else 1)
+
+        view_embeds = {}
+        for start in range(0, view_count, view_batch):
+            batch_views = min(view_batch, view_count - start)
+            if batch_views not in view_embeds:
+                view_embeds[batch_views] = np.concatenate(
+                    [np.concatenate([half] * batch_views) for half in embeds]
+                )
+
+        return view_embeds
+
+    def denoise_views(
+        self,
+        latents: np.ndarray,
+        t,
+        views,
+        count: np.ndarray,
+        prompt_embeds: np.ndarray,
+        guidance_scale: float,
+        do_classifier_free_guidance: bool,
+        timestep_dtype,
+        extra_step_kwargs,
+        conditioning: Optional[np.ndarray] = None,
+        view_embeds: Optional[Dict[int, np.ndarray]] = None,
+    ) -> np.ndarray:
+        """
+        Run the UNet on batches of views and take one scheduler step for all of them, then average the
+        overlapping views. The conditioning is concatenated to the latents of each view, like the inpainting mask.
+        """
+        batch_size = latents.shape[0]
+        view_batch = self.get_view_batch(batch_size, do_classifier_free_guidance)
+        if view_embeds is None:
+            view_embeds = self.get_view_embeds(
+                prompt_embeds, len(views), batch_size, do_classifier_free_guidance
+            )
+
+        # stack the latents for each view, keeping the batch together
+        view_latents = np.concatenate(
+            [latents[:, :, h0:h1, w0:w1] for h0, h1, w0, w1 in views]
+        )
+        cfg_halves = 2 if do_classifier_free_guidance else 1
+        if conditioning is not None:
+            conditioning = np.split(conditioning, cfg_halves)
+
+        noise_preds = []
+        for start in range(0, len(views), view_batch):
+            batch_views = views[start : start + view_batch]
+            batch_latents = view_latents[
+                start * batch_size : (start + len(batch_views)) * batch_size
+            ]
+
+            # expand the latents if we are doing classifier free guidance
+            latent_model_input = np.concatenate([batch_latents] * cfg_halves)
+            latent_model_input = self.scheduler.scale_model_input(
+                torch.from_numpy(latent_model_input), t
+            )
+            latent_model_input = latent_model_input.cpu().numpy()
+
+            if conditioning is not None:
+                # concat latents and conditioning in the channel dimension
+                batch_conditioning = np.concatenate(
+                    [
+                        half[:, :, h0:h1, w0:w1]
+                        for half in conditioning
+                        for h0, h1, w0, w1 in batch_views
+                    ]
+                )
+                latent_model_input = np.concatenate(
+                    [latent_model_input, batch_conditioning], axis=1
+                )
+
+            # predict the noise residual
+            timestep = np.array([t], dtype=timestep_dtype)
+            noise_pred = self.unet(
+                sample=latent_model_input,
+                timestep=timestep,
+                encoder_hidden_states=view_embeds[len(batch_views)],
+            )[0]
+
+            # perform guidance
+            if do_classifier_free_guidance:
+                noise_pred_uncond, noise_pred_text = np.split(noise_pred, 2)
+                noise_pred = noise_pred_uncond + guidance_scale * (
+                    noise_pred_text - noise_pred_uncond
+                )
+            elif len(views) > view_batch:
+                # the UNet may write the next batches into the same output buffer
+                noise_pred = np.copy(noise_pred)
+
+            noise_preds.append(noise_pred)
+
+        # compute the previous noisy sample x_t -> x_t-1 for all views at once
+        scheduler_output = self.scheduler.step(
+            torch.from_numpy(np.concatenate(noise_preds)),
+            t,
+            torch.from_numpy(view_latents),
+            **extra_step_kwargs,
+        )
+        views_denoised = scheduler_output.prev_sample.numpy()
+
+        value = np.zeros_like(latents)
+        for i, (h0, h1, w0, w1) in enumerate(views):
+            value[:, :, h0:h1, w0:w1] += views_denoised[
+                i * batch_size : (i + 1) * batch_size
+            ]
+
+        # take the MultiDiffusion step. Eq. 5 in MultiDiffusion paper: https://arxiv.org/abs/2302.08113
+        return np.where(count > 0, value / count, value)
+
     @torch.no_grad()
     def text2img(
         self,
@@ -524,58 +662,24 @@ class OnnxStableDiffusionPanoramaPipeline(DiffusionPipeline):
 
         # panorama additions
         views = self.get_views(height, width, self.window, self.stride)
-        count = np.zeros_like(latents)
-        value = np.zeros_like(latents)
+        count = self.get_views_count(latents, views)
+        view_embeds = self.get_view_embeds(
+            prompt_embeds, len(views), latents.shape[0], do_classifier_free_guidance
+        )
 
         for i, t in enumerate(self.progress_bar(self.scheduler.timesteps)):
-            count.fill(0)
-            value.fill(0)
-
-            for h_start, h_end, w_start, w_end in views:
-                # get the latents corresponding to the current view coordinates
-                latents_for_view = latents[:, :, h_start:h_end, w_start:w_end]
-
-                # expand the latents if we are doing classifier free guidance
-                latent_model_input = (
-                    np.concatenate([latents_for_view] * 2)
-                    if do_classifier_free_guidance
-                    else latents_for_view
-                )
-                latent_model_input = self.scheduler.scale_model_input(
-                    torch.from_numpy(latent_model_input), t
-                )
-                latent_model_input = latent_model_input.cpu().numpy()
-
-                # predict the noise residual
-                timestep = np.array([t], dtype=timestep_dtype)
-                noise_pred = self.unet(
-                    sample=latent_model_input,
-                    timestep=timestep,
-                    encoder_hidden_states=prompt_embeds,
-                )
-                noise_pred = noise_pred[0]
-
-                # perform guidance
-                if do_classifier_free_guidance:
-                    noise_pred_uncond, noise_pred_text = np.split(noise_pred, 2)
-                    noise_pred = noise_pred_uncond + guidance_scale * (
-                        noise_pred_text - noise_pred_uncond
-                    )
-
-                # compute the previous noisy sample x_t -> x_t-1
-                scheduler_output = self.scheduler.step(
-                    torch.from_numpy(noise_pred),
-                    t,
-                    torch.from_numpy(latents_for_view),
-                    **extra_step_kwargs,
-                )
-                latents_view_denoised = scheduler_output.prev_sample.numpy()
-
-                value[:, :, h_start:h_end, w_start:w_end] += latents_view_denoised
-                count[:, :, h_start:h_end, w_start:w_end] += 1
-
-            # take the MultiDiffusion step. Eq. 5 in MultiDiffusion paper: https://arxiv.org/abs/2302.08113
-            latents = np.where(count > 0, value / count, value)
+            latents = self.denoise_views(
+                latents,
+                t,
+                views,
+                count,
+                prompt_embeds,
+                guidance_scale,
+                do_classifier_free_guidance,
+                timestep_dtype,
+                extra_step_kwargs,
+                view_embeds=view_embeds,
+            )
 
             # call the callback, if provided
             if callback is not None and i % callback_steps == 0:
@@ -827,58 +931,24 @@ class OnnxStableDiffusionPanoramaPipeline(DiffusionPipeline):
 
         # panorama additions
         views = self.get_views(height, width, self.window, self.stride)
-        count = np.zeros_like(latents)
-        value = np.zeros_like(latents)
+        count = self.get_views_count(latents, views)
+        view_embeds = self.get_view_embeds(
+            prompt_embeds, len(views), latents.shape[0], do_classifier_free_guidance
+        )
 
         for i, t in enumerate(self.progress_bar(timesteps)):
-            count.fill(0)
-            value.fill(0)
-
-            for h_start, h_end, w_start, w_end in views:
-                # get the latents corresponding to the current view coordinates
-                latents_for_view = latents[:, :, h_start:h_end, w_start:w_end]
-
-                # expand the latents if we are doing classifier free guidance
-                latent_model_input = (
-                    np.concatenate([latents_for_view] * 2)
-                    if do_classifier_free_guidance
-                    else latents_for_view
-                )
-                latent_model_input = self.scheduler.scale_model_input(
-                    torch.from_numpy(latent_model_input), t
-                )
-                latent_model_input = latent_model_input.cpu().numpy()
-
-                # predict the noise residual
-                timestep = np.array([t], dtype=timestep_dtype)
-                noise_pred = self.unet(
-                    sample=latent_model_input,
-                    timestep=timestep,
-                    encoder_hidden_states=prompt_embeds,
-                )
-                noise_pred = noise_pred[0]
-
-                # perform guidance
-                if do_classifier_free_guidance:
-                    noise_pred_uncond, noise_pred_text = np.split(noise_pred, 2)
-                    noise_pred = noise_pred_uncond + guidance_scale * (
-                        noise_pred_text - noise_pred_uncond
-                    )
-
-                # compute the previous noisy sample x_t -> x_t-1
-                scheduler_output = self.scheduler.step(
-                    torch.from_numpy(noise_pred),
-                    t,
-                    torch.from_numpy(latents_for_view),
-                    **extra_step_kwargs,
-                )
-                latents_view_denoised = scheduler_output.prev_sample.numpy()
-
-                value[:, :, h_start:h_end, w_start:w_end] += latents_view_denoised
-                count[:, :, h_start:h_end, w_start:w_end] += 1
-
-            # take the MultiDiffusion step. Eq. 5 in MultiDiffusion paper: https://arxiv.org/abs/2302.08113
-            latents = np.where(count > 0, value / count, value)
+            latents = self.denoise_views(
+                latents,
+                t,
+                views,
+                count,
+                prompt_embeds,
+                guidance_scale,
+                do_classifier_free_guidance,
+                timestep_dtype,
+                extra_step_kwargs,
+                view_embeds=view_embeds,
+            )
 
             # call the callback, if provided
             if callback is not None and i % callback_steps == 0:
@@ -1090,6 +1160,8 @@ class OnnxStableDiffusionPanoramaPipeline(DiffusionPipeline):
             else masked_image_latents
         )
 
+        conditioning = np.concatenate([mask, masked_image_latents], axis=1)
+
         num_channels_mask = mask.shape[1]
         num_channels_masked_image = masked_image_latents.shape[1]
 
@@ -1135,65 +1207,25 @@ class OnnxStableDiffusionPanoramaPipeline(DiffusionPipeline):
 
         # panorama additions
         views = self.get_views(height, width, self.window, self.stride)
-        count = np.zeros_like(latents)
-        value = np.zeros_like(latents)
+        count = self.get_views_count(latents, views)
+        view_embeds = self.get_view_embeds(
+            prompt_embeds, len(views), latents.shape[0], do_classifier_free_guidance
+        )
 
         for i, t in enumerate(self.progress_bar(self.scheduler.timesteps)):
-            count.fill(0)
-            value.fill(0)
-
-            for h_start, h_end, w_start, w_end in views:
-                # get the latents corresponding to the current view coordinates
-                latents_for_view = latents[:, :, h_start:h_end, w_start:w_end]
-                mask_for_view = mask[:, :, h_start:h_end, w_start:w_end]
-                masked_latents_for_view = masked_image_latents[
-                    :, :, h_start:h_end, w_start:w_end
-                ]
-
-                # expand the latents if we are doing classifier free guidance
-                latent_model_input = (
-                    np.concatenate([latents_for_view] * 2)
-                    if do_classifier_free_guidance
-                    else latents_for_view
-                )
-                # concat latents, mask, masked_image_latnets in the channel dimension
-                latent_model_input = self.scheduler.scale_model_input(
-                    torch.from_numpy(latent_model_input), t
-                )
-                latent_model_input = latent_model_input.cpu().numpy()
-                latent_model_input = np.concatenate(
-                    [latent_model_input, mask_for_view, masked_latents_for_view], axis=1
-                )
-
-                # predict the noise residual
-                timestep = np.array([t], dtype=timestep_dtype)
-                noise_pred = self.unet(
-                    sample=latent_model_input,
-                    timestep=timestep,
-                    encoder_hidden_states=prompt_embeds,
-                )[0]
-
-                # perform guidance
-                if do_classifier_free_guidance:
-                    noise_pred_uncond, noise_pred_text = np.split(noise_pred, 2)
-                    noise_pred = noise_pred_uncond + guidance_scale * (
-                        noise_pred_text - noise_pred_uncond
-                    )
-
-                # compute the previous noisy sample x_t -> x_t-1
-                scheduler_output = self.scheduler.step(
-                    torch.from_numpy(noise_pred),
-                    t,
-                    torch.from_numpy(latents_for_view),
-                    **extra_step_kwargs,
-                )
-                latents_view_denoised = scheduler_output.prev_sample.numpy()
-
-                value[:, :, h_start:h_end, w_start:w_end] += latents_view_denoised
-                count[:, :, h_start:h_end, w_start:w_end] += 1
-
-            # take the MultiDiffusion step. Eq. 5 in MultiDiffusion paper: https://arxiv.org/abs/2302.08113
-            latents = np.where(count > 0, value / count, value)
+            latents = self.denoise_views(
+                latents,
+                t,
+                views,
+                count,
+                prompt_embeds,
+                guidance_scale,
+                do_classifier_free_guidance,
+                timestep_dtype,
+                extra_step_kwargs,
+                conditioning=conditioning,
+                view_embeds=view_embeds,
+            )
 
             # call the callback, if provided
             if callback is not None and i % callback_steps == 0:
@@ -1261,3 +1293,6 @@ class OnnxStableDiffusionPanoramaPipeline(DiffusionPipeline):
     def set_window_size(self, window: int, stride: int):
         self.window = window
         self.stride = stride
+
+    def set_view_batch(self, pixels: int):
+        self.view_batch_pixels = pixels
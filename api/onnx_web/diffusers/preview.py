@@ -0,0 +1,47 @@
+from io import BytesIO
+from logging import getLogger
+from typing import Any
+
+import numpy as np
+from PIL import Image
+
+logger = getLogger(__name__)
+
+# approximate contribution of each SD v1/v2 VAE latent channel to RGB
+LATENT_RGB_FACTORS = np.array(
+    [
+        [0.3512, 0.2297, 0.3227],
+        [0.3250, 0.4974, 0.2350],
+        [-0.2829, 0.1762, 0.2721],
+        [-0.2120, -0.2616, -0.7177],
+    ],
+    dtype=np.float32,
+)
+PREVIEW_QUALITY = 75
+
+
+def decode_latent_preview(latents: Any) -> Image.Image:
+    """
+    Project latents to RGB with a linear approximation of the VAE decoder, at the latent resolution.
+
+    Images in a batch are placed side by side.
+    """
+    latents = np.asarray(latents, dtype=np.float32)
+    if latents.ndim == 3:
+        latents = latents[np.newaxis, ...]
+
+    batch, channels, height, width = latents.shape
+    if channels != LATENT_RGB_FACTORS.shape[0]:
+        raise ValueError(f"cannot preview latents with {channels} channels")
+
+    rgb = np.einsum("bchw,cr->hbwr", latents, LATENT_RGB_FACTORS)
+    rgb = rgb.reshape((height, batch * width, 3))
+    rgb = np.clip((rgb + 1.0) * 127.5, 0, 255).astype(np.uint8)
+
+    return Image.fromarray(rgb, "RGB")
+
+
+def encode_latent_preview(latents: Any, quality: int = PREVIEW_QUALITY) -> bytes:
+    output = BytesIO()
+    decode_latent_preview(latents).save(output, format="JPEG", quality=quality)
+    return output.getvalue()
@@ -21,10 +21,16 @@ from ..server import ServerContext
 from ..server.load import get_source_filters
 from ..utils import run_gc, show_system_toast
 from ..worker import WorkerContext
+from ..worker.command import JobCommand
 from ..worker.context import ProgressCallback
 from .load import load_pipeline
 from .upscale import run_upscale_correction
-from .utils import encode_prompt, get_latents_from_seed, parse_prompt
+from .utils import (
+    encode_prompt,
+    get_latents_from_seed,
+    merge_prompt_embeds,
+    parse_prompt,
+)
 
 logger = getLogger(__name__)
 
@@ -286,11 +292,47 @@ def run_txt2img_pipeline(
             callback=progress,
         )
 
-    image_outputs = list(zip(result.images, outputs))
+    images = result.images
     del result
     del pipe
 
-    for image, output in image_outputs:
+    dest = run_txt2img_outputs(
+        job,
+        server,
+        params,
+        size,
+        upscale,
+        highres,
+        images,
+        outputs,
+        progress,
+        inversions,
+        loras,
+    )
+
+    run_gc([job.get_device()])
+    show_system_toast(f"finished txt2img job: {dest}")
+    logger.info("finished txt2img job: %s", dest)
+
+
+def run_txt2img_outputs(
+    job: WorkerContext,
+    server: ServerContext,
+    params: ImageParams,
+    size: Size,
+    upscale: UpscaleParams,
+    highres: HighresParams,
+    images: List[Image.Image],
+    outputs: List[str],
+    progress: ProgressCallback,
+    inversions: List[Tuple[str, float]],
+    loras: List[Tuple[str, float]],
+) -> Optional[str]:
+    """
+    Run highres and upscaling on the images from a txt2img pipeline, then save them.
+    """
+    dest = None
+    for image, output in zip(images, outputs):
         image = run_highres(
             job,
             server,
@@ -326,9 +368,112 @@ def run_txt2img_pipeline(
             loras=loras,
         )
 
+    return dest
+
+
+def run_txt2img_batch(
+    job: WorkerContext,
+    jobs: List[JobCommand],
+) -> None:
+    """
+    Run several compatible txt2img jobs through one denoising loop, then split the images and finish each job
+    with its own params and outputs. Jobs whose prompts cannot be batched together are run one at a time.
+    """
+    server, params, size, _outputs, _upscale, _highres = jobs[0].args
+
+    pipe_type = params.get_valid_pipeline("txt2img")
+    logger.debug("using %s pipeline for %s txt2img jobs", pipe_type, len(jobs))
+
+    # coalesced jobs use the same networks, but each one keeps its own prompts
+    prompts = [parse_prompt(member.args[1]) for member in jobs]
+    _prompt_pairs, loras, inversions = prompts[0]
+
+    pipe = load_pipeline(
+        server,
+        params,
+        pipe_type,
+        job.get_device(),
+        inversions=inversions,
+        loras=loras,
+    )
+    progress = job.get_progress_callback()
+
+    job_embeds = []
+    job_latents = []
+    for member, (prompt_pairs, _loras, _inversions) in zip(jobs, prompts):
+        member_params: ImageParams = member.args[1]
+        job_embeds.append(
+            encode_prompt(
+                pipe,
+                prompt_pairs,
+                num_images_per_prompt=member_params.batch,
+                do_classifier_free_guidance=params.do_cfg(),
+            )
+        )
+        job_latents.append(
+            get_latents_from_seed(member_params.seed, size, batch=member_params.batch)
+        )
+
+    prompt_embeds = merge_prompt_embeds(job_embeds, params.do_cfg())
+    if prompt_embeds is None:
+        logger.info(
+            "prompts cannot be batched together, running %s jobs one at a time",
+            len(jobs),
+        )
+        del pipe
+
+        for member in jobs:
+            member.fn(job, *member.args, **member.kwargs)
+
+        return
+
+    latents = np.concatenate(job_latents)
+    pipe.unet.set_prompts(prompt_embeds)
+
+    # split the previews, so each job only sees its own images
+    job.set_batches([member.args[1].batch for member in jobs])
+
+    rng = np.random.RandomState(params.seed)
+    result = pipe(
+        params.prompt,
+        height=size.height,
+        width=size.width,
+        generator=rng,
+        guidance_scale=params.cfg,
+        latents=latents,
+        negative_prompt=params.negative_prompt,
+        num_images_per_prompt=latents.shape[0],
+        num_inference_steps=params.steps,
+        eta=params.eta,
+        callback=progress,
+    )
+
+    images = result.images
+    del result
+    del pipe
+
+    for member, (_prompt_pairs, loras, inversions) in zip(jobs, prompts):
+        _server, member_params, _size, outputs, upscale, highres = member.args
+        member_images = images[: member_params.batch]
+        images = images[member_params.batch :]
+
+        dest = run_txt2img_outputs(
+            job,
+            server,
+            member_params,
+            size,
+            upscale,
+            highres,
+            member_images,
+            outputs,
+            progress,
+            inversions,
+            loras,
+        )
+        logger.info("finished txt2img job %s in batch: %s", member.name, dest)
+
     run_gc([job.get_device()])
-    show_system_toast(f"finished txt2img job: {dest}")
-    logger.info("finished txt2img job: %s", dest)
+    show_system_toast(f"finished {len(jobs)} txt2img jobs")
 
 
 def run_img2img_pipeline(
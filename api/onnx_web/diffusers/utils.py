@@ -1,13 +1,15 @@
+from hashlib import sha256
 from logging import getLogger
-from math import ceil
+from math import ceil, gcd
 from re import Pattern, compile
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 import torch
 from diffusers import OnnxStableDiffusionPipeline
 
 from ..params import ImageParams, Size
+from ..server.model_cache import ModelCache
 
 logger = getLogger(__name__)
 
@@ -71,47 +73,34 @@ def expand_alternative_ranges(prompt: str) -> List[str]:
     return prompts
 
 
-@torch.no_grad()
-def expand_prompt(
-    self: OnnxStableDiffusionPipeline,
-    prompt: str,
-    num_images_per_prompt: int,
-    do_classifier_free_guidance: bool,
-    negative_prompt: Optional[str] = None,
-    prompt_embeds: Optional[np.ndarray] = None,
-    negative_prompt_embeds: Optional[np.ndarray] = None,
-    skip_clip_states: Optional[int] = 0,
-) -> "np.NDArray":
-    # self provides:
-    #   tokenizer: CLIPTokenizer
-    #   encoder: OnnxRuntimeModel
+TokenGroup = Tuple[np.ndarray, int]  # token ids and the number of CLIP layers to skip
 
-    prompt, clip_tokens = get_tokens_from_prompt(prompt, CLIP_TOKEN)
-    if len(clip_tokens) > 0:
-        skip_clip_states = int(clip_tokens[0][1])
-        logger.info("skipping %s CLIP layers", skip_clip_states)
-
-    batch_size = len(prompt) if isinstance(prompt, list) else 1
-    prompt = expand_interval_ranges(prompt)
-
-    # split prompt into 75 token chunks
-    tokens = self.tokenizer(
-        prompt,
-        padding="max_length",
-        return_tensors="np",
-        max_length=self.tokenizer.model_max_length,
-        truncation=False,
-    )
 
-    groups_count = ceil(tokens.input_ids.shape[1] / MAX_TOKENS_PER_GROUP)
-    logger.trace("splitting %s into %s groups", tokens.input_ids.shape, groups_count)
+def get_encoder_batch_limit(self: OnnxStableDiffusionPipeline) -> int:
+    """
+    Get the static batch size of the text encoder, or 0 if the batch axis is dynamic.
+    """
+    session = getattr(self.text_encoder, "model", None)
+    if session is None or not hasattr(session, "get_inputs"):
+        return 0
+
+    batch = session.get_inputs()[0].shape[0]
+    if isinstance(batch, int):
+        return batch
+
+    return 0
+
+
+def split_token_groups(input_ids: np.ndarray) -> List[np.ndarray]:
+    groups_count = ceil(input_ids.shape[1] / MAX_TOKENS_PER_GROUP)
+    logger.trace("splitting %s into %s groups", input_ids.shape, groups_count)
 
     groups = []
     # np.array_split(tokens.input_ids, groups_count, axis=1)
     for i in range(groups_count):
         group_start = i * MAX_TOKENS_PER_GROUP
         group_end = min(
-            group_start + MAX_TOKENS_PER_GROUP, tokens.input_ids.shape[1]
+            group_start + MAX_TOKENS_PER_GROUP, input_ids.shape[1]
         )  # or should this be 1?
         logger.trace("building group for token slice [%s : %s]", group_start, group_end)
 
@@ -119,100 +108,243 @@ def expand_prompt(
         if group_size < MAX_TOKENS_PER_GROUP:
             pass  # TODO: pad short groups
 
-        groups.append(tokens.input_ids[:, group_start:group_end])
+        groups.append(input_ids[:, group_start:group_end])
+
+    return groups
+
+
+def encode_tokens(
+    self: OnnxStableDiffusionPipeline,
+    groups: List[TokenGroup],
+) -> List[np.ndarray]:
+    """
+    Run the text encoder for many groups of tokens, reusing the embeddings from an earlier prompt when the same
+    tokens have been encoded by the same text encoder.
 
-    # encode each chunk
-    logger.trace("group token shapes: %s", [t.shape for t in groups])
-    group_embeds = []
-    for group in groups:
-        logger.trace("encoding group: %s", group.shape)
+    The remaining groups are padded to the same length and stacked into as few batches as the text encoder
+    allows. CLIP uses a causal attention mask, so padding the end of a group does not change the embeddings
+    of the tokens before it.
+    """
+    cache: Optional[ModelCache] = getattr(self, "prompt_cache", None)
+    encoder_key = getattr(self, "text_encoder_key", None)
+    use_cache = cache is not None and encoder_key is not None
+
+    results: List[Optional[np.ndarray]] = [None] * len(groups)
+    missing: Dict[Any, List[int]] = {}
+    for i, (input_ids, skip_clip_states) in enumerate(groups):
+        token_hash = sha256(input_ids.astype(np.int32).tobytes()).hexdigest()
+        cache_key = (encoder_key, input_ids.shape, token_hash, skip_clip_states)
+        if use_cache:
+            results[i] = cache.get("prompt", cache_key)
+
+        if results[i] is None:
+            missing.setdefault(cache_key, []).append(i)
+
+    if len(missing) == 0:
+        return results
+
+    # encode each unique group once
+    batch_groups = [groups[indices[0]] for indices in missing.values()]
+    length = max(input_ids.shape[1] for input_ids, _skip in batch_groups)
+    batch_ids = np.concatenate(
+        [
+            np.pad(input_ids, [(0, 0), (0, length - input_ids.shape[1])], mode="edge")
+            for input_ids, _skip in batch_groups
+        ]
+    ).astype(np.int32)
 
-        text_result = self.text_encoder(input_ids=group.astype(np.int32))
+    batch_limit = get_encoder_batch_limit(self) or batch_ids.shape[0]
+    batch_results = []
+    for batch_start in range(0, batch_ids.shape[0], batch_limit):
         logger.trace(
-            "text encoder produced %s outputs: %s",
-            len(text_result),
-            [t.shape for t in text_result],
+            "encoding batch of tokens: %s",
+            batch_ids[batch_start : batch_start + batch_limit].shape,
+        )
+        batch_results.append(
+            self.text_encoder(
+                input_ids=batch_ids[batch_start : batch_start + batch_limit]
+            )
         )
 
-        last_state, _pooled_output, *hidden_states = text_result
+    text_result = [np.concatenate(outputs) for outputs in zip(*batch_results)]
+    logger.trace(
+        "text encoder produced %s outputs: %s",
+        len(text_result),
+        [t.shape for t in text_result],
+    )
+
+    last_state, _pooled_output, *hidden_states = text_result
+
+    offset = 0
+    for (cache_key, indices), (input_ids, skip_clip_states) in zip(
+        missing.items(), batch_groups
+    ):
+        rows, count = input_ids.shape
         if skip_clip_states > 0:
+            skip_state = hidden_states[-skip_clip_states][
+                offset : offset + rows, :count
+            ]
             layer_norm = torch.nn.LayerNorm(last_state.shape[2])
             norm_state = layer_norm(
-                torch.from_numpy(
-                    hidden_states[-skip_clip_states].astype(np.float32)
-                ).detach()
+                torch.from_numpy(skip_state.astype(np.float32)).detach()
             )
             logger.trace(
                 "normalized results after skipping %s layers: %s",
                 skip_clip_states,
                 norm_state.shape,
             )
-            group_embeds.append(
-                norm_state.numpy().astype(hidden_states[-skip_clip_states].dtype)
-            )
-        else:
-            group_embeds.append(last_state)
-
-    # concat those embeds
-    logger.trace("group embeds shape: %s", [t.shape for t in group_embeds])
-    prompt_embeds = np.concatenate(group_embeds, axis=1)
-    prompt_embeds = np.repeat(prompt_embeds, num_images_per_prompt, axis=0)
-
-    # get unconditional embeddings for classifier free guidance
-    if do_classifier_free_guidance:
-        uncond_tokens: List[str]
-        if negative_prompt is None:
-            uncond_tokens = [""] * batch_size
-        elif type(prompt) is not type(negative_prompt):
-            raise TypeError(
-                f"`negative_prompt` should be the same type to `prompt`, but got {type(negative_prompt)} !="
-                f" {type(prompt)}."
-            )
-        elif isinstance(negative_prompt, str):
-            uncond_tokens = [negative_prompt] * batch_size
-        elif batch_size != len(negative_prompt):
-            raise ValueError(
-                f"`negative_prompt`: {negative_prompt} has batch size {len(negative_prompt)}, but `prompt`:"
-                f" {prompt} has batch size {batch_size}. Please make sure that passed `negative_prompt` matches"
-                " the batch size of `prompt`."
-            )
+            embeds = norm_state.numpy().astype(skip_state.dtype)
         else:
-            uncond_tokens = negative_prompt
+            embeds = last_state[offset : offset + rows, :count].copy()
+
+        offset += rows
+
+        if use_cache:
+            cache.set("prompt", cache_key, embeds, size=embeds.nbytes)
+
+        for i in indices:
+            results[i] = embeds
+
+    return results
+
+
+@torch.no_grad()
+def expand_prompts(
+    self: OnnxStableDiffusionPipeline,
+    prompt_pairs: List[Tuple[str, Optional[str]]],
+    num_images_per_prompt: int,
+    do_classifier_free_guidance: bool,
+    skip_clip_states: Optional[int] = 0,
+) -> List[np.ndarray]:
+    """
+    Encode the prompt and negative prompt for each pair, running the text encoder for all of them together.
+    """
+    # self provides:
+    #   tokenizer: CLIPTokenizer
+    #   encoder: OnnxRuntimeModel
+
+    groups: List[TokenGroup] = []
+    pair_groups: List[Tuple[List[int], Optional[int], Tuple[int, int]]] = []
+    for prompt, negative_prompt in prompt_pairs:
+        prompt_skip = skip_clip_states
+        prompt, clip_tokens = get_tokens_from_prompt(prompt, CLIP_TOKEN)
+        if len(clip_tokens) > 0:
+            prompt_skip = int(clip_tokens[0][1])
+            logger.info("skipping %s CLIP layers", prompt_skip)
+
+        batch_size = len(prompt) if isinstance(prompt, list) else 1
+        prompt = expand_interval_ranges(prompt)
 
-        uncond_input = self.tokenizer(
-            uncond_tokens,
+        # split prompt into 75 token chunks
+        tokens = self.tokenizer(
+            prompt,
             padding="max_length",
-            max_length=self.tokenizer.model_max_length,
-            truncation=True,
             return_tensors="np",
+            max_length=self.tokenizer.model_max_length,
+            truncation=False,
         )
-        negative_prompt_embeds = self.text_encoder(
-            input_ids=uncond_input.input_ids.astype(np.int32)
-        )[0]
-        negative_padding = tokens.input_ids.shape[1] - negative_prompt_embeds.shape[1]
+
+        prompt_groups = split_token_groups(tokens.input_ids)
+        logger.trace("group token shapes: %s", [t.shape for t in prompt_groups])
+
+        positive = list(range(len(groups), len(groups) + len(prompt_groups)))
+        groups.extend((group, prompt_skip) for group in prompt_groups)
+
+        # get unconditional embeddings for classifier free guidance
+        negative = None
+        if do_classifier_free_guidance:
+            uncond_tokens: List[str]
+            if negative_prompt is None:
+                uncond_tokens = [""] * batch_size
+            elif type(prompt) is not type(negative_prompt):
+                raise TypeError(
+                    f"`negative_prompt` should be the same type to `prompt`, but got {type(negative_prompt)} !="
+                    f" {type(prompt)}."
+                )
+            elif isinstance(negative_prompt, str):
+                uncond_tokens = [negative_prompt] * batch_size
+            elif batch_size != len(negative_prompt):
+                raise ValueError(
+                    f"`negative_prompt`: {negative_prompt} has batch size {len(negative_prompt)}, but `prompt`:"
+                    f" {prompt} has batch size {batch_size}. Please make sure that passed `negative_prompt` matches"
+                    " the batch size of `prompt`."
+                )
+            else:
+                uncond_tokens = negative_prompt
+
+            uncond_input = self.tokenizer(
+                uncond_tokens,
+                padding="max_length",
+                max_length=self.tokenizer.model_max_length,
+                truncation=True,
+                return_tensors="np",
+            )
+
+            negative = len(groups)
+            groups.append((uncond_input.input_ids, 0))
+
+        pair_groups.append((positive, negative, tokens.input_ids.shape))
+
+    # encode every chunk at once
+    group_embeds = encode_tokens(self, groups)
+
+    results = []
+    for positive, negative, input_shape in pair_groups:
+        # concat those embeds
         logger.trace(
-            "padding negative prompt to match input: %s, %s, %s extra tokens",
-            tokens.input_ids.shape,
-            negative_prompt_embeds.shape,
-            negative_padding,
-        )
-        negative_prompt_embeds = np.pad(
-            negative_prompt_embeds,
-            [(0, 0), (0, negative_padding), (0, 0)],
-            mode="constant",
-            constant_values=0,
-        )
-        negative_prompt_embeds = np.repeat(
-            negative_prompt_embeds, num_images_per_prompt, axis=0
+            "group embeds shape: %s", [group_embeds[i].shape for i in positive]
         )
+        prompt_embeds = np.concatenate([group_embeds[i] for i in positive], axis=1)
+        prompt_embeds = np.repeat(prompt_embeds, num_images_per_prompt, axis=0)
+
+        if negative is not None:
+            negative_prompt_embeds = group_embeds[negative]
+            negative_padding = input_shape[1] - negative_prompt_embeds.shape[1]
+            logger.trace(
+                "padding negative prompt to match input: %s, %s, %s extra tokens",
+                input_shape,
+                negative_prompt_embeds.shape,
+                negative_padding,
+            )
+            negative_prompt_embeds = np.pad(
+                negative_prompt_embeds,
+                [(0, 0), (0, negative_padding), (0, 0)],
+                mode="constant",
+                constant_values=0,
+            )
+            negative_prompt_embeds = np.repeat(
+                negative_prompt_embeds, num_images_per_prompt, axis=0
+            )
+
+            # For classifier free guidance, we need to do two forward passes.
+            # Here we concatenate the unconditional and text embeddings into a single batch
+            # to avoid doing two forward passes
+            prompt_embeds = np.concatenate([negative_prompt_embeds, prompt_embeds])
+
+        logger.trace("expanded prompt shape: %s", prompt_embeds.shape)
+        results.append(prompt_embeds)
 
-        # For classifier free guidance, we need to do two forward passes.
-        # Here we concatenate the unconditional and text embeddings into a single batch
-        # to avoid doing two forward passes
-        prompt_embeds = np.concatenate([negative_prompt_embeds, prompt_embeds])
+    return results
 
-    logger.trace("expanded prompt shape: %s", prompt_embeds.shape)
-    return prompt_embeds
+
+@torch.no_grad()
+def expand_prompt(
+    self: OnnxStableDiffusionPipeline,
+    prompt: str,
+    num_images_per_prompt: int,
+    do_classifier_free_guidance: bool,
+    negative_prompt: Optional[str] = None,
+    prompt_embeds: Optional[np.ndarray] = None,
+    negative_prompt_embeds: Optional[np.ndarray] = None,
+    skip_clip_states: Optional[int] = 0,
+) -> "np.NDArray":
+    return expand_prompts(
+        self,
+        [(prompt, negative_prompt)],
+        num_images_per_prompt,
+        do_classifier_free_guidance,
+        skip_clip_states=skip_clip_states,
+    )[0]
 
 
 def get_tokens_from_prompt(
@@ -247,6 +379,41 @@ def get_inversions_from_prompt(prompt: str) -> Tuple[str, List[Tuple[str, float]
     return get_tokens_from_prompt(prompt, INVERSION_TOKEN)
 
 
+def merge_prompt_embeds(
+    job_embeds: List[List[np.ndarray]],
+    do_classifier_free_guidance: bool = True,
+) -> Optional[List[np.ndarray]]:
+    """
+    Merge the prompt embeddings for several jobs into one batch, with the negative embeddings for every job
+    ahead of the positive ones. The alternative prompts for each job are repeated until they line up, so every
+    UNet step still uses the right alternative for each job.
+
+    Returns None if the embeddings cannot be concatenated, like prompts that were padded to different lengths.
+    """
+    shapes = set(
+        embeds.shape[1:] for alternatives in job_embeds for embeds in alternatives
+    )
+    if len(shapes) > 1:
+        logger.debug("cannot merge prompt embeddings with shapes: %s", shapes)
+        return None
+
+    count = 1
+    for alternatives in job_embeds:
+        count = count * len(alternatives) // gcd(count, len(alternatives))
+
+    merged = []
+    for i in range(count):
+        step = [alternatives[i % len(alternatives)] for alternatives in job_embeds]
+        if do_classifier_free_guidance:
+            negative = [embeds[: embeds.shape[0] // 2] for embeds in step]
+            positive = [embeds[embeds.shape[0] // 2 :] for embeds in step]
+            merged.append(np.concatenate(negative + positive))
+        else:
+            merged.append(np.concatenate(step))
+
+    return merged
+
+
 def get_latents_from_seed(seed: int, size: Size, batch: int = 1) -> np.ndarray:
     """
     From https://www.travelneil.com/stable-diffusion-updates.html.
@@ -352,6 +519,15 @@ def encode_prompt(
     num_images_per_prompt: int = 1,
     do_classifier_free_guidance: bool = True,
 ) -> List[np.ndarray]:
+    # pipelines using expand_prompt can encode all of the pairs together
+    if getattr(pipe._encode_prompt, "__func__", None) is expand_prompt:
+        return expand_prompts(
+            pipe,
+            prompt_pairs,
+            num_images_per_prompt=num_images_per_prompt,
+            do_classifier_free_guidance=do_classifier_free_guidance,
+        )
+
     return [
         pipe._encode_prompt(
             prompt,
@@ -1,12 +1,17 @@
+from typing import Optional
+
 import numpy as np
-from numpy import random
 from PIL import Image, ImageFilter
 
 from ..params import Point
 
 
-def get_pixel_index(x: int, y: int, width: int) -> int:
-    return (y * width) + x
+def get_noise_generator(seed: Optional[int] = None) -> np.random.Generator:
+    """
+    Create a random generator for noise sources. The same seed will produce the same noise, while a seed
+    of None will draw fresh entropy from the OS.
+    """
+    return np.random.default_rng(seed)
 
 
 def noise_source_fill_edge(
@@ -37,12 +42,17 @@ def noise_source_fill_mask(
 
 
 def noise_source_gaussian(
-    source: Image.Image, dims: Point, origin: Point, rounds=3, **kw
+    source: Image.Image,
+    dims: Point,
+    origin: Point,
+    rounds=3,
+    seed: Optional[int] = None,
+    **kw
 ) -> Image.Image:
     """
     Gaussian blur, source image centered on white canvas.
     """
-    noise = noise_source_uniform(source, dims, origin)
+    noise = noise_source_uniform(source, dims, origin, seed=seed)
     noise.paste(source, origin)
 
     for _i in range(rounds):
@@ -52,71 +62,46 @@ def noise_source_gaussian(
 
 
 def noise_source_uniform(
-    _source: Image.Image, dims: Point, _origin: Point, **kw
+    _source: Image.Image, dims: Point, _origin: Point, seed: Optional[int] = None, **kw
 ) -> Image.Image:
     width, height = dims
-    size = width * height
+    rng = get_noise_generator(seed)
 
-    noise_r = random.uniform(0, 256, size=size)
-    noise_g = random.uniform(0, 256, size=size)
-    noise_b = random.uniform(0, 256, size=size)
+    noise = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
 
-    noise = Image.new("RGB", (width, height))
-
-    for x in range(width):
-        for y in range(height):
-            i = get_pixel_index(x, y, width)
-            noise.putpixel((x, y), (int(noise_r[i]), int(noise_g[i]), int(noise_b[i])))
-
-    return noise
+    return Image.fromarray(noise, "RGB")
 
 
 def noise_source_normal(
-    _source: Image.Image, dims: Point, _origin: Point, **kw
+    _source: Image.Image, dims: Point, _origin: Point, seed: Optional[int] = None, **kw
 ) -> Image.Image:
     width, height = dims
-    size = width * height
-
-    noise_r = random.normal(128, 32, size=size)
-    noise_g = random.normal(128, 32, size=size)
-    noise_b = random.normal(128, 32, size=size)
+    rng = get_noise_generator(seed)
 
-    noise = Image.new("RGB", (width, height))
+    noise = rng.normal(128, 32, size=(height, width, 3))
+    noise = np.clip(noise, 0, 255).astype(np.uint8)
 
-    for x in range(width):
-        for y in range(height):
-            i = get_pixel_index(x, y, width)
-            noise.putpixel((x, y), (int(noise_r[i]), int(noise_g[i]), int(noise_b[i])))
-
-    return noise
+    return Image.fromarray(noise, "RGB")
 
 
 def noise_source_histogram(
-    source: Image.Image, dims: Point, _origin: Point, **kw
+    source: Image.Image, dims: Point, _origin: Point, seed: Optional[int] = None, **kw
 ) -> Image.Image:
-    r, g, b = source.split()
+    """
+    Noise with the same color distribution as the source image, sampled separately for each channel.
+    """
     width, height = dims
-    size = width * height
+    rng = get_noise_generator(seed)
 
-    hist_r = r.histogram()
-    hist_g = g.histogram()
-    hist_b = b.histogram()
+    channels = []
+    for channel in source.convert("RGB").split():
+        hist = np.array(channel.histogram(), dtype=np.float64)
+        channels.append(
+            rng.choice(256, p=hist / np.sum(hist), size=(height, width)).astype(
+                np.uint8
+            )
+        )
 
-    noise_r = random.choice(
-        256, p=np.divide(np.copy(hist_r), np.sum(hist_r)), size=size
-    )
-    noise_g = random.choice(
-        256, p=np.divide(np.copy(hist_g), np.sum(hist_g)), size=size
-    )
-    noise_b = random.choice(
-        256, p=np.divide(np.copy(hist_b), np.sum(hist_b)), size=size
-    )
+    noise = np.stack(channels, axis=-1)
 
-    noise = Image.new("RGB", (width, height))
-
-    for x in range(width):
-        for y in range(height):
-            i = get_pixel_index(x, y, width)
-            noise.putpixel((x, y), (noise_r[i], noise_g[i], noise_b[i]))
-
-    return noise
+    return Image.fromarray(noise, "RGB")
@@ -2,6 +2,7 @@
 
 from logging import getLogger
 from os import path
+from typing import Optional
 
 import cv2
 import numpy as np
@@ -46,8 +47,9 @@ def source_filter_noise(
     server: ServerContext,
     source: Image.Image,
     strength: float = 0.5,
+    seed: Optional[int] = None,
 ):
-    noise = noise_source_histogram(source, source.size)
+    noise = noise_source_histogram(source, source.size, (0, 0), seed=seed)
     return ImageChops.blend(source, noise, strength)
 
 
@@ -1,4 +1,4 @@
-from typing import Tuple, Union
+from typing import Optional, Tuple, Union
 
 from PIL import Image, ImageChops, ImageOps
 
@@ -15,6 +15,7 @@ def expand_image(
     fill="white",
     noise_source=noise_source_histogram,
     mask_filter=mask_filter_none,
+    seed: Optional[int] = None,
 ):
     size = Size(*source.size).add_border(expand).round_to_tile()
     size = tuple(size)
@@ -25,7 +26,7 @@ def expand_image(
 
     # new mask pixels need to be filled with white so they will be replaced
     full_mask = mask_filter(mask, size, origin, fill="white")
-    full_noise = noise_source(source, size, origin, fill=fill)
+    full_noise = noise_source(source, size, origin, fill=fill, seed=seed)
     full_noise = ImageChops.multiply(full_noise, full_mask)
 
     full_source = Image.composite(full_noise, full_source, full_mask.convert("L"))
@@ -9,6 +9,8 @@ logger = getLogger(__name__)
 
 
 class OnnxModel:
+    batch_limit: int  # 0 when the model has a dynamic batch axis
+
     def __init__(
         self,
         server: ServerContext,
@@ -21,6 +23,9 @@ class OnnxModel:
             model_path, providers=[provider], provider_options=sess_options
         )
 
+        batch = self.session.get_inputs()[0].shape[0]
+        self.batch_limit = batch if isinstance(batch, int) else 0
+
     def __call__(self, image: Any) -> Any:
         input_name = self.session.get_inputs()[0].name
         output_name = self.session.get_outputs()[0].name
@@ -1,7 +1,7 @@
 from hashlib import sha256
 from json import dumps
 from logging import getLogger
-from os import path
+from os import fsync, path
 from struct import pack
 from time import time
 from typing import Any, List, Optional, Tuple
@@ -11,6 +11,7 @@ from piexif.helper import UserComment
 from PIL import Image, PngImagePlugin
 
 from onnx_web.convert.utils import resolve_tensor
+from onnx_web.server.hash_index import get_hash_index
 from onnx_web.server.load import get_extra_hashes
 
 from .params import Border, HighresParams, ImageParams, Param, Size, UpscaleParams
@@ -19,21 +20,6 @@ from .utils import base_join
 
 logger = getLogger(__name__)
 
-HASH_BUFFER_SIZE = 2**22  # 4MB
-
-
-def hash_file(name: str):
-    sha = sha256()
-    with open(name, "rb") as f:
-        while True:
-            data = f.read(HASH_BUFFER_SIZE)
-            if not data:
-                break
-
-            sha.update(data)
-
-    return sha.hexdigest()
-
 
 def hash_value(sha, param: Optional[Param]):
     if param is None:
@@ -103,6 +89,7 @@ def str_params(
                 model_hash = f.readline().rstrip(",. \n\t\r")
 
     model_hash = model_hash or "unknown"
+    hash_index = get_hash_index(server)
     hash_map = {
         model_name: model_hash,
     }
@@ -112,7 +99,7 @@ def str_params(
         inversion_pairs = [
             (
                 name,
-                hash_file(
+                hash_index.hash(
                     resolve_tensor(path.join(server.model_path, "inversion", name))
                 ).upper(),
             )
@@ -128,7 +115,7 @@ def str_params(
         lora_pairs = [
             (
                 name,
-                hash_file(
+                hash_index.hash(
                     resolve_tensor(path.join(server.model_path, "lora", name))
                 ).upper(),
             )
@@ -197,8 +184,61 @@ def save_image(
     inversions: List[Tuple[str, float]] = None,
     loras: List[Tuple[str, float]] = None,
 ) -> str:
+    """
+    Save an image and its params, in the background when the worker has an output writer.
+
+    Returns the path where the image will be written.
+    """
     path = base_join(server.output_path, output)
 
+    if server.output_writer is None:
+        write_image(
+            server,
+            path,
+            output,
+            image,
+            params,
+            size,
+            upscale=upscale,
+            border=border,
+            highres=highres,
+            inversions=inversions,
+            loras=loras,
+        )
+    else:
+        logger.debug("queueing output image for %s", path)
+        # the job may keep using the image after it has been saved
+        server.output_writer.submit(
+            write_image,
+            server,
+            path,
+            output,
+            image.copy(),
+            params,
+            size,
+            upscale=upscale,
+            border=border,
+            highres=highres,
+            inversions=inversions,
+            loras=loras,
+        )
+
+    return path
+
+
+def write_image(
+    server: ServerContext,
+    path: str,
+    output: str,
+    image: Image.Image,
+    params: Optional[ImageParams] = None,
+    size: Optional[Size] = None,
+    upscale: Optional[UpscaleParams] = None,
+    border: Optional[Border] = None,
+    highres: Optional[HighresParams] = None,
+    inversions: List[Tuple[str, float]] = None,
+    loras: List[Tuple[str, float]] = None,
+) -> str:
     if server.image_format == "png":
         exif = PngImagePlugin.PngInfo()
 
@@ -223,7 +263,7 @@ def save_image(
                 str_params(server, params, size, inversions=inversions, loras=loras),
             )
 
-        image.save(path, format=server.image_format, pnginfo=exif)
+        save_options = {"pnginfo": exif}
     else:
         exif = dump(
             {
@@ -252,7 +292,12 @@ def save_image(
                 }
             }
         )
-        image.save(path, format=server.image_format, exif=exif)
+        save_options = {"exif": exif}
+
+    with open(path, "wb") as f:
+        image.save(f, format=server.image_format, **save_options)
+        f.flush()
+        fsync(f.fileno())
 
     if params is not None:
         save_params(
@@ -284,5 +329,7 @@ def save_params(
     )
     with open(path, "w") as f:
         f.write(dumps(json))
+        f.flush()
+        fsync(f.fileno())
         logger.debug("saved image params to: %s", path)
         return path
@@ -1,10 +1,23 @@
+from base64 import b64encode
 from io import BytesIO
+from json import dumps
 from logging import getLogger
 from os import path
-
-from flask import Flask, jsonify, make_response, request, url_for
+from queue import Empty
+from typing import Any, Dict, Optional
+
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    make_response,
+    request,
+    stream_with_context,
+    url_for,
+)
 from jsonschema import validate
 from PIL import Image
+from prometheus_client import CONTENT_TYPE_LATEST
 
 from ..chain import CHAIN_STAGES, ChainPipeline
 from ..diffusers.load import get_available_pipelines, get_pipeline_schedulers
@@ -12,6 +25,7 @@ from ..diffusers.run import (
     run_blend_pipeline,
     run_img2img_pipeline,
     run_inpaint_pipeline,
+    run_txt2img_batch,
     run_txt2img_pipeline,
     run_upscale_pipeline,
 )
@@ -23,6 +37,7 @@ from ..utils import (
     base_join,
     get_and_clamp_float,
     get_and_clamp_int,
+    get_boolean,
     get_from_list,
     get_from_map,
     get_not_empty,
@@ -31,6 +46,8 @@ from ..utils import (
     load_config_str,
     sanitize_name,
 )
+from ..worker.affinity import get_job_affinity, get_job_coalesce_key
+from ..worker.command import JobPriority, ProgressCommand
 from ..worker.pool import DevicePoolExecutor
 from .context import ServerContext
 from .load import (
@@ -50,12 +67,16 @@ from .params import (
     border_from_request,
     highres_from_request,
     pipeline_from_request,
+    priority_from_request,
     upscale_from_request,
 )
 from .utils import wrap_route
 
 logger = getLogger(__name__)
 
+# seconds between comments on an idle stream, so proxies do not close it
+STREAM_KEEPALIVE = 15.0
+
 
 def ready_reply(
     ready: bool = False,
@@ -63,16 +84,20 @@ def ready_reply(
     failed: bool = False,
     pending: bool = False,
     progress: int = 0,
+    preview: Optional[bytes] = None,
 ):
-    return jsonify(
-        {
-            "cancelled": cancelled,
-            "failed": failed,
-            "pending": pending,
-            "progress": progress,
-            "ready": ready,
-        }
-    )
+    data = {
+        "cancelled": cancelled,
+        "failed": failed,
+        "pending": pending,
+        "progress": progress,
+        "ready": ready,
+    }
+
+    if preview is not None:
+        data["preview"] = b64encode(preview).decode("ascii")
+
+    return jsonify(data)
 
 
 def error_reply(err: str):
@@ -207,6 +232,8 @@ def img2img(server: ServerContext, pool: DevicePoolExecutor):
         source,
         strength,
         needs_device=device,
+        needs_models=get_job_affinity(params, "img2img", upscale),
+        priority=priority_from_request(),
         source_filter=source_filter,
     )
 
@@ -233,6 +260,10 @@ def txt2img(server: ServerContext, pool: DevicePoolExecutor):
         upscale,
         highres,
         needs_device=device,
+        needs_models=get_job_affinity(params, "txt2img", upscale),
+        priority=priority_from_request(),
+        coalesce_key=get_job_coalesce_key(params, size, "txt2img"),
+        coalesce_fn=run_txt2img_batch,
     )
 
     logger.info("txt2img job queued for: %s", job_name)
@@ -299,6 +330,8 @@ def inpaint(server: ServerContext, pool: DevicePoolExecutor):
         fill_color,
         tile_order,
         needs_device=device,
+        needs_models=get_job_affinity(params, "inpaint", upscale),
+        priority=priority_from_request(),
     )
 
     logger.info("inpaint job queued for: %s", job_name)
@@ -338,6 +371,8 @@ def upscale(server: ServerContext, pool: DevicePoolExecutor):
         highres,
         source,
         needs_device=device,
+        needs_models=get_job_affinity(params, upscale=upscale),
+        priority=priority_from_request(),
     )
 
     logger.info("upscale job queued for: %s", job_name)
@@ -426,6 +461,8 @@ def chain(server: ServerContext, pool: DevicePoolExecutor):
         output=output[0],
         size=size,
         needs_device=device,
+        needs_models=get_job_affinity(params),
+        priority=priority_from_request(JobPriority.batch),
     )
 
     return jsonify(json_params(output, params, size))
@@ -467,6 +504,8 @@ def blend(server: ServerContext, pool: DevicePoolExecutor):
         sources,
         mask,
         needs_device=device,
+        needs_models=get_job_affinity(params, upscale=upscale),
+        priority=priority_from_request(),
     )
 
     logger.info("upscale job queued for: %s", job_name)
@@ -489,6 +528,8 @@ def txt2txt(server: ServerContext, pool: DevicePoolExecutor):
         size,
         output,
         needs_device=device,
+        needs_models=get_job_affinity(params),
+        priority=priority_from_request(),
     )
 
     return jsonify(json_params(output, params, size))
@@ -526,14 +567,115 @@ def ready(server: ServerContext, pool: DevicePoolExecutor):
                 failed=True,
             )  # is a missing image really an error? yes will display the retry button
 
+    previews = get_boolean(request.args, "previews", False)
     return ready_reply(
         ready=progress.finished,
         progress=progress.progress,
         failed=progress.failed,
         cancelled=progress.cancelled,
+        preview=pool.get_preview(output_file) if previews else None,
     )
 
 
+def metrics(server: ServerContext, pool: DevicePoolExecutor):
+    return Response(pool.metrics.export(), content_type=CONTENT_TYPE_LATEST)
+
+
+def stream_event(
+    output: str,
+    pending: bool,
+    progress: Optional[ProgressCommand],
+    previews: bool = False,
+) -> str:
+    data: Dict[str, Any] = {
+        "cancelled": False,
+        "failed": False,
+        "output": output,
+        "pending": pending,
+        "progress": 0,
+        "ready": False,
+    }
+
+    if pending:
+        event = "pending"
+    elif progress is None:
+        event = "failed"
+        data.update(failed=True, ready=True)
+    else:
+        data.update(
+            cancelled=progress.cancelled,
+            failed=progress.failed,
+            progress=progress.progress,
+            ready=progress.finished,
+        )
+
+        if progress.cancelled:
+            event = "cancelled"
+        elif progress.failed:
+            event = "failed"
+        elif progress.finished:
+            event = "finished"
+        else:
+            event = "progress"
+
+        if previews and progress.preview is not None:
+            data["preview"] = b64encode(progress.preview).decode("ascii")
+
+    return f"event: {event}\ndata: {dumps(data)}\n\n"
+
+
+def stream(server: ServerContext, pool: DevicePoolExecutor):
+    outputs = [sanitize_name(output) for output in request.args.getlist("output")]
+    previews = get_boolean(request.args, "previews", False)
+
+    # subscribe before checking the current state, so no updates are missed in between
+    listener = pool.subscribe(outputs, limit=server.stream_limit)
+    if listener is None:
+        # each stream holds a server thread, leave enough for the other routes
+        response = error_reply("too many open streams")
+        response.status_code = 503
+        return response
+
+    remaining = set(outputs)
+
+    def generate():
+        try:
+            for output in outputs:
+                pending, progress = pool.done(output)
+                if not pending and progress is None:
+                    # not a known job, which may already have been written
+                    if path.exists(base_join(server.output_path, output)):
+                        progress = ProgressCommand(output, "", True, 0)
+
+                yield stream_event(output, pending, progress, previews=previews)
+
+                if progress is None or progress.finished:
+                    remaining.discard(output)
+
+            while len(outputs) == 0 or len(remaining) > 0:
+                try:
+                    progress = listener.get(timeout=STREAM_KEEPALIVE)
+                except Empty:
+                    yield ": keepalive\n\n"
+                    continue
+
+                yield stream_event(progress.job, False, progress, previews=previews)
+
+                if progress.finished:
+                    remaining.discard(progress.job)
+        finally:
+            pool.unsubscribe(listener)
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+    # the generator will not clean up if the client disconnects before the stream starts
+    response.call_on_close(lambda: pool.unsubscribe(listener))
+    return response
+
+
 def register_api_routes(app: Flask, server: ServerContext, pool: DevicePoolExecutor):
     return [
         app.route("/api")(wrap_route(introspect, server, app=app)),
@@ -566,5 +708,7 @@ def register_api_routes(app: Flask, server: ServerContext, pool: DevicePoolExecu
         app.route("/api/cancel", methods=["PUT"])(
             wrap_route(cancel, server, pool=pool)
         ),
+        app.route("/api/metrics")(wrap_route(metrics, server, pool=pool)),
         app.route("/api/ready")(wrap_route(ready, server, pool=pool)),
+        app.route("/api/stream")(wrap_route(stream, server, pool=pool)),
     ]
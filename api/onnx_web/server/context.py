@@ -6,14 +6,27 @@ from typing import List, Optional
 import torch
 
 from ..utils import get_boolean
+from .metrics import TimingBuffer
 from .model_cache import ModelCache
+from .writer import OutputWriter
 
 logger = getLogger(__name__)
 
+DEFAULT_BLEND_CACHE_LIMIT = 2**34  # 16GB
 DEFAULT_CACHE_LIMIT = 5
+DEFAULT_COALESCE_LIMIT = 4
+DEFAULT_HISTORY_LIMIT = 1000
+DEFAULT_HISTORY_TTL = 86400  # 1 day
 DEFAULT_JOB_LIMIT = 10
+DEFAULT_OUTPUT_QUEUE_LIMIT = 8
+DEFAULT_OUTPUT_THREADS = 2
+DEFAULT_PROMPT_CACHE_LIMIT = 2**26  # 64MB
+DEFAULT_PROMPT_CACHE_PROMPTS = 1000
 DEFAULT_IMAGE_FORMAT = "png"
 DEFAULT_SERVER_VERSION = "v0.10.0"
+DEFAULT_STREAM_LIMIT = 2  # waitress has 4 threads by default
+DEFAULT_TILE_BATCH_MEMORY = 2**24  # 16MB
+DEFAULT_VIEW_BATCH_PIXELS = 4 * 512 * 512  # each view and CFG sample at full size
 
 
 class ServerContext:
@@ -30,6 +43,9 @@ class ServerContext:
         image_format: str = DEFAULT_IMAGE_FORMAT,
         cache_limit: int = DEFAULT_CACHE_LIMIT,
         cache_path: Optional[str] = None,
+        blend_cache_limit: int = DEFAULT_BLEND_CACHE_LIMIT,
+        coalesce_limit: int = DEFAULT_COALESCE_LIMIT,
+        coalesce_window: float = 0.0,
         show_progress: bool = True,
         optimizations: Optional[List[str]] = None,
         extra_models: Optional[List[str]] = None,
@@ -37,6 +53,17 @@ class ServerContext:
         memory_limit: Optional[int] = None,
         admin_token: Optional[str] = None,
         server_version: Optional[str] = DEFAULT_SERVER_VERSION,
+        history_limit: int = DEFAULT_HISTORY_LIMIT,
+        history_ttl: Optional[float] = DEFAULT_HISTORY_TTL,
+        history_path: Optional[str] = None,
+        output_queue_limit: int = DEFAULT_OUTPUT_QUEUE_LIMIT,
+        output_threads: int = DEFAULT_OUTPUT_THREADS,
+        preview_steps: int = 0,
+        prompt_cache_limit: int = DEFAULT_PROMPT_CACHE_LIMIT,
+        stream_limit: int = DEFAULT_STREAM_LIMIT,
+        tile_batch_memory: int = DEFAULT_TILE_BATCH_MEMORY,
+        vae_batch_size: int = 1,
+        view_batch_pixels: int = DEFAULT_VIEW_BATCH_PIXELS,
     ) -> None:
         self.bundle_path = bundle_path
         self.model_path = model_path
@@ -49,6 +76,9 @@ class ServerContext:
         self.image_format = image_format
         self.cache_limit = cache_limit
         self.cache_path = cache_path or path.join(model_path, ".cache")
+        self.blend_cache_limit = blend_cache_limit
+        self.coalesce_limit = coalesce_limit
+        self.coalesce_window = coalesce_window
         self.show_progress = show_progress
         self.optimizations = optimizations or []
         self.extra_models = extra_models or []
@@ -56,8 +86,29 @@ class ServerContext:
         self.memory_limit = memory_limit
         self.admin_token = admin_token or token_urlsafe()
         self.server_version = server_version
+        self.history_limit = history_limit
+        self.history_ttl = history_ttl
+        self.history_path = history_path
+        self.output_queue_limit = output_queue_limit
+        self.output_threads = output_threads
+        self.preview_steps = preview_steps
+        self.prompt_cache_limit = prompt_cache_limit
+        self.stream_limit = stream_limit
+        self.tile_batch_memory = tile_batch_memory
+        self.vae_batch_size = vae_batch_size
+        self.view_batch_pixels = view_batch_pixels
 
-        self.cache = ModelCache(self.cache_limit)
+        self.cache = ModelCache(self.cache_limit, memory_limit=self.memory_limit)
+        self.prompt_cache = ModelCache(
+            DEFAULT_PROMPT_CACHE_PROMPTS if self.prompt_cache_limit > 0 else 0,
+            memory_limit=self.prompt_cache_limit,
+        )
+
+        # created by each worker, since threads cannot be sent to another process
+        self.output_writer: Optional[OutputWriter] = None
+
+        # each process keeps its own timings, the workers send theirs to the server with their progress
+        self.timings = TimingBuffer()
 
     @classmethod
     def from_environ(cls):
@@ -65,6 +116,10 @@ class ServerContext:
         if memory_limit is not None:
             memory_limit = int(memory_limit)
 
+        history_ttl = float(environ.get("ONNX_WEB_HISTORY_TTL", DEFAULT_HISTORY_TTL))
+        if history_ttl <= 0:
+            history_ttl = None
+
         return cls(
             bundle_path=environ.get(
                 "ONNX_WEB_BUNDLE_PATH", path.join("..", "gui", "out")
@@ -79,6 +134,13 @@ class ServerContext:
             default_platform=environ.get("ONNX_WEB_DEFAULT_PLATFORM", None),
             image_format=environ.get("ONNX_WEB_IMAGE_FORMAT", "png"),
             cache_limit=int(environ.get("ONNX_WEB_CACHE_MODELS", DEFAULT_CACHE_LIMIT)),
+            blend_cache_limit=int(
+                environ.get("ONNX_WEB_BLEND_CACHE_LIMIT", DEFAULT_BLEND_CACHE_LIMIT)
+            ),
+            coalesce_limit=int(
+                environ.get("ONNX_WEB_COALESCE_LIMIT", DEFAULT_COALESCE_LIMIT)
+            ),
+            coalesce_window=float(environ.get("ONNX_WEB_COALESCE_WINDOW", 0.0)),
             show_progress=get_boolean(environ, "ONNX_WEB_SHOW_PROGRESS", True),
             optimizations=environ.get("ONNX_WEB_OPTIMIZATIONS", "").split(","),
             extra_models=environ.get("ONNX_WEB_EXTRA_MODELS", "").split(","),
@@ -88,6 +150,31 @@ class ServerContext:
             server_version=environ.get(
                 "ONNX_WEB_SERVER_VERSION", DEFAULT_SERVER_VERSION
             ),
+            history_limit=int(
+                environ.get("ONNX_WEB_HISTORY_LIMIT", DEFAULT_HISTORY_LIMIT)
+            ),
+            history_ttl=history_ttl,
+            history_path=environ.get("ONNX_WEB_HISTORY_PATH", None),
+            output_queue_limit=int(
+                environ.get("ONNX_WEB_OUTPUT_QUEUE_LIMIT", DEFAULT_OUTPUT_QUEUE_LIMIT)
+            ),
+            output_threads=int(
+                environ.get("ONNX_WEB_OUTPUT_THREADS", DEFAULT_OUTPUT_THREADS)
+            ),
+            preview_steps=int(environ.get("ONNX_WEB_PREVIEW_STEPS", 0)),
+            prompt_cache_limit=int(
+                environ.get("ONNX_WEB_PROMPT_CACHE_LIMIT", DEFAULT_PROMPT_CACHE_LIMIT)
+            ),
+            stream_limit=int(
+                environ.get("ONNX_WEB_STREAM_LIMIT", DEFAULT_STREAM_LIMIT)
+            ),
+            tile_batch_memory=int(
+                environ.get("ONNX_WEB_TILE_BATCH_MEMORY", DEFAULT_TILE_BATCH_MEMORY)
+            ),
+            vae_batch_size=int(environ.get("ONNX_WEB_VAE_BATCH_SIZE", 1)),
+            view_batch_pixels=int(
+                environ.get("ONNX_WEB_VIEW_BATCH_PIXELS", DEFAULT_VIEW_BATCH_PIXELS)
+            ),
         )
 
     def torch_dtype(self):
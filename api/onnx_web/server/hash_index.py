@@ -0,0 +1,184 @@
+from hashlib import sha256
+from logging import getLogger
+from os import getpid, makedirs, path, stat
+from sqlite3 import Connection, connect
+from threading import Lock, Thread
+from typing import Dict, List, Optional, Tuple
+
+from .context import ServerContext
+
+logger = getLogger(__name__)
+
+HASH_BUFFER_SIZE = 2**22  # 4MB
+HASH_INDEX_FILE = "hashes.db"
+
+FileStat = Tuple[int, float]  # size and modification time
+
+
+def hash_file(name: str):
+    sha = sha256()
+    with open(name, "rb") as f:
+        while True:
+            data = f.read(HASH_BUFFER_SIZE)
+            if not data:
+                break
+
+            sha.update(data)
+
+    return sha.hexdigest()
+
+
+def get_file_stat(name: str) -> FileStat:
+    file_stat = stat(name)
+    return (file_stat.st_size, file_stat.st_mtime)
+
+
+class HashIndex:
+    """
+    Index of file hashes, keyed by path, size, and modification time, so large files are only hashed again
+    after they have changed. The index can be saved to a SQLite database that is shared with the workers.
+    """
+
+    hashes: Dict[str, Tuple[FileStat, str]]
+    db_path: Optional[str]
+
+    db: Optional[Connection]
+    db_pid: Optional[int]
+    lock: Lock
+
+    def __init__(self, db_path: Optional[str] = None) -> None:
+        self.hashes = {}
+        self.db_path = db_path
+        self.db = None
+        self.db_pid = None
+        self.lock = Lock()
+
+    def connect(self) -> Optional[Connection]:
+        """
+        Open the database for this process, since connections cannot be shared with forked workers.
+
+        Must be called while holding the lock.
+        """
+        if self.db_path is None:
+            return None
+
+        if self.db is not None and self.db_pid == getpid():
+            return self.db
+
+        try:
+            makedirs(path.dirname(self.db_path), exist_ok=True)
+            self.db = connect(self.db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS hashes "
+                "(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, hash TEXT)"
+            )
+            self.db_pid = getpid()
+        except Exception:
+            logger.exception("error opening hash index at %s", self.db_path)
+            self.db = None
+            self.db_path = None
+
+        return self.db
+
+    def close(self) -> None:
+        with self.lock:
+            if self.db is not None and self.db_pid == getpid():
+                self.db.close()
+
+            self.db = None
+            self.db_pid = None
+
+    def get(self, name: str) -> Optional[str]:
+        """
+        Get the hash of a file, if it has been indexed and has not changed since then.
+        """
+        name = path.abspath(name)
+        file_stat = get_file_stat(name)
+
+        with self.lock:
+            if name in self.hashes:
+                indexed_stat, file_hash = self.hashes[name]
+                if indexed_stat == file_stat:
+                    return file_hash
+
+            db = self.connect()
+            if db is None:
+                return None
+
+            row = db.execute(
+                "SELECT size, mtime, hash FROM hashes WHERE path = ?", (name,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        size, mtime, file_hash = row
+        if (size, mtime) != file_stat:
+            logger.debug("file has changed since it was indexed: %s", name)
+            return None
+
+        with self.lock:
+            self.hashes[name] = (file_stat, file_hash)
+
+        return file_hash
+
+    def hash(self, name: str) -> str:
+        """
+        Get the hash of a file, hashing it and adding it to the index if it has not been indexed or has changed.
+        """
+        file_hash = self.get(name)
+        if file_hash is not None:
+            return file_hash
+
+        name = path.abspath(name)
+        file_stat = get_file_stat(name)
+
+        logger.debug("hashing file for index: %s", name)
+        file_hash = hash_file(name)
+
+        with self.lock:
+            self.hashes[name] = (file_stat, file_hash)
+
+            db = self.connect()
+            if db is not None:
+                try:
+                    with db:
+                        db.execute(
+                            "INSERT OR REPLACE INTO hashes (path, size, mtime, hash) VALUES (?, ?, ?, ?)",
+                            (name, file_stat[0], file_stat[1], file_hash),
+                        )
+                except Exception:
+                    logger.exception("error saving hash for %s", name)
+
+        return file_hash
+
+    def update(self, names: List[str]) -> None:
+        """
+        Make sure that all of the files are in the index, hashing any that are missing or have changed.
+        """
+        for name in names:
+            try:
+                self.hash(name)
+            except Exception:
+                logger.exception("error indexing hash for %s", name)
+
+        logger.debug("indexed hashes for %s files", len(names))
+
+    def update_background(self, names: List[str]) -> Thread:
+        thread = Thread(
+            target=self.update, args=(names,), daemon=True, name="onnx-web hash index"
+        )
+        thread.start()
+        return thread
+
+
+hash_index: Optional[HashIndex] = None
+
+
+def get_hash_index(server: ServerContext) -> HashIndex:
+    global hash_index
+
+    if hash_index is None:
+        hash_index = HashIndex(path.join(server.cache_path, HASH_INDEX_FILE))
+
+    return hash_index
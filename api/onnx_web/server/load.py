@@ -7,6 +7,7 @@ from typing import Any, Dict, List, Optional, Union
 import torch
 from jsonschema import ValidationError, validate
 
+from ..convert.utils import resolve_tensor
 from ..image import (  # mask filters; noise sources
     mask_filter_gaussian_multiply,
     mask_filter_gaussian_screen,
@@ -35,6 +36,7 @@ from ..params import DeviceParams
 from ..torch_before_ort import get_available_providers
 from ..utils import load_config, merge
 from .context import ServerContext
+from .hash_index import get_hash_index
 
 logger = getLogger(__name__)
 
@@ -353,6 +355,16 @@ def load_models(server: ServerContext) -> None:
     logger.debug("loaded LoRA models from disk: %s", lora_models)
     network_models.extend([NetworkModel(model, "lora") for model in lora_models])
 
+    # hash the networks ahead of time, so the first image that uses them does not have to wait
+    network_files = [
+        resolve_tensor(path.join(server.model_path, network.type, network.name))
+        for network in network_models
+        if network.type in ["inversion", "lora"]
+    ]
+    get_hash_index(server).update_background(
+        [file for file in network_files if file is not None]
+    )
+
 
 def load_params(server: ServerContext) -> None:
     global config_params
@@ -0,0 +1,129 @@
+from collections import deque
+from contextlib import contextmanager
+from logging import getLogger
+from time import perf_counter
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from prometheus_client import CollectorRegistry, Histogram, generate_latest
+
+logger = getLogger(__name__)
+
+DEFAULT_TIMING_LIMIT = 10000
+
+# job stages can take minutes, while a single UNet step can be a few milliseconds
+TIMING_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+# metric name -> description, label names
+TIMING_METRICS: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    "load_pipeline": (
+        "Time spent loading diffusion pipelines, by pipeline and whether it was cached",
+        ("pipeline", "cache"),
+    ),
+    "queue_wait": (
+        "Time spent by jobs waiting in the queue before they were sent to a worker",
+        ("device",),
+    ),
+    "session": (
+        "Time spent running each UNet and VAE session",
+        ("model",),
+    ),
+    "stage": (
+        "Time spent running each chain pipeline stage",
+        ("stage",),
+    ),
+    "tile": (
+        "Time spent running each tile of a chain pipeline stage",
+        ("stage",),
+    ),
+}
+
+Timing = Tuple[str, Tuple[str, ...], float]  # metric, label values, seconds
+
+
+class TimingBuffer:
+    """
+    Collect timings in a worker until they can be sent to the server with the next progress update. When the
+    buffer is full, the oldest timings will be dropped.
+    """
+
+    timings: Deque[Timing]
+
+    def __init__(self, limit: int = DEFAULT_TIMING_LIMIT) -> None:
+        self.limit = limit
+        self.timings = deque(maxlen=limit)
+
+    def record(self, metric: str, labels: Tuple[str, ...], duration: float) -> None:
+        self.timings.append((metric, labels, duration))
+
+    @contextmanager
+    def timer(self, metric: str, *labels: str) -> Iterator[None]:
+        """
+        Record how long the body takes to run, whether or not it raises an error.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(metric, labels, perf_counter() - start)
+
+    def drain(self) -> List[Timing]:
+        # swap the buffer rather than clearing it, so timings recorded by other threads are not lost
+        timings, self.timings = self.timings, deque(maxlen=self.limit)
+        return list(timings)
+
+
+class MetricsRegistry:
+    """
+    Aggregate the timings reported by each worker into Prometheus histograms.
+    """
+
+    histograms: Dict[str, Histogram]
+    registry: CollectorRegistry
+
+    def __init__(self) -> None:
+        self.registry = CollectorRegistry()
+        self.histograms = {
+            metric: Histogram(
+                f"onnx_web_{metric}_seconds",
+                description,
+                labels,
+                registry=self.registry,
+                buckets=TIMING_BUCKETS,
+            )
+            for metric, (description, labels) in TIMING_METRICS.items()
+        }
+
+    def observe(self, metric: str, labels: Tuple[str, ...], duration: float) -> None:
+        histogram = self.histograms.get(metric, None)
+        if histogram is None:
+            logger.warning("unknown timing metric: %s", metric)
+            return
+
+        try:
+            histogram.labels(*labels).observe(duration)
+        except ValueError:
+            logger.warning("invalid labels for timing metric %s: %s", metric, labels)
+
+    def observe_all(self, timings: Optional[List[Timing]]) -> None:
+        for metric, labels, duration in timings or []:
+            self.observe(metric, labels, duration)
+
+    def export(self) -> bytes:
+        return generate_latest(self.registry)
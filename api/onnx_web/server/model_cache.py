@@ -1,82 +1,257 @@
+from collections import OrderedDict
 from logging import getLogger
-from typing import Any, List, Tuple
+from os import path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from ..constants import ONNX_MODEL, ONNX_WEIGHTS
 
 logger = getLogger(__name__)
 
-cache: List[Tuple[str, Any, Any]] = []
+CacheKey = Tuple[str, Any]
+
+# bytes per element for ORT tensor types, used to measure OrtValues without copying them
+ORT_TYPE_SIZES = {
+    "tensor(bool)": 1,
+    "tensor(double)": 8,
+    "tensor(float)": 4,
+    "tensor(float16)": 2,
+    "tensor(int8)": 1,
+    "tensor(int32)": 4,
+    "tensor(int64)": 8,
+    "tensor(uint8)": 1,
+}
+MAX_MEASURE_DEPTH = 4
+
+
+def freeze_key(key: Any) -> Any:
+    """
+    Convert lists and dicts within a cache key into hashable tuples.
+    """
+    if isinstance(key, (list, tuple)):
+        return tuple(freeze_key(k) for k in key)
+
+    if isinstance(key, dict):
+        return tuple(sorted((k, freeze_key(v)) for k, v in key.items()))
+
+    return key
+
+
+def measure_session(session: Any) -> int:
+    """
+    Estimate the size of an ONNX session's initializers from the model it was loaded from.
+    """
+    model_bytes = getattr(session, "_model_bytes", None)
+    if model_bytes is not None:
+        return len(model_bytes)
+
+    model_path = getattr(session, "_model_path", None)
+    if model_path is None or not path.isfile(model_path):
+        return 0
+
+    # SD models keep their weights in external data files next to the graph
+    model_dir = path.dirname(model_path)
+    return sum(
+        path.getsize(path.join(model_dir, name))
+        for name in [ONNX_MODEL, ONNX_WEIGHTS]
+        if path.isfile(path.join(model_dir, name))
+    ) or path.getsize(model_path)
+
+
+def measure_model_size(
+    value: Any, depth: int = 0, visited: Optional[Set[int]] = None
+) -> int:
+    """
+    Estimate the memory used by a cached model, counting numpy buffers, ORT values, and ONNX session
+    initializers, including those held by pipeline components.
+    """
+    visited = visited if visited is not None else set()
+    if value is None or id(value) in visited or depth > MAX_MEASURE_DEPTH:
+        return 0
+
+    visited.add(id(value))
+
+    # other cache entries are measured on their own
+    if isinstance(value, ModelCache):
+        return 0
+
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+
+    if isinstance(value, (str, int, float, bool)):
+        return 0
+
+    # torch tensors
+    if hasattr(value, "element_size") and hasattr(value, "nelement"):
+        return value.element_size() * value.nelement()
+
+    # ORT sessions and values, without importing onnxruntime in the server
+    if hasattr(value, "get_inputs") and hasattr(value, "run"):
+        return measure_session(value)
+
+    if (
+        hasattr(value, "data_type")
+        and hasattr(value, "shape")
+        and callable(value.shape)
+    ):
+        try:
+            return int(np.prod(value.shape())) * ORT_TYPE_SIZES.get(
+                value.data_type(), 4
+            )
+        except Exception:
+            return 0
+
+    if isinstance(value, dict):
+        return sum(measure_model_size(v, depth + 1, visited) for v in value.values())
+
+    if isinstance(value, (list, tuple, set)):
+        return sum(measure_model_size(v, depth + 1, visited) for v in value)
+
+    if hasattr(value, "__dict__"):
+        return sum(
+            measure_model_size(v, depth + 1, visited) for v in vars(value).values()
+        )
+
+    return 0
 
 
 class ModelCache:
-    # cache: List[Tuple[str, Any, Any]]
+    """
+    Keyed LRU cache for loaded models, bounded by both the number of entries and their total size in bytes.
+    """
+
+    cache: "OrderedDict[CacheKey, Tuple[Any, int]]"
     limit: int
+    memory: int  # total size of the cached models, kept up to date rather than summed for each check
+    memory_limit: Optional[int]
+
+    hits: int
+    misses: int
+    evictions: int
 
-    def __init__(self, limit: int) -> None:
+    def __init__(self, limit: int, memory_limit: Optional[int] = None) -> None:
+        self.cache = OrderedDict()
         self.limit = limit
-        logger.debug("creating model cache with limit of %s models", limit)
+        self.memory = 0
+        self.memory_limit = memory_limit
 
-    def drop(self, tag: str, key: Any) -> int:
-        global cache
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
+        logger.debug(
+            "creating model cache with limit of %s models and %s bytes",
+            limit,
+            memory_limit,
+        )
+
+    def drop(self, tag: str, key: Any) -> int:
         logger.debug("dropping item from cache: %s %s", tag, key)
-        removed = [model for model in cache if model[0] == tag and model[1] == key]
-        for item in removed:
-            cache.remove(item)
+        cache_key = (tag, freeze_key(key))
+        if cache_key in self.cache:
+            _value, size = self.cache.pop(cache_key)
+            self.memory -= size
+            return 1
 
-        return len(removed)
+        return 0
 
     def get(self, tag: str, key: Any) -> Any:
-        global cache
-
-        for t, k, v in cache:
-            if tag == t and key == k:
-                logger.debug("found cached model: %s %s", tag, key)
-                return v
+        cache_key = (tag, freeze_key(key))
+        if cache_key in self.cache:
+            logger.debug("found cached model: %s %s", tag, key)
+            self.cache.move_to_end(cache_key)
+            self.hits += 1
+            value, _size = self.cache[cache_key]
+            return value
 
         logger.debug("model not found in cache: %s %s", tag, key)
+        self.misses += 1
         return None
 
-    def set(self, tag: str, key: Any, value: Any) -> None:
-        global cache
+    def find(self, tag: str, match: Callable[[Any], bool]) -> Any:
+        """
+        Find the most recently used model with a matching key, without counting a hit or miss.
+        """
+        for (t, k), (value, _size) in reversed(self.cache.items()):
+            if t == tag and match(k):
+                logger.debug("found similar model in cache: %s %s", tag, k)
+                return value
+
+        return None
 
+    def set(self, tag: str, key: Any, value: Any, size: Optional[int] = None) -> None:
         if self.limit == 0:
             logger.debug("cache limit set to 0, not caching model: %s", tag)
             return
 
-        for i in range(len(cache)):
-            t, k, v = cache[i]
-            if tag == t and key != k:
-                logger.debug("updating model cache: %s %s", tag, key)
-                cache[i] = (tag, key, value)
-                return
+        if size is None:
+            size = measure_model_size(value)
+
+        cache_key = (tag, freeze_key(key))
+        if cache_key in self.cache:
+            logger.debug("updating model cache: %s %s", tag, key)
+            _value, old_size = self.cache[cache_key]
+            self.memory -= old_size
+        else:
+            logger.debug("adding new model to cache: %s %s, %s bytes", tag, key, size)
 
-        logger.debug("adding new model to cache: %s %s", tag, key)
-        cache.append((tag, key, value))
+        self.cache[cache_key] = (value, size)
+        self.cache.move_to_end(cache_key)
+        self.memory += size
         self.prune()
 
     def clear(self):
-        global cache
+        self.cache.clear()
+        self.memory = 0
 
-        cache.clear()
+    def keys(self) -> List[CacheKey]:
+        return list(self.cache.keys())
 
     def prune(self):
-        global cache
+        total = len(self.cache)
+        removed = []
 
-        total = len(cache)
-        overage = total - self.limit
-        if overage > 0:
-            removed = cache[:overage]
+        # always keep the most recent model, even when it is over the memory limit by itself
+        while len(self.cache) > 1 and (
+            len(self.cache) > self.limit
+            or (self.memory_limit is not None and self.memory > self.memory_limit)
+        ):
+            (tag, _key), (_value, size) = self.cache.popitem(last=False)
+            self.memory -= size
+            removed.append((tag, size))
+
+        if len(removed) > 0:
+            self.evictions += len(removed)
             logger.info(
                 "removing %s of %s models from cache, %s",
-                overage,
+                len(removed),
                 total,
-                [m[0] for m in removed],
+                removed,
             )
-            cache[:] = cache[-self.limit :]
         else:
-            logger.debug("model cache below limit, %s of %s", total, self.limit)
+            logger.debug(
+                "model cache below limit, %s of %s models, %s of %s bytes",
+                total,
+                self.limit,
+                self.memory,
+                self.memory_limit,
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": self.size,
+            "evictions": self.evictions,
+            "hits": self.hits,
+            "limit": self.limit,
+            "memory": self.memory,
+            "memory_limit": self.memory_limit,
+            "misses": self.misses,
+        }
 
     @property
     def size(self):
-        global cache
-
-        return len(cache)
+        return len(self.cache)
@@ -18,8 +18,10 @@ from ..utils import (
     get_and_clamp_int,
     get_boolean,
     get_from_list,
+    get_from_map,
     get_not_empty,
 )
+from ..worker.command import JobPriority
 from .context import ServerContext
 from .load import (
     get_available_platforms,
@@ -319,3 +321,9 @@ def highres_from_request() -> HighresParams:
         method=method,
         iterations=iterations,
     )
+
+
+def priority_from_request(
+    default: JobPriority = JobPriority.interactive,
+) -> JobPriority:
+    return get_from_map(request.args, "priority", JobPriority.__members__, default.name)
@@ -0,0 +1,98 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging import getLogger
+from threading import BoundedSemaphore, Lock
+from typing import Callable, List, Optional
+
+logger = getLogger(__name__)
+
+WriteCallback = Callable[[Optional[BaseException]], None]
+
+
+class OutputWriter:
+    """
+    Encode and save outputs on a pool of background threads, so the worker can start the next job while the
+    last one is still being written. When the queue is full, new writes will wait for a free slot.
+    """
+
+    executor: ThreadPoolExecutor
+    futures: List[Future]  # writes for the current job
+    job: Optional[str]
+    lock: Lock
+    slots: BoundedSemaphore
+
+    def __init__(self, threads: int, limit: int) -> None:
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="onnx-web-writer"
+        )
+        self.futures = []
+        self.job = None
+        self.lock = Lock()
+        self.slots = BoundedSemaphore(max(limit, threads))
+
+    def start(self, job: str) -> None:
+        with self.lock:
+            self.job = job
+            self.futures = []
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        # wait for a free slot, to keep finished images from piling up in memory
+        self.slots.acquire()
+
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(self.on_written)
+
+        with self.lock:
+            self.futures.append(future)
+
+        return future
+
+    def on_written(self, future: Future) -> None:
+        self.slots.release()
+
+        error = future.exception()
+        if error is not None:
+            logger.error("error writing output: %s", error)
+
+    def on_done(self, callback: WriteCallback) -> None:
+        """
+        Call back once all of the outputs for the current job have been written, with the first error, if any.
+        The callback may run on a writer thread, or right away if nothing is left to write.
+        """
+        with self.lock:
+            futures = self.futures
+            self.futures = []
+
+        if len(futures) == 0:
+            callback(None)
+            return
+
+        remaining = len(futures)
+        errors: List[BaseException] = []
+        errors_lock = Lock()
+
+        def on_future(future: Future):
+            nonlocal remaining
+            with errors_lock:
+                remaining -= 1
+                if future.exception() is not None:
+                    errors.append(future.exception())
+
+                done = remaining == 0
+
+            if done:
+                callback(errors[0] if len(errors) > 0 else None)
+
+        for future in futures:
+            future.add_done_callback(on_future)
+
+    def shutdown(self) -> None:
+        """
+        Wait for all of the queued outputs to be written.
+        """
+        logger.debug("flushing queued outputs")
+        self.executor.shutdown(wait=True)
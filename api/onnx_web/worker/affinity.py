@@ -0,0 +1,138 @@
+from logging import getLogger
+from os import path
+from typing import Any, List, Optional, Tuple
+
+from ..diffusers.utils import get_inversions_from_prompt, get_loras_from_prompt
+from ..params import ImageParams, Size, UpscaleParams
+from ..server.model_cache import ModelCache, freeze_key
+
+logger = getLogger(__name__)
+
+ModelAffinity = Tuple[Any, ...]
+
+# cache entries that are only useful alongside another model
+SKIP_AFFINITY_TAGS = ["lora-base", "scheduler"]
+
+
+def get_model_name(model: str) -> str:
+    name, _ext = path.splitext(path.basename(model))
+    return name
+
+
+def get_cache_affinity(tag: str, key: Any) -> Optional[ModelAffinity]:
+    """
+    Describe a model cache entry in the same terms that jobs use to request models.
+    """
+    if tag in SKIP_AFFINITY_TAGS:
+        return None
+
+    if tag == "diffusion":
+        pipeline, model, _device, _provider, control, inversions, loras = key
+        return ("diffusion", model, pipeline, control, inversions, loras)
+
+    # upscaling and correction models are keyed by their path
+    for part in key:
+        if isinstance(part, str):
+            return ("model", get_model_name(part))
+
+    return None
+
+
+def get_cache_affinities(cache: ModelCache) -> List[ModelAffinity]:
+    affinities = []
+    for tag, key in cache.keys():
+        try:
+            affinity = get_cache_affinity(tag, key)
+            if affinity is not None and affinity not in affinities:
+                affinities.append(affinity)
+        except Exception:
+            logger.debug("unable to describe cache entry: %s, %s", tag, key)
+
+    return affinities
+
+
+def get_job_affinity(
+    params: ImageParams,
+    pipeline: Optional[str] = None,
+    upscale: Optional[UpscaleParams] = None,
+) -> List[ModelAffinity]:
+    """
+    Describe the models that a job will load. The diffusion pipeline only matches exactly when the pipeline type
+    is known, otherwise any pipeline for the same model is a partial match.
+    """
+    affinities: List[ModelAffinity] = []
+
+    if pipeline is None:
+        affinities.append(("diffusion", params.model))
+    else:
+        # the same networks that parse_prompt will find
+        prompt, loras = get_loras_from_prompt(params.input_prompt)
+        _prompt, inversions = get_inversions_from_prompt(prompt)
+
+        if params.input_negative_prompt is not None:
+            neg_prompt, neg_loras = get_loras_from_prompt(params.input_negative_prompt)
+            _neg_prompt, neg_inversions = get_inversions_from_prompt(neg_prompt)
+            loras.extend(neg_loras)
+            inversions.extend(neg_inversions)
+
+        control = params.control.name if params.control is not None else None
+        affinities.append(
+            (
+                "diffusion",
+                params.model,
+                params.get_valid_pipeline(pipeline),
+                control,
+                freeze_key(inversions),
+                freeze_key(loras),
+            )
+        )
+
+    if upscale is not None:
+        for model in [upscale.upscale_model, upscale.correction_model]:
+            if model is not None:
+                affinities.append(("model", get_model_name(model)))
+
+    return affinities
+
+
+def get_job_coalesce_key(
+    params: ImageParams, size: Size, pipeline: str = "txt2img"
+) -> Optional[Any]:
+    """
+    Describe the settings that must match for jobs to share one batch. Only the plain txt2img pipeline can be
+    batched this way, other pipelines are never coalesced.
+    """
+    if params.get_valid_pipeline(pipeline) != "txt2img":
+        return None
+
+    diffusion = get_job_affinity(params, pipeline)[0]
+    return freeze_key(
+        (
+            diffusion,
+            params.scheduler,
+            params.steps,
+            params.cfg,
+            params.eta,
+            size.width,
+            size.height,
+            params.tiled_vae,
+            params.tiles,
+            params.overlap,
+            params.stride,
+        )
+    )
+
+
+def score_affinity(wanted: List[ModelAffinity], cached: List[ModelAffinity]) -> int:
+    """
+    Score how many of the wanted models are already cached. Exact matches are worth more than models that
+    were loaded with a different pipeline or networks.
+    """
+    score = 0
+    for affinity in wanted:
+        if affinity in cached:
+            score += 2
+        elif any(c[:2] == affinity[:2] for c in cached):
+            score += 1
+
+    return score
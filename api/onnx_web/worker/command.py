@@ -1,4 +1,13 @@
-from typing import Any, Callable, Dict
+from enum import IntEnum
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ..server.metrics import Timing
+
+
+class JobPriority(IntEnum):
+    interactive = 0
+    batch = 1
 
 
 class ProgressCommand:
@@ -8,6 +17,9 @@ class ProgressCommand:
     progress: int
     cancelled: bool
     failed: bool
+    models: Optional[List[Tuple[Any, ...]]]  # models cached by the worker
+    preview: Optional[bytes]  # encoded preview image
+    timings: Optional[List[Timing]]  # recorded since the last update
 
     def __init__(
         self,
@@ -17,6 +29,9 @@ class ProgressCommand:
         progress: int,
         cancelled: bool = False,
         failed: bool = False,
+        models: Optional[List[Tuple[Any, ...]]] = None,
+        preview: Optional[bytes] = None,
+        timings: Optional[List[Timing]] = None,
     ):
         self.job = job
         self.device = device
@@ -24,25 +39,46 @@ class ProgressCommand:
         self.progress = progress
         self.cancelled = cancelled
         self.failed = failed
+        self.models = models
+        self.preview = preview
+        self.timings = timings
 
 
 class JobCommand:
-    device: str
+    device: Optional[str]  # bound when the job is dispatched, unless required
     name: str
     fn: Callable[..., None]
     args: Any
     kwargs: Dict[str, Any]
+    models: List[Tuple[Any, ...]]
+    priority: int
+    queued: float
+
+    coalesce_key: Optional[Any]  # jobs with the same key can be run as one batch
+    coalesce_fn: Optional[Callable[..., None]]  # called with the list of jobs
+    members: List[str]  # names of the jobs in a coalesced batch
 
     def __init__(
         self,
         name: str,
-        device: str,
+        device: Optional[str],
         fn: Callable[..., None],
         args: Any,
         kwargs: Dict[str, Any],
+        models: Optional[List[Tuple[Any, ...]]] = None,
+        priority: int = JobPriority.interactive,
+        coalesce_key: Optional[Any] = None,
+        coalesce_fn: Optional[Callable[..., None]] = None,
+        members: Optional[List[str]] = None,
     ):
         self.device = device
         self.name = name
         self.fn = fn
         self.args = args
         self.kwargs = kwargs
+        self.models = models or []
+        self.priority = priority
+        self.queued = monotonic()
+        self.coalesce_key = coalesce_key
+        self.coalesce_fn = coalesce_fn
+        self.members = members or [name]
@@ -1,10 +1,12 @@
 from logging import getLogger
 from os import getpid
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from torch.multiprocessing import Queue, Value
 
 from ..params import DeviceParams
+from ..server.metrics import Timing, TimingBuffer
+from ..server.writer import OutputWriter
 from .command import JobCommand, ProgressCommand
 
 logger = getLogger(__name__)
@@ -14,14 +16,20 @@ ProgressCallback = Callable[[int, int, Any], None]
 
 
 class WorkerContext:
+    batches: List[
+        int
+    ]  # images for each member of the current batch, once they are known
     cancel: "Value[bool]"
     job: str
+    members: List[str]  # jobs in the current batch, reported together
     pending: "Queue[JobCommand]"
     active_pid: "Value[int]"
-    progress: "Queue[ProgressCommand]"
+    progress: "Queue[Optional[ProgressCommand]]"  # None will wake the pool
     last_progress: Optional[ProgressCommand]
     idle: "Value[bool]"
+    preview_steps: int
     timeout: float
+    timings: Optional[TimingBuffer]  # set by the worker process
 
     def __init__(
         self,
@@ -30,11 +38,14 @@ class WorkerContext:
         cancel: "Value[bool]",
         logs: "Queue[str]",
         pending: "Queue[JobCommand]",
-        progress: "Queue[ProgressCommand]",
+        progress: "Queue[Optional[ProgressCommand]]",
         active_pid: "Value[int]",
         idle: "Value[bool]",
+        preview_steps: int = 0,
     ):
         self.job = job
+        self.members = [job]
+        self.batches = []
         self.device = device
         self.cancel = cancel
         self.progress = progress
@@ -43,10 +54,14 @@ class WorkerContext:
         self.active_pid = active_pid
         self.last_progress = None
         self.idle = idle
+        self.preview_steps = preview_steps
         self.timeout = 1.0
+        self.timings = None
 
-    def start(self, job: str) -> None:
+    def start(self, job: str, members: Optional[List[str]] = None) -> None:
         self.job = job
+        self.members = members or [job]
+        self.batches = []
         self.set_cancel(cancel=False)
         self.set_idle(idle=False)
 
@@ -80,10 +95,64 @@ class WorkerContext:
 
         def on_progress(step: int, timestep: int, latents: Any):
             on_progress.step = step
-            self.set_progress(step)
+            self.set_progress(step, previews=self.get_previews(step, latents))
 
         return ChainProgress.from_progress(on_progress)
 
+    def get_timings(self) -> Optional[List[Timing]]:
+        """
+        Take the timings that have been recorded since the last progress update.
+        """
+        if self.timings is None:
+            return None
+
+        return self.timings.drain() or None
+
+    def get_previews(self, step: int, latents: Any) -> Dict[str, bytes]:
+        """
+        Preview the latents for each job in the current batch, showing each job only its own images.
+        """
+        if self.preview_steps <= 0 or latents is None:
+            return {}
+
+        if step % self.preview_steps != 0:
+            return {}
+
+        from ..diffusers.preview import encode_latent_preview
+
+        try:
+            if len(self.members) == 1:
+                return {self.members[0]: encode_latent_preview(latents)}
+
+            if len(self.batches) != len(self.members) or sum(self.batches) != len(
+                latents
+            ):
+                logger.debug(
+                    "unable to split latents %s between jobs: %s",
+                    latents.shape,
+                    self.members,
+                )
+                return {}
+
+            previews = {}
+            offset = 0
+            for member, batch in zip(self.members, self.batches):
+                previews[member] = encode_latent_preview(
+                    latents[offset : offset + batch]
+                )
+                offset += batch
+
+            return previews
+        except Exception as err:
+            logger.debug("unable to preview latents for job %s: %s", self.job, err)
+            return {}
+
+    def set_batches(self, batches: List[int]) -> None:
+        """
+        Set the number of images for each member of the current batch, in the order of their latents.
+        """
+        self.batches = batches
+
     def set_cancel(self, cancel: bool = True) -> None:
         with self.cancel.get_lock():
             self.cancel.value = cancel
@@ -92,55 +161,118 @@ class WorkerContext:
         with self.idle.get_lock():
             self.idle.value = idle
 
-    def set_progress(self, progress: int) -> None:
+    def set_progress(
+        self, progress: int, previews: Optional[Dict[str, bytes]] = None
+    ) -> None:
         if self.is_cancelled():
             raise RuntimeError("job has been cancelled")
         else:
             logger.debug("setting progress for job %s to %s", self.job, progress)
+            # the batch shares one set of timings, so they are only sent once
+            timings = self.get_timings()
+            for job in self.members:
+                self.last_progress = ProgressCommand(
+                    job,
+                    self.device.device,
+                    False,
+                    progress,
+                    self.is_cancelled(),
+                    False,
+                    preview=(previews or {}).get(job),
+                    timings=timings,
+                )
+                timings = None
+
+                self.progress.put(
+                    self.last_progress,
+                    block=False,
+                )
+
+    def finish(self, models: Optional[List[Tuple[Any, ...]]] = None) -> None:
+        logger.debug("setting finished for job %s", self.job)
+        progress = self.get_progress()
+        timings = self.get_timings()
+        for job in self.members:
             self.last_progress = ProgressCommand(
-                self.job,
+                job,
                 self.device.device,
-                False,
+                True,
                 progress,
                 self.is_cancelled(),
                 False,
+                models=models,
+                timings=timings,
             )
-
+            timings = None
             self.progress.put(
                 self.last_progress,
                 block=False,
             )
 
-    def finish(self) -> None:
-        logger.debug("setting finished for job %s", self.job)
-        self.last_progress = ProgressCommand(
-            self.job,
-            self.device.device,
-            True,
-            self.get_progress(),
-            self.is_cancelled(),
-            False,
-        )
-        self.progress.put(
-            self.last_progress,
-            block=False,
-        )
-
-    def fail(self) -> None:
+    def finish_after(
+        self, writer: OutputWriter, models: Optional[List[Tuple[Any, ...]]] = None
+    ) -> None:
+        """
+        Report the current job as finished once its outputs have been written, or failed if any of them could
+        not be, and mark the worker as idle so it can start the next job in the meantime.
+        """
+        job = self.job
+        members = self.members
+        progress = self.get_progress()
+        cancelled = self.is_cancelled()
+        timings = self.get_timings()
+
+        def on_written(error: Optional[BaseException]):
+            if error is None:
+                logger.debug("outputs written, setting finished for job %s", job)
+            else:
+                logger.warning("error writing outputs for job %s: %s", job, error)
+
+            try:
+                for i, member in enumerate(members):
+                    self.progress.put(
+                        ProgressCommand(
+                            member,
+                            self.device.device,
+                            True,
+                            progress,
+                            cancelled,
+                            error is not None,
+                            models=models,
+                            timings=(timings if i == 0 else None),
+                        ),
+                        block=False,
+                    )
+            except Exception:
+                logger.exception("error setting finished on job %s", job)
+
+        writer.on_done(on_written)
+        self.set_idle()
+
+        # wake the pool, so it sends the next job without waiting for the outputs or the progress interval
+        self.progress.put(None, block=False)
+
+    def fail(self, models: Optional[List[Tuple[Any, ...]]] = None) -> None:
         logger.warning("setting failure for job %s", self.job)
         try:
-            self.last_progress = ProgressCommand(
-                self.job,
-                self.device.device,
-                True,
-                self.get_progress(),
-                self.is_cancelled(),
-                True,
-            )
-            self.progress.put(
-                self.last_progress,
-                block=False,
-            )
+            progress = self.get_progress()
+            timings = self.get_timings()
+            for job in self.members:
+                self.last_progress = ProgressCommand(
+                    job,
+                    self.device.device,
+                    True,
+                    progress,
+                    self.is_cancelled(),
+                    True,
+                    models=models,
+                    timings=timings,
+                )
+                timings = None
+                self.progress.put(
+                    self.last_progress,
+                    block=False,
+                )
         except Exception:
             logger.exception("error setting failure on job %s", self.job)
 
@@ -1,25 +1,37 @@
-from collections import Counter
 from logging import getLogger
-from queue import Empty
-from threading import Lock, Thread
-from typing import Callable, Dict, List, Optional, Tuple
+from queue import Empty, SimpleQueue
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 from torch.multiprocessing import Process, Queue, Value
 
 from ..params import DeviceParams
 from ..server import ServerContext
-from .command import JobCommand, ProgressCommand
+from ..server.metrics import MetricsRegistry
+from .affinity import ModelAffinity, score_affinity
+from .command import JobCommand, JobPriority, ProgressCommand
 from .context import WorkerContext
+from .registry import FINAL_STATES, JobRegistry, JobState
+from .transport import ImageTransport
 from .utils import Interval
 from .worker import worker_main
 
 logger = getLogger(__name__)
 
+ANY_DEVICE = "any"
+
+# jobs are sent through the worker queue by a background thread, so wait briefly for the last ones to arrive
+DRAIN_TIMEOUT = 0.1
+
 
 class DevicePoolExecutor:
     server: ServerContext
     devices: List[DeviceParams]
 
+    affinity_timeout: float
+    coalesce_limit: int
+    coalesce_window: float
     join_timeout: float
     max_jobs_per_worker: int
     max_pending_per_worker: int
@@ -34,21 +46,30 @@ class DevicePoolExecutor:
     context: Dict[str, WorkerContext]  # Device -> Context
     current: Dict[str, "Value[int]"]  # Device -> pid
     pending: Dict[str, "Queue[JobCommand]"]
-    progress: Dict[str, "Queue[ProgressCommand]"]
+    progress: Dict[str, "Queue[Optional[ProgressCommand]]"]
     workers: Dict[str, Process]
 
     health_worker: Interval
     logger_worker: Thread
-    progress_worker: Interval
-
-    cancelled_jobs: List[str]
-    finished_jobs: List[ProgressCommand]
-    pending_jobs: List[JobCommand]
-    running_jobs: Dict[str, ProgressCommand]  # Device -> job progress
+    progress_readers: Dict[str, Thread]
+    progress_worker: Thread
+
+    cancelled_jobs: Set[str]
+    coalesced: Dict[str, List[str]]  # Job -> jobs in the same batch
+    dispatched_jobs: Dict[str, str]  # Device -> last job sent to the worker
+    jobs: JobRegistry
+    metrics: MetricsRegistry
+    ready_jobs: Dict[str, List[JobCommand]]  # Device or any -> jobs waiting
     total_jobs: Dict[str, int]  # Device -> job count
+    transport: ImageTransport
+    warm_models: Dict[str, List[ModelAffinity]]  # Device -> cached models
 
+    events: "SimpleQueue[Optional[ProgressCommand]]"
+    listeners: List[Tuple[Optional[Set[str]], "SimpleQueue[ProgressCommand]"]]
     logs: "Queue[str]"
     rlock: Lock
+    ready_lock: Lock
+    stopped: Event
 
     def __init__(
         self,
@@ -58,10 +79,14 @@ class DevicePoolExecutor:
         join_timeout: float = 5.0,
         recycle_interval: float = 10,
         progress_interval: float = 1.0,
+        affinity_timeout: float = 30.0,
     ):
         self.server = server
         self.devices = devices
 
+        self.affinity_timeout = affinity_timeout
+        self.coalesce_limit = server.coalesce_limit
+        self.coalesce_window = server.coalesce_window
         self.join_timeout = join_timeout
         self.max_jobs_per_worker = server.job_limit
         self.max_pending_per_worker = max_pending_per_worker
@@ -74,17 +99,30 @@ class DevicePoolExecutor:
         self.pending = {}
         self.progress = {}
         self.workers = {}
-
-        self.cancelled_jobs = []
-        self.finished_jobs = []
-        self.pending_jobs = []
-        self.running_jobs = {}
+        self.progress_readers = {}
+
+        self.cancelled_jobs = set()
+        self.coalesced = {}
+        self.dispatched_jobs = {}
+        self.jobs = JobRegistry(
+            limit=server.history_limit,
+            ttl=server.history_ttl,
+            path=server.history_path,
+        )
+        self.metrics = MetricsRegistry()
+        self.ready_jobs = {ANY_DEVICE: []}
         self.total_jobs = {}
+        self.transport = ImageTransport()
+        self.warm_models = {}
         self.worker_cancel = {}
         self.worker_idle = {}
 
+        self.events = SimpleQueue()
+        self.listeners = []
         self.logs = Queue(self.max_pending_per_worker)
         self.rlock = Lock()
+        self.ready_lock = Lock()
+        self.stopped = Event()
 
     def start(self) -> None:
         self.create_health_worker()
@@ -97,11 +135,18 @@ class DevicePoolExecutor:
     def create_device_worker(self, device: DeviceParams) -> None:
         name = device.device
 
+        # jobs that were sent to the old worker but not started would be lost with its queue
+        self.requeue_pending(name)
+
         # always recreate queues
         self.progress[name] = Queue(self.max_pending_per_worker)
         self.pending[name] = Queue(self.max_pending_per_worker)
         self.total_jobs[device.device] = 0
 
+        # a new worker starts with an empty model cache, but keeps any jobs that require this device
+        self.ready_jobs.setdefault(name, [])
+        self.warm_models[name] = []
+
         # reuse pid sentinel
         if name in self.current:
             logger.debug("using existing current worker value")
@@ -112,7 +157,8 @@ class DevicePoolExecutor:
             self.current[name] = current
 
         self.worker_cancel[name] = Value("B", False)
-        self.worker_idle[name] = Value("B", False)
+        # new workers can take a job right away, it will wait in their queue until they start
+        self.worker_idle[name] = Value("B", True)
 
         # create a new context and worker
         context = WorkerContext(
@@ -124,6 +170,7 @@ class DevicePoolExecutor:
             pending=self.pending[name],
             active_pid=current,
             idle=self.worker_idle[name],
+            preview_steps=self.server.preview_steps,
         )
         self.context[name] = context
 
@@ -139,6 +186,42 @@ class DevicePoolExecutor:
         worker.start()
         current.value = worker.pid
 
+        self.create_progress_reader(name)
+
+    def requeue_pending(self, device: str) -> None:
+        """
+        Move jobs from a worker's queue back to the ready jobs for the same device, before the queue is replaced.
+        """
+        queue = self.pending.get(device, None)
+        if queue is None:
+            return
+
+        jobs = []
+        while True:
+            try:
+                jobs.append(queue.get(timeout=DRAIN_TIMEOUT))
+            except Empty:
+                break
+
+        if len(jobs) == 0:
+            return
+
+        logger.info(
+            "returning %s jobs from worker for device %s to the queue: %s",
+            len(jobs),
+            device,
+            [job.name for job in jobs],
+        )
+
+        with self.ready_lock:
+            for job in jobs:
+                if self.dispatched_jobs.get(device) == job.name:
+                    del self.dispatched_jobs[device]
+
+                self.ready_jobs.setdefault(device, []).append(job)
+
+        self.wake()
+
     def create_health_worker(self) -> None:
         self.health_worker = Interval(self.recycle_interval, health_main, args=(self,))
         self.health_worker.daemon = True
@@ -160,37 +243,89 @@ class DevicePoolExecutor:
         logger.debug("starting logger worker")
         self.logger_worker.start()
 
+    def create_progress_reader(self, device: str) -> None:
+        reader = Thread(
+            name=f"onnx-web progress: {device}",
+            target=progress_reader_main,
+            args=(
+                self,
+                device,
+                self.progress[device],
+            ),
+            daemon=True,
+        )
+        self.progress_readers[device] = reader
+
+        logger.debug("starting progress reader for device %s", device)
+        reader.start()
+
     def create_progress_worker(self) -> None:
-        self.progress_worker = Interval(
-            self.progress_interval, progress_main, args=(self,)
+        self.progress_worker = Thread(
+            name="onnx-web progress",
+            target=progress_main,
+            args=(self,),
+            daemon=True,
         )
-        self.progress_worker.daemon = True
-        self.progress_worker.name = "onnx-web progress"
+
         logger.debug("starting progress worker")
         self.progress_worker.start()
 
-    def get_job_context(self, key: str) -> WorkerContext:
-        device, _progress = self.running_jobs[key]
-        return self.context[device]
+    def subscribe(
+        self, keys: Optional[List[str]] = None, limit: Optional[int] = None
+    ) -> Optional["SimpleQueue[ProgressCommand]"]:
+        """
+        Listen for progress updates for some jobs, or all jobs if no keys are given.
 
-    def get_next_device(self, needs_device: Optional[DeviceParams] = None) -> int:
-        # respect overrides if possible
-        if needs_device is not None:
-            for i in range(len(self.devices)):
-                if self.devices[i].device == needs_device.device:
-                    return i
+        If there are already as many listeners as the limit, this will return None instead.
+        """
+        listener = SimpleQueue()
+        with self.ready_lock:
+            if limit is not None and len(self.listeners) >= limit:
+                logger.warning("too many progress listeners: %s", len(self.listeners))
+                return None
 
-        jobs = Counter(range(len(self.devices)))
-        jobs.update([self.pending[d.device].qsize() for d in self.devices])
+            self.listeners.append((set(keys) if keys else None, listener))
 
-        queued = jobs.most_common()
-        logger.trace("jobs queued by device: %s", queued)
+        return listener
 
-        lowest_count = queued[-1][1]
-        lowest_devices = [d[0] for d in queued if d[1] == lowest_count]
-        lowest_devices.sort()
+    def unsubscribe(self, listener: "SimpleQueue[ProgressCommand]") -> None:
+        with self.ready_lock:
+            self.listeners[:] = [
+                (keys, queue) for keys, queue in self.listeners if queue is not listener
+            ]
 
-        return lowest_devices[0]
+    def notify(self, progress: ProgressCommand) -> None:
+        with self.ready_lock:
+            listeners = list(self.listeners)
+
+        for keys, queue in listeners:
+            if keys is None or progress.job in keys:
+                queue.put(progress)
+
+    def wake(self) -> None:
+        """
+        Wake the progress worker to schedule jobs without waiting for a progress event.
+        """
+        self.events.put(None)
+
+    def get_job_context(self, key: str) -> WorkerContext:
+        return self.context[self.jobs.get(key).device]
+
+    def get_affinity(self, device: str, job: JobCommand) -> int:
+        """
+        Score how many of the models needed by a job are already loaded on a device.
+        """
+        return score_affinity(job.models, self.warm_models.get(device, []))
+
+    def set_warm(self, device: str, models: List[ModelAffinity]) -> None:
+        """
+        Assume that a device will have the models for a job that was sent to it, until the worker reports
+        the contents of its model cache.
+        """
+        cached = self.warm_models.setdefault(device, [])
+        for model in models:
+            if model not in cached:
+                cached.append(model)
 
     def cancel(self, key: str) -> bool:
         """
@@ -199,24 +334,37 @@ class DevicePoolExecutor:
         should be cancelled on the next progress callback.
         """
 
-        for job in self.finished_jobs:
-            if job.job == key:
-                logger.debug("cannot cancel finished job: %s", key)
-                return False
+        record = self.jobs.get(key)
+        if record is not None and record.final:
+            logger.debug("cannot cancel finished job: %s", key)
+            return False
+
+        cancelled = None
+        with self.ready_lock:
+            for queue in self.ready_jobs.values():
+                for job in queue:
+                    if job.name == key:
+                        queue.remove(job)
+                        cancelled = ProgressCommand(
+                            key, job.device or ANY_DEVICE, True, 0, cancelled=True
+                        )
+                        break
+
+        if cancelled is not None:
+            logger.info("cancelled pending job: %s", key)
+            self.jobs.update(cancelled)
+            self.transport.release(key)
+            self.notify(cancelled)
+            return True
 
-        for job in self.pending_jobs:
-            if job.name == key:
-                self.pending_jobs.remove(job)
-                logger.info("cancelled pending job: %s", key)
-                return True
+        # jobs that have been dispatched will be cancelled when they start
 
-        if key not in self.running_jobs:
+        if record is None or record.state != JobState.running:
             logger.debug("cancelled job is not active: %s", key)
         else:
-            job = self.running_jobs[key]
-            logger.info("cancelling job %s, active on device %s", key, job.device)
+            logger.info("cancelling job %s, active on device %s", key, record.device)
 
-        self.cancelled_jobs.append(key)
+        self.cancelled_jobs.add(key)
         return True
 
     def done(self, key: str) -> Tuple[bool, Optional[ProgressCommand]]:
@@ -225,22 +373,26 @@ class DevicePoolExecutor:
 
         If the job is still pending, the first item will be True and there will be no ProgressCommand.
         """
-        if key in self.running_jobs:
-            logger.debug("checking status for running job: %s", key)
-            return (False, self.running_jobs[key])
+        record = self.jobs.get(key)
+        if record is None:
+            logger.trace("checking status for unknown job: %s", key)
+            return (False, None)
 
-        for job in self.finished_jobs:
-            if job.job == key:
-                logger.debug("checking status for finished job: %s", key)
-                return (False, job)
+        logger.debug("checking status for %s job: %s", record.state.name, key)
+        if record.state == JobState.pending:
+            return (True, None)
 
-        for job in self.pending_jobs:
-            if job.name == key:
-                logger.debug("checking status for pending job: %s", key)
-                return (True, None)
+        return (False, record.progress)
+
+    def get_preview(self, key: str) -> Optional[bytes]:
+        """
+        Get the last preview for a running job, which may have been sent a few steps ago.
+        """
+        record = self.jobs.get(key)
+        if record is None:
+            return None
 
-        logger.trace("checking status for unknown job: %s", key)
-        return (False, None)
+        return record.preview
 
     def join(self):
         logger.info("stopping worker pool")
@@ -266,8 +418,9 @@ class DevicePoolExecutor:
             self.health_worker.join(self.recycle_interval)
 
             logger.debug("stopping progress worker")
-            self.progress_worker.cancel()
-            self.progress_worker.join(self.progress_interval)
+            self.stopped.set()
+            self.wake()
+            self.progress_worker.join(self.join_timeout)
 
             logger.debug("stopping logger worker")
             self.logger_worker.join(self.join_timeout)
@@ -287,6 +440,12 @@ class DevicePoolExecutor:
             logger.debug("stopping leaking workers")
             self.join_leaking()
 
+            logger.debug("closing job history")
+            self.jobs.close()
+
+            logger.debug("removing shared images")
+            self.transport.close()
+
             logger.debug("worker pool stopped")
 
     def join_leaking(self):
@@ -304,10 +463,11 @@ class DevicePoolExecutor:
                     )
 
                 try:
-                    progress = context.progress.get_nowait()
-                    while progress is not None:
-                        self.update_job(progress)
+                    # read until the queue is empty, skipping the wake events
+                    while True:
                         progress = context.progress.get_nowait()
+                        if progress is not None:
+                            self.update_job(progress)
                 except Empty:
                     logger.trace("empty queue in leaking worker for device %s", device)
                 except ValueError as e:
@@ -376,6 +536,11 @@ class DevicePoolExecutor:
                 logger.warning("restarting progress worker")
                 self.create_progress_worker()
 
+            for device, reader in self.progress_readers.items():
+                if not reader.is_alive():
+                    logger.warning("restarting progress reader for device %s", device)
+                    self.create_progress_reader(device)
+
             logger.debug("worker pool recycled")
 
     def submit(
@@ -385,20 +550,58 @@ class DevicePoolExecutor:
         /,
         *args,
         needs_device: Optional[DeviceParams] = None,
+        needs_models: Optional[List[ModelAffinity]] = None,
+        priority: int = JobPriority.interactive,
+        coalesce_key: Optional[Any] = None,
+        coalesce_fn: Optional[Callable[..., None]] = None,
         **kwargs,
     ) -> None:
-        device_idx = self.get_next_device(needs_device=needs_device)
-        device = self.devices[device_idx].device
+        """
+        Queue a job for the first compatible device to become idle.
+
+        Jobs with a higher priority (lower value) run first, and jobs will be sent to a device that already has
+        their models loaded when possible. Jobs with the same coalesce key may be held for a short time and
+        then passed to the coalesce function together, as a list of jobs.
+        """
+        device = ANY_DEVICE
+        if needs_device is not None:
+            if needs_device.device in self.context:
+                device = needs_device.device
+            else:
+                logger.warning(
+                    "job %s requires unknown device %s, using any device",
+                    key,
+                    needs_device.device,
+                )
+
         logger.info(
-            "assigning job %s to device %s: %s",
+            "queueing job %s for %s with %s priority",
             key,
-            device_idx,
             device,
+            JobPriority(priority).name,
         )
 
-        # build and queue job
-        job = JobCommand(key, device, fn, args, kwargs)
-        self.pending_jobs.append(job)
+        # build and queue job, the device will be bound when it is dispatched
+        job = JobCommand(
+            key,
+            None if device == ANY_DEVICE else device,
+            fn,
+            args,
+            kwargs,
+            models=needs_models,
+            priority=priority,
+            coalesce_key=coalesce_key,
+            coalesce_fn=coalesce_fn,
+        )
+
+        # send images through shared files rather than pickling them into the worker queue
+        self.transport.share(job)
+
+        with self.ready_lock:
+            self.jobs.add(key, job.device)
+            self.ready_jobs[device].append(job)
+
+        self.wake()
 
     def status(self) -> Dict[str, List[Tuple[str, int, bool, bool, bool, bool]]]:
         """
@@ -408,36 +611,36 @@ class DevicePoolExecutor:
             "cancelled": [],
             "finished": [
                 (
-                    job.job,
-                    job.progress,
+                    record.name,
+                    record.progress.progress,
                     False,
-                    job.finished,
-                    job.cancelled,
-                    job.failed,
+                    record.progress.finished,
+                    record.progress.cancelled,
+                    record.progress.failed,
                 )
-                for job in self.finished_jobs
+                for record in self.jobs.by_state(*FINAL_STATES)
             ],
             "pending": [
                 (
-                    job.name,
+                    record.name,
                     0,
                     True,
                     False,
                     False,
                     False,
                 )
-                for job in self.pending_jobs
+                for record in self.jobs.by_state(JobState.pending)
             ],
             "running": [
                 (
-                    name,
-                    job.progress,
+                    record.name,
+                    record.progress.progress,
                     False,
-                    job.finished,
-                    job.cancelled,
-                    job.failed,
+                    record.progress.finished,
+                    record.progress.cancelled,
+                    record.progress.failed,
                 )
-                for name, job in self.running_jobs.items()
+                for record in self.jobs.by_state(JobState.running)
             ],
             "total": [
                 (
@@ -452,39 +655,217 @@ class DevicePoolExecutor:
             ],
         }
 
-    def next_job(self, device: str):
-        for job in self.pending_jobs:
-            if job.device == device:
-                logger.debug("enqueuing job %s on device %s", job.name, device)
-                self.pending[device].put(job, block=False)
-                # job will be removed from pending queue when progress is updated
-                return
+    def next_job(self, device: str, warm_only: bool = False) -> Optional[JobCommand]:
+        """
+        Take the next job that can run on a device, from the highest priority class. Within that class, jobs
+        for models that the device has already loaded are preferred, unless the oldest job has been waiting for
+        longer than the affinity timeout.
+
+        Must be called while holding the ready lock.
+        """
+        queues = [self.ready_jobs.get(device, []), self.ready_jobs[ANY_DEVICE]]
+        now = monotonic()
+        candidates = [
+            (job.priority, job.queued, job, queue)
+            for queue in queues
+            for job in queue
+            if not self.is_held(queues, job, now)
+        ]
+        if len(candidates) == 0:
+            logger.trace("no pending jobs for device %s", device)
+            return None
+
+        top_priority = min(priority for priority, _queued, _job, _queue in candidates)
+        top = sorted(
+            [c for c in candidates if c[0] == top_priority], key=lambda c: c[1]
+        )
+        scores = {c[2].name: self.get_affinity(device, c[2]) for c in top}
+
+        # the sort is stable, so the oldest job with the best score comes first
+        warm = sorted(
+            [c for c in top if scores[c[2].name] > 0], key=lambda c: -scores[c[2].name]
+        )
+
+        oldest = top[0]
+        expired = monotonic() - oldest[1] > self.affinity_timeout
+
+        if len(warm) > 0 and (not expired or warm[0] is oldest):
+            selected = warm[0]
+        elif warm_only:
+            return None
+        else:
+            selected = oldest
+
+        _priority, _queued, job, queue = selected
+        queue.remove(job)
+        return self.coalesce_job(queues, job)
+
+    def is_held(
+        self, queues: List[List[JobCommand]], job: JobCommand, now: float
+    ) -> bool:
+        """
+        Check if a job is waiting for more compatible jobs to join its batch, which lasts until the batch is
+        full or the coalesce window has passed.
+
+        Must be called while holding the ready lock.
+        """
+        if job.coalesce_key is None or self.coalesce_window <= 0:
+            return False
 
-        logger.trace("no pending jobs for device %s", device)
+        if now - job.queued >= self.coalesce_window:
+            return False
+
+        compatible = sum(
+            1
+            for queue in queues
+            for other in queue
+            if other.coalesce_key == job.coalesce_key
+        )
+        return compatible < self.coalesce_limit
+
+    def coalesce_job(
+        self, queues: List[List[JobCommand]], job: JobCommand
+    ) -> JobCommand:
+        """
+        Take the oldest ready jobs that are compatible with the selected job and merge them into one batch.
+
+        Must be called while holding the ready lock.
+        """
+        if (
+            job.coalesce_key is None
+            or job.coalesce_fn is None
+            or self.coalesce_window <= 0
+            or self.coalesce_limit <= 1
+        ):
+            return job
+
+        compatible = sorted(
+            [
+                (other.queued, other, queue)
+                for queue in queues
+                for other in queue
+                if other.coalesce_key == job.coalesce_key
+            ],
+            key=lambda c: c[0],
+        )[: self.coalesce_limit - 1]
+        if len(compatible) == 0:
+            return job
+
+        jobs = [job]
+        for _queued, other, queue in compatible:
+            queue.remove(other)
+            jobs.append(other)
+
+        members = [member.name for member in jobs]
+        logger.info("coalescing %s jobs into one batch: %s", len(jobs), members)
+        for name in members:
+            self.coalesced[name] = members
+
+        batch = JobCommand(
+            job.name,
+            job.device,
+            job.coalesce_fn,
+            (jobs,),
+            {},
+            models=job.models,
+            priority=job.priority,
+            members=members,
+        )
+        batch.queued = job.queued
+        return batch
+
+    def dispatch_job(self, device: str, job: JobCommand) -> None:
+        waited = monotonic() - job.queued
+        logger.debug(
+            "enqueuing job %s on device %s, waited %.2fs", job.name, device, waited
+        )
+        self.metrics.observe("queue_wait", (device,), waited)
+
+        # the job will be removed from the pending jobs when progress is updated
+        job.device = device
+        self.dispatched_jobs[device] = job.name
+        self.set_warm(device, job.models)
+        self.context[device].set_idle(False)
+        self.pending[device].put(job, block=False)
+
+    def schedule(self) -> None:
+        """
+        Bind ready jobs to idle devices. Idle devices that already have the models for a waiting job take those
+        jobs first, then the remaining devices take the oldest jobs.
+        """
+        idle = [device for device, context in self.context.items() if context.is_idle()]
+        if len(idle) == 0:
+            return
+
+        with self.ready_lock:
+            for warm_only in [True, False]:
+                for device in list(idle):
+                    job = self.next_job(device, warm_only=warm_only)
+                    if job is not None:
+                        self.dispatch_job(device, job)
+                        idle.remove(device)
 
     def finish_job(self, progress: ProgressCommand):
         # move from running to finished
         logger.info("job has finished: %s", progress.job)
-        self.finished_jobs.append(progress)
-        if progress.job in self.running_jobs:
-            del self.running_jobs[progress.job]
+        record = self.jobs.update(progress)
+        self.transport.release(progress.job)
+        self.coalesced.pop(progress.job, None)
+
+        # the worker is idle once it finishes the last job it was sent
+        if self.dispatched_jobs.get(progress.device) == progress.job:
+            del self.dispatched_jobs[progress.device]
+            if progress.device in self.context:
+                self.context[progress.device].set_idle()
+
+        if progress.models is not None:
+            logger.debug(
+                "worker for device %s has %s models cached",
+                progress.device,
+                len(progress.models),
+            )
+            self.warm_models[progress.device] = progress.models
 
         self.join_leaking()
-        if progress.job in self.cancelled_jobs:
-            self.cancelled_jobs.remove(progress.job)
+        self.cancelled_jobs.discard(progress.job)
+
+        # jobs that were cancelled while the rest of their batch kept running have already been reported
+        if record is not None:
+            self.notify(progress)
 
     def update_job(self, progress: ProgressCommand):
+        # timings are only needed for the metrics, so they are not kept with the job
+        self.metrics.observe_all(progress.timings)
+        progress.timings = None
+
         if progress.finished:
             return self.finish_job(progress)
 
+        if self.is_cancelled_member(progress.job):
+            # the rest of the batch keeps running, so only report this job as cancelled
+            record = self.jobs.get(progress.job)
+            if record is None or not record.final:
+                logger.info(
+                    "cancelling job %s, the rest of its batch will continue",
+                    progress.job,
+                )
+                cancelled = ProgressCommand(
+                    progress.job,
+                    progress.device,
+                    True,
+                    progress.progress,
+                    cancelled=True,
+                )
+                self.jobs.update(cancelled)
+                self.notify(cancelled)
+
+            return
+
         # move from pending to running
         logger.debug(
             "progress update for job: %s to %s", progress.job, progress.progress
         )
-        self.running_jobs[progress.job] = progress
-        self.pending_jobs[:] = [
-            job for job in self.pending_jobs if job.name != progress.job
-        ]
+        self.jobs.update(progress)
 
         # increment job counter if this is the start of a new job
         if progress.progress == 0:
@@ -508,6 +889,18 @@ class DevicePoolExecutor:
             )
             self.context[progress.device].set_cancel()
 
+        self.notify(progress)
+
+    def is_cancelled_member(self, key: str) -> bool:
+        """
+        Check if a job has been cancelled while other jobs in the same batch have not.
+        """
+        if key not in self.cancelled_jobs:
+            return False
+
+        members = self.coalesced.get(key, [key])
+        return any(name not in self.cancelled_jobs for name in members)
+
     def leak_worker(self, device: str):
         context = self.context[device]
         worker = self.workers[device]
@@ -517,16 +910,16 @@ class DevicePoolExecutor:
 def health_main(pool: DevicePoolExecutor):
     logger.trace("checking in from health worker thread")
     pool.recycle()
+    pool.jobs.prune()
 
     if pool.logs.full():
         logger.warning("logger queue is full, restarting worker")
         pool.logger_worker.join(pool.join_timeout)
         pool.create_logger_worker()
 
-    if any([queue.full() for queue in pool.progress.values()]):
-        logger.warning("progress queue is full, restarting worker")
-        pool.progress_worker.join(pool.join_timeout)
-        pool.create_progress_worker()
+    for device, queue in pool.progress.items():
+        if queue.full():
+            logger.warning("progress queue for device %s is full", device)
 
 
 def logger_main(pool: DevicePoolExecutor, logs: "Queue[str]"):
@@ -545,39 +938,66 @@ def logger_main(pool: DevicePoolExecutor, logs: "Queue[str]"):
             logger.exception("error in log worker")
 
 
-def progress_main(pool: DevicePoolExecutor):
-    logger.trace("checking in from progress worker thread")
+def progress_reader_main(
+    pool: DevicePoolExecutor, device: str, queue: "Queue[Optional[ProgressCommand]]"
+):
+    """
+    Forward progress from a device worker to the progress worker as soon as it arrives.
+    """
+    logger.trace("checking in from progress reader for device %s", device)
 
-    for device, _worker, context in pool.leaking:
-        # whether the worker is alive or not, try to clear its queues
+    while not pool.stopped.is_set():
         try:
-            progress = context.progress.get_nowait()
-            while progress is not None:
-                pool.update_job(progress)
-                progress = context.progress.get_nowait()
+            progress = queue.get(timeout=pool.join_timeout / 2)
+            pool.events.put(progress)
         except Empty:
-            logger.trace("empty queue in leaking worker for device %s", device)
-        except ValueError as e:
-            logger.debug("value error in leaking worker for device %s: %s", device, e)
+            # stop once the queue has been replaced and emptied
+            if pool.progress.get(device) is not queue:
+                break
+        except (OSError, ValueError):
+            logger.debug("progress queue for device %s has been closed", device)
             break
         except Exception:
-            logger.exception("error in leaking worker for device %s", device)
+            logger.exception("error in progress reader for device %s", device)
 
-    for device, queue in pool.progress.items():
+
+def progress_main(pool: DevicePoolExecutor):
+    logger.trace("checking in from progress worker thread")
+
+    while not pool.stopped.is_set():
         try:
-            progress = queue.get_nowait()
-            while progress is not None:
-                pool.update_job(progress)
-                progress = queue.get_nowait()
+            # wait for the next event, or check the idle flags after an interval
+            timeout = pool.progress_interval
+            if pool.coalesce_window > 0:
+                # release held jobs close to the end of their window
+                timeout = min(timeout, pool.coalesce_window)
+
+            event = pool.events.get(timeout=timeout)
+            while True:
+                if event is not None:
+                    pool.update_job(event)
+
+                event = pool.events.get_nowait()
         except Empty:
-            logger.trace("empty queue in progress worker for device %s", device)
-        except ValueError as e:
-            logger.debug("value error in progress worker for device %s: %s", device, e)
-            break
+            pass
         except Exception:
-            logger.exception("error in progress worker for device %s", device)
+            logger.exception("error in progress worker")
+
+        for device, _worker, context in pool.leaking:
+            # whether the worker is alive or not, try to clear its queues
+            try:
+                # read until the queue is empty, skipping the wake events
+                while True:
+                    progress = context.progress.get_nowait()
+                    if progress is not None:
+                        pool.update_job(progress)
+            except Empty:
+                logger.trace("empty queue in leaking worker for device %s", device)
+            except ValueError as e:
+                logger.debug(
+                    "value error in leaking worker for device %s: %s", device, e
+                )
+            except Exception:
+                logger.exception("error in leaking worker for device %s", device)
 
-    for device, context in pool.context.items():
-        if context.is_idle():
-            logger.trace("enqueueing next job for idle worker")
-            pool.next_job(device)
+        pool.schedule()
@@ -0,0 +1,258 @@
+from collections import OrderedDict
+from enum import IntEnum
+from logging import getLogger
+from sqlite3 import Connection, connect
+from threading import Lock
+from time import time
+from typing import Dict, List, Optional
+
+from .command import ProgressCommand
+
+logger = getLogger(__name__)
+
+
+class JobState(IntEnum):
+    pending = 0
+    running = 1
+    finished = 2
+    failed = 3
+    cancelled = 4
+
+
+FINAL_STATES = [JobState.finished, JobState.failed, JobState.cancelled]
+
+
+def get_progress_state(progress: ProgressCommand) -> JobState:
+    if not progress.finished:
+        return JobState.running
+
+    if progress.cancelled:
+        return JobState.cancelled
+
+    if progress.failed:
+        return JobState.failed
+
+    return JobState.finished
+
+
+class JobRecord:
+    name: str
+    state: JobState
+    device: Optional[str]
+    progress: Optional[ProgressCommand]  # last update from the worker
+    preview: Optional[
+        bytes
+    ]  # last preview from the worker, most updates do not have one
+    updated: float
+
+    def __init__(
+        self,
+        name: str,
+        state: JobState,
+        device: Optional[str] = None,
+        progress: Optional[ProgressCommand] = None,
+        updated: Optional[float] = None,
+    ) -> None:
+        self.name = name
+        self.state = state
+        self.device = device
+        self.progress = progress
+        self.preview = None
+        self.updated = updated or time()
+
+    @property
+    def final(self) -> bool:
+        return self.state in FINAL_STATES
+
+
+class JobRegistry:
+    """
+    Index of jobs by name, from the time they are queued until their final record expires. Final records are
+    kept for a limited time and count, and can be saved to a SQLite database so they survive a restart.
+    """
+
+    jobs: Dict[str, JobRecord]
+    final_jobs: "OrderedDict[str, JobRecord]"  # in the order they finished
+    limit: int
+    ttl: Optional[float]
+
+    db: Optional[Connection]
+    lock: Lock
+
+    def __init__(
+        self,
+        limit: int = 1000,
+        ttl: Optional[float] = None,
+        path: Optional[str] = None,
+    ) -> None:
+        self.jobs = {}
+        self.final_jobs = OrderedDict()
+        self.limit = limit
+        self.ttl = ttl
+        self.db = None
+        self.lock = Lock()
+
+        if path is not None:
+            self.open(path)
+
+    def open(self, path: str) -> None:
+        logger.debug("loading job history from %s", path)
+
+        # connections are only used while holding the lock
+        self.db = connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs "
+            "(name TEXT PRIMARY KEY, device TEXT, state TEXT, progress INTEGER, updated REAL)"
+        )
+
+        rows = self.db.execute(
+            "SELECT name, device, state, progress, updated FROM jobs ORDER BY updated"
+        ).fetchall()
+        for name, device, state, progress, updated in rows:
+            if state not in JobState.__members__:
+                logger.warning("unknown state in job history: %s, %s", name, state)
+                continue
+
+            state = JobState[state]
+            record = JobRecord(
+                name,
+                state,
+                device=device,
+                progress=ProgressCommand(
+                    name,
+                    device,
+                    True,
+                    progress,
+                    cancelled=(state == JobState.cancelled),
+                    failed=(state == JobState.failed),
+                ),
+                updated=updated,
+            )
+            self.jobs[name] = record
+            self.final_jobs[name] = record
+
+        logger.info("loaded %s jobs from history", len(rows))
+        self.prune()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    def get(self, name: str) -> Optional[JobRecord]:
+        return self.jobs.get(name)
+
+    def by_state(self, *states: JobState) -> List[JobRecord]:
+        return [record for record in list(self.jobs.values()) if record.state in states]
+
+    def add(self, name: str, device: Optional[str] = None) -> JobRecord:
+        """
+        Add a pending job. Jobs with the same name as a final record, like retries, replace that record.
+        """
+        record = JobRecord(name, JobState.pending, device=device)
+
+        with self.lock:
+            if name in self.jobs and not self.jobs[name].final:
+                logger.warning("job %s is already %s", name, self.jobs[name].state.name)
+
+            self.final_jobs.pop(name, None)
+            self.jobs[name] = record
+
+        return record
+
+    def update(self, progress: ProgressCommand) -> Optional[JobRecord]:
+        """
+        Record a progress update, moving the job from pending to running and then to a final state. Updates
+        for jobs that have already reached a final state are ignored, as are updates for unknown jobs that have
+        not finished yet.
+        """
+        state = get_progress_state(progress)
+
+        with self.lock:
+            record = self.jobs.get(progress.job)
+            if record is None:
+                if not progress.finished:
+                    logger.debug("ignoring update for unknown job: %s", progress.job)
+                    return None
+
+                # the job may have been submitted before a restart or evicted, keep the result in the history
+                record = JobRecord(progress.job, state)
+                self.jobs[progress.job] = record
+            elif record.final:
+                logger.debug(
+                    "ignoring update for %s job: %s", record.state.name, progress.job
+                )
+                return None
+
+            record.state = state
+            record.device = progress.device
+            record.progress = progress
+            record.updated = time()
+
+            if progress.preview is not None:
+                record.preview = progress.preview
+
+            if record.final:
+                # the outputs are ready, so the preview is no longer needed
+                record.preview = None
+                self.final_jobs[record.name] = record
+                self.save(record)
+                self.evict()
+
+        return record
+
+    def save(self, record: JobRecord) -> None:
+        if self.db is None:
+            return
+
+        try:
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO jobs (name, device, state, progress, updated) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        record.name,
+                        record.device,
+                        record.state.name,
+                        record.progress.progress if record.progress else 0,
+                        record.updated,
+                    ),
+                )
+        except Exception:
+            logger.exception("error saving job %s to history", record.name)
+
+    def evict(self) -> None:
+        """
+        Remove the oldest final records that are past the TTL or count limit.
+
+        Must be called while holding the lock.
+        """
+        removed = []
+        expires = time() - self.ttl if self.ttl is not None else None
+        while len(self.final_jobs) > 0:
+            name, record = next(iter(self.final_jobs.items()))
+            if len(self.final_jobs) <= self.limit and (
+                expires is None or record.updated > expires
+            ):
+                break
+
+            del self.final_jobs[name]
+            del self.jobs[name]
+            removed.append(name)
+
+        if len(removed) == 0:
+            return
+
+        logger.debug("removing %s jobs from history", len(removed))
+        if self.db is not None:
+            try:
+                with self.db:
+                    self.db.executemany(
+                        "DELETE FROM jobs WHERE name = ?", [(name,) for name in removed]
+                    )
+            except Exception:
+                logger.exception("error removing jobs from history")
+
+    def prune(self) -> None:
+        with self.lock:
+            self.evict()
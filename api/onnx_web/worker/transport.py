@@ -0,0 +1,185 @@
+from logging import getLogger
+from os import path, remove
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+import numpy as np
+from PIL import Image
+
+from .command import JobCommand
+
+logger = getLogger(__name__)
+
+SHARED_IMAGE_MODES = ["L", "RGB", "RGBA"]
+SHARED_MEMORY_PATH = "/dev/shm"
+
+
+class SharedImage:
+    """
+    Handle for an image that has been written to a memory-mapped file, so that only the handle needs to be
+    sent to the worker.
+    """
+
+    file: str
+    mode: str
+    size: Tuple[int, int]
+
+    def __init__(self, file: str, mode: str, size: Tuple[int, int]) -> None:
+        self.file = file
+        self.mode = mode
+        self.size = size
+
+    @classmethod
+    def from_image(cls, image: Image.Image, root: str) -> "SharedImage":
+        shared = cls(path.join(root, f"{uuid4().hex}.raw"), image.mode, image.size)
+        try:
+            with open(shared.file, "wb") as f:
+                f.write(image.tobytes())
+        except Exception:
+            # do not leave a partial file behind, for example when the shared memory is full
+            shared.remove()
+            raise
+
+        return shared
+
+    def load(self) -> Image.Image:
+        # the pixels are copied into the image, so the file can be removed while the job is still running
+        mapped = np.memmap(self.file, dtype=np.uint8, mode="r")
+        return Image.frombytes(self.mode, self.size, memoryview(mapped))
+
+    def remove(self) -> None:
+        try:
+            remove(self.file)
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            logger.warning("error removing shared image %s: %s", self.file, err)
+
+
+def share_images(value: Any, root: str, shared: List[SharedImage]) -> Any:
+    """
+    Replace the images within the args or kwargs for a job with handles to shared copies.
+    """
+    if isinstance(value, Image.Image) and value.mode in SHARED_IMAGE_MODES:
+        try:
+            image = SharedImage.from_image(value, root)
+            shared.append(image)
+            return image
+        except Exception:
+            logger.exception("error sharing image, sending it through the queue")
+            return value
+
+    # named tuples and other subclasses are sent as they are
+    if type(value) is list:
+        return [share_images(v, root, shared) for v in value]
+
+    if type(value) is tuple:
+        return tuple(share_images(v, root, shared) for v in value)
+
+    if type(value) is dict:
+        return {k: share_images(v, root, shared) for k, v in value.items()}
+
+    return value
+
+
+def load_images(value: Any) -> Any:
+    """
+    Replace the shared image handles within the args or kwargs for a job with the images.
+    """
+    if isinstance(value, SharedImage):
+        return value.load()
+
+    # coalesced batches carry the original jobs
+    if isinstance(value, JobCommand):
+        load_job_images(value)
+        return value
+
+    if type(value) is list:
+        return [load_images(v) for v in value]
+
+    if type(value) is tuple:
+        return tuple(load_images(v) for v in value)
+
+    if type(value) is dict:
+        return {k: load_images(v) for k, v in value.items()}
+
+    return value
+
+
+def load_job_images(job: JobCommand) -> None:
+    job.args = load_images(job.args)
+    job.kwargs = load_images(job.kwargs)
+
+    # chain pipelines keep the images for each stage in the stage kwargs
+    stages = getattr(job.fn, "stages", None)
+    if type(stages) is list:
+        job.fn.stages = load_images(stages)
+
+
+class ImageTransport:
+    """
+    Send images to the workers through memory-mapped files instead of pickling them into the job queues,
+    and remove those files once their job has finished.
+    """
+
+    images: Dict[str, List[SharedImage]]  # job -> shared images
+    lock: Lock
+    root: Optional[str]
+
+    def __init__(self, root: Optional[str] = None) -> None:
+        self.images = {}
+        self.lock = Lock()
+        self.root = root
+
+    def get_root(self) -> str:
+        """
+        Must be called while holding the lock.
+        """
+        if self.root is None:
+            # keep the files in memory when possible
+            base = SHARED_MEMORY_PATH if path.isdir(SHARED_MEMORY_PATH) else None
+            self.root = mkdtemp(prefix="onnx-web-", dir=base)
+            logger.debug("sharing images with workers through %s", self.root)
+
+        return self.root
+
+    def share(self, job: JobCommand) -> None:
+        shared: List[SharedImage] = []
+        with self.lock:
+            root = self.get_root()
+
+        job.args = share_images(job.args, root, shared)
+        job.kwargs = share_images(job.kwargs, root, shared)
+
+        stages = getattr(job.fn, "stages", None)
+        if type(stages) is list:
+            job.fn.stages = share_images(stages, root, shared)
+
+        if len(shared) > 0:
+            logger.debug("shared %s images for job %s", len(shared), job.name)
+            with self.lock:
+                self.images.setdefault(job.name, []).extend(shared)
+
+    def release(self, name: str) -> None:
+        with self.lock:
+            shared = self.images.pop(name, [])
+
+        if len(shared) > 0:
+            logger.debug("removing %s shared images for job %s", len(shared), name)
+            for image in shared:
+                image.remove()
+
+    def close(self) -> None:
+        with self.lock:
+            names = list(self.images.keys())
+
+        for name in names:
+            self.release(name)
+
+        with self.lock:
+            if self.root is not None:
+                rmtree(self.root, ignore_errors=True)
+                self.root = None
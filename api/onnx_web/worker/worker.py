@@ -6,8 +6,11 @@ from sys import exit
 from setproctitle import setproctitle
 
 from ..server import ServerContext, apply_patches
+from ..server.writer import OutputWriter
 from ..torch_before_ort import get_available_providers
+from .affinity import get_cache_affinities
 from .context import WorkerContext
+from .transport import load_job_images
 
 logger = getLogger(__name__)
 
@@ -37,6 +40,22 @@ def worker_main(worker: WorkerContext, server: ServerContext):
     # make leaking workers easier to recycle
     worker.progress.cancel_join_thread()
 
+    # send the timings recorded in this process with each progress update
+    worker.timings = server.timings
+
+    if server.output_threads > 0:
+        server.output_writer = OutputWriter(
+            server.output_threads, server.output_queue_limit
+        )
+
+    try:
+        worker_loop(worker, server)
+    finally:
+        if server.output_writer is not None:
+            server.output_writer.shutdown()
+
+
+def worker_loop(worker: WorkerContext, server: ServerContext):
     while True:
         try:
             if not worker.is_active():
@@ -52,19 +71,30 @@ def worker_main(worker: WorkerContext, server: ServerContext):
             logger.info("worker %s got job: %s", worker.device.device, job.name)
 
             # clear flags and save the job name
-            worker.start(job.name)
+            worker.start(job.name, job.members)
+            if server.output_writer is not None:
+                server.output_writer.start(job.name)
+
             logger.info("starting job: %s", job.name)
 
             # reset progress, which does a final check for cancellation
             worker.set_progress(0)
+            load_job_images(job)
             job.fn(worker, *job.args, **job.kwargs)
 
-            # confirm completion of the job
+            # confirm completion of the job and report the cached models
             logger.info("job succeeded: %s", job.name)
-            worker.finish()
+            logger.debug("prompt cache stats: %s", server.prompt_cache.stats())
+            if server.output_writer is None:
+                worker.finish(models=get_cache_affinities(server.cache))
+            else:
+                worker.finish_after(
+                    server.output_writer, models=get_cache_affinities(server.cache)
+                )
         except Empty:
-            logger.trace("worker reached end of queue, setting idle flag")
-            worker.set_idle()
+            # the pool sets the idle flag when the last job it sent has finished, setting it here could
+            # overwrite a job that was dispatched while the queue was being checked
+            logger.trace("worker reached end of queue")
         except KeyboardInterrupt:
             logger.info("worker got keyboard interrupt")
             worker.fail()
@@ -86,4 +116,4 @@ def worker_main(worker: WorkerContext, server: ServerContext):
             logger.exception(
                 "unrecognized error while running job",
             )
-            worker.fail()
+            worker.fail(models=get_cache_affinities(server.cache))
@@ -0,0 +1,135 @@
+from argparse import ArgumentParser
+from logging import getLogger
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+import torch
+from onnx import ModelProto, load_model, numpy_helper
+from safetensors.torch import save_file
+
+from onnx_web.convert.diffusion.lora import (
+    blend_initializers,
+    blend_lora_weights,
+    fix_initializer_name,
+    fix_node_name,
+)
+
+logger = getLogger(__name__)
+
+LORA_COUNTS = [1, 2, 4]
+
+
+def make_lora(base_model: ModelProto, rank: int, seed: int) -> Dict[str, torch.Tensor]:
+    """
+    Create a random LoRA for the attention and projection nodes in a UNet, with the same keys as a kohya-ss LoRA.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    initializers = {
+        fix_initializer_name(tensor.name): tensor
+        for tensor in base_model.graph.initializer
+    }
+
+    lora = {}
+    for node in base_model.graph.node:
+        node_name = fix_node_name(node.name)
+        if node.op_type == "MatMul" and node_name.endswith("_MatMul"):
+            weight_names = [n for n in node.input if "MatMul" in n]
+            if len(weight_names) == 0 or weight_names[0] not in initializers:
+                continue
+
+            dims = initializers[weight_names[0]].dims
+            if len(dims) != 2:
+                continue
+
+            base_key = node_name[: -len("_MatMul")]
+            down_shape = (rank, dims[0])
+            up_shape = (dims[1], rank)
+        elif node.op_type == "Conv" and node_name.endswith("_Conv"):
+            weight_names = [
+                fix_initializer_name(n) for n in node.input if ".weight" in n
+            ]
+            if len(weight_names) == 0 or weight_names[0] not in initializers:
+                continue
+
+            dims = initializers[weight_names[0]].dims
+            if tuple(dims[-2:]) != (1, 1):
+                continue
+
+            base_key = node_name[: -len("_Conv")]
+            down_shape = (rank, dims[1], 1, 1)
+            up_shape = (dims[0], rank, 1, 1)
+        else:
+            continue
+
+        prefix = f"lora_unet_{base_key}"
+        lora[f"{prefix}.lora_down.weight"] = torch.randn(
+            down_shape, generator=generator
+        )
+        lora[f"{prefix}.lora_up.weight"] = torch.randn(up_shape, generator=generator)
+        lora[f"{prefix}.alpha"] = torch.tensor(float(rank))
+
+    return lora
+
+
+def time_blend(
+    base_model: ModelProto, loras: List[Tuple[str, float]], repeat: int
+) -> Tuple[float, float, int]:
+    initializers = {tensor.name: tensor for tensor in base_model.graph.initializer}
+
+    def get_weights(name: str):
+        return numpy_helper.to_array(initializers[name])
+
+    compose_times = []
+    update_times = []
+    updated = {}
+    for _ in range(repeat):
+        start = perf_counter()
+        blended = blend_lora_weights(loras, "unet")
+        compose_times.append(perf_counter() - start)
+
+        start = perf_counter()
+        updated = blend_initializers(base_model, blended, get_weights)
+        update_times.append(perf_counter() - start)
+
+    return (min(compose_times), min(update_times), len(updated))
+
+
+def main():
+    parser = ArgumentParser(
+        description="Benchmark blending 1, 2, and 4 LoRAs with an SD v1.5 UNet"
+    )
+    parser.add_argument(
+        "--base",
+        type=str,
+        required=True,
+        help="path to the UNet model, like models/stable-diffusion-onnx-v1-5/unet/model.onnx",
+    )
+    parser.add_argument("--lora", nargs="*", type=str, default=[])
+    parser.add_argument("--rank", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print("loading base model from %s" % args.base)
+    base_model = load_model(args.base)
+
+    with TemporaryDirectory() as temp:
+        lora_files = list(args.lora)
+        for i in range(len(lora_files), max(LORA_COUNTS)):
+            lora_file = path.join(temp, f"lora-{i}.safetensors")
+            save_file(make_lora(base_model, args.rank, i), lora_file)
+            lora_files.append(lora_file)
+
+        print("loras  compose  update  total  initializers")
+        for count in LORA_COUNTS:
+            loras = [(lora_file, 1.0 / count) for lora_file in lora_files[:count]]
+            compose, update, updated = time_blend(base_model, loras, args.repeat)
+            print(
+                "%5d  %6.2fs  %5.2fs  %4.2fs  %12d"
+                % (count, compose, update, compose + update, updated)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+from argparse import ArgumentParser
+from time import perf_counter
+
+from PIL import Image
+
+from onnx_web.image.noise_source import (
+    noise_source_fill_edge,
+    noise_source_fill_mask,
+    noise_source_gaussian,
+    noise_source_histogram,
+    noise_source_normal,
+    noise_source_uniform,
+)
+
+NOISE_SOURCES = {
+    "fill-edge": noise_source_fill_edge,
+    "fill-mask": noise_source_fill_mask,
+    "gaussian": noise_source_gaussian,
+    "histogram": noise_source_histogram,
+    "normal": noise_source_normal,
+    "uniform": noise_source_uniform,
+}
+NOISE_SIZES = [512, 1024, 2048]
+
+
+def time_noise(noise_source, size: int, repeat: int) -> float:
+    # outpainting fills the border around a source image half the size of the canvas
+    source = Image.effect_noise((size // 2, size // 2), 64).convert("RGB")
+    origin = (size // 4, size // 4)
+
+    times = []
+    for i in range(repeat):
+        start = perf_counter()
+        noise_source(source, (size, size), origin, seed=i)
+        times.append(perf_counter() - start)
+
+    return min(times)
+
+
+def main():
+    parser = ArgumentParser(
+        description="Benchmark the noise sources used for outpainting at 512, 1024, and 2048px"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print("source      " + "  ".join("%7dpx" % size for size in NOISE_SIZES))
+    for name, noise_source in NOISE_SOURCES.items():
+        times = [time_noise(noise_source, size, args.repeat) for size in NOISE_SIZES]
+        print("%-10s  " % name + "  ".join("%8.3fs" % t for t in times))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,846 @@
+from argparse import ArgumentParser
+from json import dump
+from os import makedirs, path
+from platform import python_version
+from string import ascii_lowercase, digits, punctuation
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import onnxruntime
+import torch
+from diffusers import OnnxRuntimeModel
+from diffusers import __version__ as diffusers_version
+from onnx import TensorProto, helper, numpy_helper, save_model
+from onnxruntime import InferenceSession
+from PIL import Image
+
+from onnx_web.chain.utils import blend_tiles
+from onnx_web.diffusers.load import get_available_pipelines, load_pipeline
+from onnx_web.diffusers.patches.vae import VAEWrapper
+from onnx_web.diffusers.utils import encode_prompt, parse_prompt
+from onnx_web.models.meta import NetworkModel
+from onnx_web.output import save_image
+from onnx_web.params import DeviceParams, ImageParams, Size
+from onnx_web.server import ServerContext
+
+# the synthetic models keep the input and output signatures of the converted models, but are small enough
+# that the time spent outside of the ONNX sessions dominates each step
+CONTROL_CHANNELS = [8, 16, 32]
+CONTROL_NAME = "tiny-control"
+HIDDEN_SIZE = 32
+MAX_LENGTH = 77
+OPSET = 14
+TEXT_LAYERS = 4
+
+BLEND_SIZES = [1024, 2048]
+BLEND_TILE = 512
+SAVE_FORMATS = ["png", "jpeg", "webp"]
+SAVE_SIZE = 1024
+VAE_SIZES = [1024, 2048]
+VAE_WINDOW = 64
+
+PROMPT = "a tiny cat sitting on a small chair, oil painting"
+NEGATIVE_PROMPT = "blurry"
+STRENGTH = 0.5
+
+SCHEDULER_CONFIG = {
+    "_class_name": "DDIMScheduler",
+    "beta_end": 0.012,
+    "beta_schedule": "scaled_linear",
+    "beta_start": 0.00085,
+    "clip_sample": False,
+    "num_train_timesteps": 1000,
+    "set_alpha_to_one": False,
+    "skip_prk_steps": True,
+    "steps_offset": 1,
+}
+
+LOW_RES_SCHEDULER_CONFIG = {
+    "_class_name": "DDPMScheduler",
+    "beta_end": 0.02,
+    "beta_schedule": "linear",
+    "beta_start": 0.0001,
+    "num_train_timesteps": 1000,
+}
+
+# each pipeline runs on the model with the UNet it expects
+PIPELINE_MODELS = {
+    "inpaint": "tiny-inpaint",
+    "pix2pix": "tiny-pix2pix",
+    "upscale": "tiny-upscale",
+}
+DEFAULT_MODEL = "tiny-sd"
+
+# pipelines that do not run on the synthetic models, unless they are named with --pipelines
+SKIP_PIPELINES = {
+    "pix2pix": "expand_prompt builds 2 sets of prompt embeddings, but the pix2pix UNet needs 3",
+}
+
+
+def random_tensor(rng: np.random.Generator, name: str, shape: List[int]):
+    return numpy_helper.from_array(
+        (rng.standard_normal(shape) * 0.1).astype(np.float32), name
+    )
+
+
+def int_tensor(name: str, values: List[int]):
+    return numpy_helper.from_array(np.array(values, dtype=np.int64), name)
+
+
+def float_info(name: str, shape: List[Any]):
+    return helper.make_tensor_value_info(name, TensorProto.FLOAT, shape)
+
+
+def write_model(
+    file: str, nodes: List[Any], inputs: List[Any], outputs: List[Any], initializers
+) -> None:
+    graph = helper.make_graph(
+        nodes, path.basename(path.dirname(file)), inputs, outputs, initializers
+    )
+    model = helper.make_model(
+        graph, opset_imports=[helper.make_opsetid("", OPSET)], ir_version=8
+    )
+
+    makedirs(path.dirname(file), exist_ok=True)
+    save_model(model, file)
+
+
+def write_json(file: str, data: Dict[str, Any]) -> None:
+    makedirs(path.dirname(file), exist_ok=True)
+    with open(file, "w") as f:
+        dump(data, f, indent=2)
+
+
+def write_tokenizer(model: str) -> int:
+    """
+    Write a character-level CLIP tokenizer and return the size of its vocabulary.
+    """
+    chars = ascii_lowercase + digits + punctuation
+    tokens = list(chars) + [f"{c}</w>" for c in chars]
+    tokens += ["<|startoftext|>", "<|endoftext|>"]
+
+    tokenizer = path.join(model, "tokenizer")
+    write_json(
+        path.join(tokenizer, "vocab.json"),
+        {token: i for i, token in enumerate(tokens)},
+    )
+    with open(path.join(tokenizer, "merges.txt"), "w") as f:
+        f.write("#version: 0.2\n")
+
+    write_json(
+        path.join(tokenizer, "tokenizer_config.json"),
+        {
+            "bos_token": "<|startoftext|>",
+            "do_lower_case": True,
+            "eos_token": "<|endoftext|>",
+            "model_max_length": MAX_LENGTH,
+            "pad_token": "<|endoftext|>",
+            "tokenizer_class": "CLIPTokenizer",
+            "unk_token": "<|endoftext|>",
+        },
+    )
+    return len(tokens)
+
+
+def write_text_encoder(file: str, rng: np.random.Generator, vocab: int) -> None:
+    nodes = [helper.make_node("Gather", ["embeddings", "input_ids"], ["hidden_0"])]
+    initializers = [random_tensor(rng, "embeddings", [vocab, HIDDEN_SIZE])]
+    for i in range(TEXT_LAYERS):
+        initializers.append(random_tensor(rng, f"layer_{i}", [HIDDEN_SIZE] * 2))
+        nodes.append(
+            helper.make_node("MatMul", [f"hidden_{i}", f"layer_{i}"], [f"dense_{i}"])
+        )
+        nodes.append(helper.make_node("Tanh", [f"dense_{i}"], [f"hidden_{i + 1}"]))
+
+    nodes.append(
+        helper.make_node("Identity", [f"hidden_{TEXT_LAYERS}"], ["last_hidden_state"])
+    )
+    nodes.append(
+        helper.make_node(
+            "ReduceMean",
+            ["last_hidden_state"],
+            ["pooler_output"],
+            axes=[1],
+            keepdims=0,
+        )
+    )
+
+    hidden_shape = ["batch", "sequence", HIDDEN_SIZE]
+    write_model(
+        file,
+        nodes,
+        [
+            helper.make_tensor_value_info(
+                "input_ids", TensorProto.INT32, ["batch", "sequence"]
+            )
+        ],
+        [
+            float_info("last_hidden_state", hidden_shape),
+            float_info("pooler_output", ["batch", HIDDEN_SIZE]),
+        ]
+        + [float_info(f"hidden_{i}", hidden_shape) for i in range(TEXT_LAYERS + 1)],
+        initializers,
+    )
+
+
+def make_conditioning(rng: np.random.Generator, channels: int):
+    """
+    Add the timestep and the mean of the prompt embeddings to the features, so every input is used.
+    """
+    nodes = [
+        helper.make_node(
+            "ReduceMean",
+            ["encoder_hidden_states"],
+            ["text_mean"],
+            axes=[1],
+            keepdims=0,
+        ),
+        helper.make_node("MatMul", ["text_mean", "text_weight"], ["text_proj"]),
+        helper.make_node("Reshape", ["text_proj", "channel_shape"], ["text_bias"]),
+        helper.make_node("Mul", ["timestep", "time_scale"], ["time_scaled"]),
+        helper.make_node("Reshape", ["time_scaled", "batch_shape"], ["time_bias"]),
+        helper.make_node("Add", ["features", "text_bias"], ["text_features"]),
+        helper.make_node("Add", ["text_features", "time_bias"], ["conditioned"]),
+    ]
+    initializers = [
+        random_tensor(rng, "text_weight", [HIDDEN_SIZE, channels]),
+        int_tensor("channel_shape", [-1, channels, 1, 1]),
+        int_tensor("batch_shape", [-1, 1, 1, 1]),
+        numpy_helper.from_array(np.array(0.001, dtype=np.float32), "time_scale"),
+    ]
+    inputs = [
+        float_info("timestep", ["timesteps"]),
+        float_info("encoder_hidden_states", ["batch", "sequence", HIDDEN_SIZE]),
+    ]
+    return nodes, initializers, inputs
+
+
+def control_shapes() -> List[Any]:
+    """
+    Get the channels and downsampling of each ControlNet residual, following the SD v1.5 UNet.
+    """
+    small, medium, large = CONTROL_CHANNELS
+    return [
+        (small, 1),
+        (small, 1),
+        (small, 1),
+        (small, 2),
+        (medium, 2),
+        (medium, 2),
+        (medium, 4),
+        (large, 4),
+        (large, 4),
+        (large, 8),
+        (large, 8),
+        (large, 8),
+        (large, 8),
+    ]
+
+
+def residual_names() -> List[str]:
+    return [f"down_block_{i}" for i in range(12)] + ["mid_block_additional_residual"]
+
+
+def write_unet(
+    file: str,
+    rng: np.random.Generator,
+    channels: int,
+    control: bool = False,
+    class_labels: bool = False,
+) -> None:
+    nodes, initializers, inputs = make_conditioning(rng, 4)
+    nodes.insert(
+        0,
+        helper.make_node(
+            "Conv", ["sample", "conv_weight", "conv_bias"], ["features"], pads=[1] * 4
+        ),
+    )
+    initializers += [
+        random_tensor(rng, "conv_weight", [4, channels, 3, 3]),
+        random_tensor(rng, "conv_bias", [4]),
+    ]
+    inputs.insert(0, float_info("sample", ["batch", channels, "height", "width"]))
+
+    last = "conditioned"
+    if class_labels:
+        inputs.append(
+            helper.make_tensor_value_info("class_labels", TensorProto.INT64, ["batch"])
+        )
+        nodes += [
+            helper.make_node(
+                "Cast", ["class_labels"], ["labels"], to=TensorProto.FLOAT
+            ),
+            helper.make_node("Mul", ["labels", "time_scale"], ["labels_scaled"]),
+            helper.make_node(
+                "Reshape", ["labels_scaled", "batch_shape"], ["labels_bias"]
+            ),
+            helper.make_node("Add", [last, "labels_bias"], ["labeled"]),
+        ]
+        last = "labeled"
+
+    if control:
+        for name, (residual_channels, scale) in zip(residual_names(), control_shapes()):
+            inputs.append(
+                float_info(
+                    name,
+                    ["batch", residual_channels, f"height/{scale}", f"width/{scale}"],
+                )
+            )
+            nodes += [
+                helper.make_node(
+                    "ReduceMean", [name], [f"{name}_mean"], axes=[1, 2, 3], keepdims=1
+                ),
+                helper.make_node("Add", [last, f"{name}_mean"], [f"{name}_sum"]),
+            ]
+            last = f"{name}_sum"
+
+    nodes.append(helper.make_node("Identity", [last], ["out_sample"]))
+    write_model(
+        file,
+        nodes,
+        inputs,
+        [float_info("out_sample", ["batch", 4, "height", "width"])],
+        initializers,
+    )
+
+
+def write_controlnet(file: str, rng: np.random.Generator) -> None:
+    small = CONTROL_CHANNELS[0]
+    nodes, initializers, inputs = make_conditioning(rng, small)
+    nodes = [
+        helper.make_node("Conv", ["sample", "sample_weight"], ["sample_features"]),
+        helper.make_node(
+            "AveragePool",
+            ["controlnet_cond"],
+            ["cond_pooled"],
+            kernel_shape=[8, 8],
+            strides=[8, 8],
+        ),
+        helper.make_node("Conv", ["cond_pooled", "cond_weight"], ["cond_features"]),
+        helper.make_node("Add", ["sample_features", "cond_features"], ["features"]),
+    ] + nodes
+    initializers += [
+        random_tensor(rng, "sample_weight", [small, 4, 1, 1]),
+        random_tensor(rng, "cond_weight", [small, 3, 1, 1]),
+    ]
+    inputs.insert(0, float_info("sample", ["batch", 4, "height", "width"]))
+    inputs.append(
+        float_info("controlnet_cond", ["batch", 3, "image_height", "image_width"])
+    )
+
+    levels = {1: "conditioned"}
+    for scale in [2, 4, 8]:
+        levels[scale] = f"level_{scale}"
+        nodes.append(
+            helper.make_node(
+                "AveragePool",
+                [levels[scale // 2]],
+                [levels[scale]],
+                kernel_shape=[2, 2],
+                strides=[2, 2],
+            )
+        )
+
+    outputs = []
+    for name, (channels, scale) in zip(residual_names(), control_shapes()):
+        initializers.append(
+            random_tensor(rng, f"{name}_weight", [channels, small, 1, 1])
+        )
+        nodes.append(
+            helper.make_node("Conv", [levels[scale], f"{name}_weight"], [name])
+        )
+        outputs.append(
+            float_info(name, ["batch", channels, f"height/{scale}", f"width/{scale}"])
+        )
+
+    write_model(file, nodes, inputs, outputs, initializers)
+
+
+def write_vae(
+    file: str, rng: np.random.Generator, decoder: bool, scale: int = 8
+) -> None:
+    if decoder:
+        input_name, output_name = "latent_sample", "sample"
+        nodes = [
+            helper.make_node("Conv", [input_name, "weight"], ["features"]),
+            helper.make_node(
+                "Resize", ["features", "", "scales"], ["resized"], mode="nearest"
+            ),
+            helper.make_node("Tanh", ["resized"], [output_name]),
+        ]
+        initializers = [
+            random_tensor(rng, "weight", [3, 4, 1, 1]),
+            numpy_helper.from_array(
+                np.array([1, 1, scale, scale], dtype=np.float32), "scales"
+            ),
+        ]
+        inputs = [float_info(input_name, ["batch", 4, "height", "width"])]
+        outputs = [float_info(output_name, ["batch", 3, "height*8", "width*8"])]
+    else:
+        input_name, output_name = "sample", "latent_sample"
+        nodes = [
+            helper.make_node(
+                "AveragePool",
+                [input_name],
+                ["pooled"],
+                kernel_shape=[scale, scale],
+                strides=[scale, scale],
+            ),
+            helper.make_node("Conv", ["pooled", "weight"], [output_name]),
+        ]
+        initializers = [random_tensor(rng, "weight", [4, 3, 1, 1])]
+        inputs = [float_info(input_name, ["batch", 3, "height", "width"])]
+        outputs = [float_info(output_name, ["batch", 4, "height/8", "width/8"])]
+
+    write_model(file, nodes, inputs, outputs, initializers)
+
+
+def write_diffusion_model(
+    model: str, rng: np.random.Generator, unet_channels: int, upscale: bool = False
+) -> None:
+    vocab = write_tokenizer(model)
+    write_text_encoder(path.join(model, "text_encoder", "model.onnx"), rng, vocab)
+    write_json(path.join(model, "scheduler", "scheduler_config.json"), SCHEDULER_CONFIG)
+
+    components = {
+        "scheduler": ["diffusers", "DDIMScheduler"],
+        "text_encoder": ["diffusers", "OnnxRuntimeModel"],
+        "tokenizer": ["transformers", "CLIPTokenizer"],
+        "unet": ["diffusers", "OnnxRuntimeModel"],
+    }
+
+    if upscale:
+        write_unet(
+            path.join(model, "unet", "model.onnx"),
+            rng,
+            unet_channels,
+            class_labels=True,
+        )
+        write_vae(path.join(model, "vae", "model.onnx"), rng, decoder=True, scale=4)
+        write_json(
+            path.join(model, "low_res_scheduler", "scheduler_config.json"),
+            LOW_RES_SCHEDULER_CONFIG,
+        )
+        components.update(
+            {
+                "_class_name": "OnnxStableDiffusionUpscalePipeline",
+                "low_res_scheduler": ["diffusers", "DDPMScheduler"],
+                "max_noise_level": 350,
+                "vae": ["diffusers", "OnnxRuntimeModel"],
+            }
+        )
+    else:
+        write_unet(path.join(model, "unet", "model.onnx"), rng, unet_channels)
+        write_unet(
+            path.join(model, "cnet", "model.onnx"), rng, unet_channels, control=True
+        )
+        write_vae(path.join(model, "vae_decoder", "model.onnx"), rng, decoder=True)
+        write_vae(path.join(model, "vae_encoder", "model.onnx"), rng, decoder=False)
+        components.update(
+            {
+                "_class_name": "OnnxStableDiffusionPipeline",
+                "feature_extractor": [None, None],
+                "requires_safety_checker": False,
+                "safety_checker": [None, None],
+                "vae_decoder": ["diffusers", "OnnxRuntimeModel"],
+                "vae_encoder": ["diffusers", "OnnxRuntimeModel"],
+            }
+        )
+
+    write_json(path.join(model, "model_index.json"), components)
+
+
+def write_models(model_path: str, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    write_diffusion_model(path.join(model_path, DEFAULT_MODEL), rng, 4)
+    write_diffusion_model(path.join(model_path, PIPELINE_MODELS["inpaint"]), rng, 9)
+    write_diffusion_model(path.join(model_path, PIPELINE_MODELS["pix2pix"]), rng, 8)
+    write_diffusion_model(
+        path.join(model_path, PIPELINE_MODELS["upscale"]), rng, 7, upscale=True
+    )
+    write_controlnet(path.join(model_path, "control", f"{CONTROL_NAME}.onnx"), rng)
+
+
+class SessionTimer:
+    """
+    Time every ONNX session run by the name of the directory holding the model.
+    """
+
+    sessions: Dict[str, Dict[str, float]]
+
+    def __init__(self) -> None:
+        self.sessions = {}
+        self.original_run = InferenceSession.run
+        self.original_binding = InferenceSession.run_with_iobinding
+
+    def __enter__(self):
+        timer = self
+
+        def timed(original):
+            def run(session, *args, **kwargs):
+                start = perf_counter()
+                try:
+                    return original(session, *args, **kwargs)
+                finally:
+                    timer.add(session, perf_counter() - start)
+
+            return run
+
+        InferenceSession.run = timed(self.original_run)
+        InferenceSession.run_with_iobinding = timed(self.original_binding)
+        return self
+
+    def __exit__(self, *args) -> None:
+        InferenceSession.run = self.original_run
+        InferenceSession.run_with_iobinding = self.original_binding
+
+    def add(self, session: InferenceSession, duration: float) -> None:
+        model_path = getattr(session, "_model_path", None)
+        name = path.basename(path.dirname(model_path)) if model_path else "memory"
+        stats = self.sessions.setdefault(name, {"calls": 0, "time": 0.0})
+        stats["calls"] += 1
+        stats["time"] += duration
+
+    def total(self) -> float:
+        return sum(stats["time"] for stats in self.sessions.values())
+
+
+def get_pipe_params(pipeline: str) -> Dict[str, Any]:
+    """
+    Get the extra params that run_img2img_pipeline passes to each pipeline.
+    """
+    if pipeline == "controlnet":
+        return {"controlnet_conditioning_scale": STRENGTH}
+    elif pipeline == "img2img":
+        return {"strength": STRENGTH}
+    elif pipeline == "pix2pix":
+        return {"image_guidance_scale": STRENGTH}
+
+    return {}
+
+
+def run_pipeline(
+    pipeline: str,
+    pipe: Any,
+    params: ImageParams,
+    size: int,
+    callback: Callable,
+) -> None:
+    """
+    Call each pipeline the way its chain stage does.
+    """
+    source = Image.effect_noise((size, size), 64).convert("RGB")
+    rng = np.random.RandomState(params.seed)
+
+    if pipeline in ["txt2img", "panorama"]:
+        width = size * 2 if pipeline == "panorama" else size
+        pipe(
+            params.prompt,
+            height=size,
+            width=width,
+            generator=rng,
+            guidance_scale=params.cfg,
+            negative_prompt=params.negative_prompt,
+            num_inference_steps=params.steps,
+            callback=callback,
+        )
+    elif pipeline == "lpw":
+        pipe.text2img(
+            params.prompt,
+            height=size,
+            width=size,
+            generator=torch.manual_seed(params.seed),
+            guidance_scale=params.cfg,
+            negative_prompt=params.negative_prompt,
+            num_inference_steps=params.steps,
+            callback=callback,
+        )
+    elif pipeline in ["controlnet", "img2img", "pix2pix"]:
+        prompt_pairs, _loras, _inversions = parse_prompt(params)
+        prompt_embeds = encode_prompt(pipe, prompt_pairs, params.batch, params.do_cfg())
+        pipe.unet.set_prompts(prompt_embeds)
+        pipe(
+            params.prompt,
+            source,
+            generator=rng,
+            guidance_scale=params.cfg,
+            negative_prompt=params.negative_prompt,
+            num_images_per_prompt=params.batch,
+            num_inference_steps=params.steps,
+            eta=params.eta,
+            callback=callback,
+            **get_pipe_params(pipeline),
+        )
+    elif pipeline == "inpaint":
+        mask = Image.new("RGB", (size, size), "black")
+        mask.paste("white", (size // 4, size // 4, size * 3 // 4, size * 3 // 4))
+        pipe(
+            params.prompt,
+            generator=rng,
+            guidance_scale=params.cfg,
+            height=size,
+            image=source,
+            mask_image=mask,
+            negative_prompt=params.negative_prompt,
+            num_inference_steps=params.steps,
+            width=size,
+            eta=params.eta,
+            callback=callback,
+        )
+    elif pipeline == "upscale":
+        prompt_pairs, _loras, _inversions = parse_prompt(params)
+        prompt_embeds = encode_prompt(
+            pipe,
+            prompt_pairs,
+            num_images_per_prompt=params.batch,
+            do_classifier_free_guidance=params.do_cfg(),
+        )
+        pipe.unet.set_prompts(prompt_embeds)
+        pipe(
+            params.prompt,
+            source,
+            generator=torch.manual_seed(params.seed),
+            guidance_scale=params.cfg,
+            negative_prompt=params.negative_prompt,
+            num_inference_steps=params.steps,
+            eta=params.eta,
+            noise_level=20,
+            callback=callback,
+        )
+    else:
+        raise ValueError(f"unknown pipeline: {pipeline}")
+
+
+def time_pipeline(
+    server: ServerContext, device: DeviceParams, pipeline: str, args
+) -> Dict[str, Any]:
+    model = path.join(server.model_path, PIPELINE_MODELS.get(pipeline, DEFAULT_MODEL))
+    params = ImageParams(
+        model,
+        pipeline,
+        args.scheduler,
+        PROMPT,
+        7.5,
+        args.steps,
+        42,
+        negative_prompt=NEGATIVE_PROMPT,
+        control=NetworkModel(CONTROL_NAME, "control"),
+        tiles=args.size,
+        stride=args.size // 2,
+    )
+
+    start = perf_counter()
+    load_pipeline(server, params, pipeline, device)
+    load_cold = perf_counter() - start
+
+    start = perf_counter()
+    pipe = load_pipeline(server, params, pipeline, device)
+    load_warm = perf_counter() - start
+
+    best = None
+    for _i in range(args.repeat):
+        steps = []
+
+        def callback(step: int, timestep: int, latents: Any) -> None:
+            steps.append(step)
+
+        with SessionTimer() as timer:
+            start = perf_counter()
+            run_pipeline(pipeline, pipe, params, args.size, callback)
+            total = perf_counter() - start
+
+        if best is None or total < best["total"]:
+            step_count = max(len(steps), 1)
+            best = {
+                "load_cold": load_cold,
+                "load_warm": load_warm,
+                "overhead_per_step": (total - timer.total()) / step_count,
+                "session_time": timer.total(),
+                "sessions": timer.sessions,
+                "steps": len(steps),
+                "time_per_step": total / step_count,
+                "total": total,
+            }
+
+    server.cache.clear()
+    return best
+
+
+def time_blend(size: int, repeat: int) -> Dict[str, Any]:
+    tile_image = Image.effect_noise((BLEND_TILE, BLEND_TILE), 64).convert("RGB")
+    stride = BLEND_TILE * 3 // 4
+    tiles = [
+        (left, top, tile_image)
+        for top in range(0, size - BLEND_TILE + 1, stride)
+        for left in range(0, size - BLEND_TILE + 1, stride)
+    ]
+
+    times = []
+    for _i in range(repeat):
+        start = perf_counter()
+        blend_tiles(tiles, 1, size, size, BLEND_TILE, 0.25)
+        times.append(perf_counter() - start)
+
+    return {"size": size, "tiles": len(tiles), "time": min(times)}
+
+
+def time_vae(
+    server: ServerContext, decoder: str, size: int, repeat: int
+) -> Dict[str, Any]:
+    model = OnnxRuntimeModel(OnnxRuntimeModel.load_model(decoder))
+    vae = VAEWrapper(server, model, decoder=True, window=VAE_WINDOW, overlap=0.25)
+    vae.set_tiled(True)
+
+    latents = np.random.default_rng(0).standard_normal((1, 4, size // 8, size // 8))
+    latents = latents.astype(np.float32)
+
+    times = []
+    for _i in range(repeat):
+        with SessionTimer() as timer:
+            start = perf_counter()
+            vae(latent_sample=latents)
+            total = perf_counter() - start
+
+        times.append((total, timer.total()))
+
+    total, session_time = min(times)
+    return {
+        "overhead": total - session_time,
+        "session_time": session_time,
+        "size": size,
+        "time": total,
+    }
+
+
+def time_save(server: ServerContext, format: str, repeat: int) -> Dict[str, Any]:
+    server.image_format = format
+    image = Image.effect_noise((SAVE_SIZE, SAVE_SIZE), 64).convert("RGB")
+    params = ImageParams(DEFAULT_MODEL, "txt2img", "ddim", PROMPT, 7.5, 20, 42)
+    size = Size(SAVE_SIZE, SAVE_SIZE)
+
+    times = []
+    for i in range(repeat):
+        start = perf_counter()
+        save_image(server, f"bench-{i}.{format}", image, params, size)
+        times.append(perf_counter() - start)
+
+    return {"format": format, "size": SAVE_SIZE, "time": min(times)}
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    print("pipeline    load cold  load warm   per step   overhead   sessions")
+    for name, result in results["pipelines"].items():
+        if "error" in result:
+            print("%-10s  error: %s" % (name, result["error"]))
+        else:
+            print(
+                "%-10s  %8.3fs  %8.3fs  %8.4fs  %8.4fs  %8.3fs"
+                % (
+                    name,
+                    result["load_cold"],
+                    result["load_warm"],
+                    result["time_per_step"],
+                    result["overhead_per_step"],
+                    result["session_time"],
+                )
+            )
+
+    for result in results["blend"]:
+        print("tile blending  %5dpx  %8.3fs" % (result["size"], result["time"]))
+
+    for result in results["vae"]:
+        print(
+            "tiled VAE      %5dpx  %8.3fs  overhead %8.3fs"
+            % (result["size"], result["time"], result["overhead"])
+        )
+
+    for result in results["save"]:
+        if "error" in result:
+            print(
+                "save image     %5s    error: %s" % (result["format"], result["error"])
+            )
+        else:
+            print("save image     %5s    %8.3fs" % (result["format"], result["time"]))
+
+
+def main():
+    parser = ArgumentParser(
+        description="Benchmark the diffusion pipelines and image utilities with tiny synthetic models"
+    )
+    parser.add_argument("--optimizations", type=str, default="")
+    parser.add_argument("--output", type=str, default="bench-pipelines.json")
+    parser.add_argument(
+        "--pipelines",
+        nargs="*",
+        default=[
+            pipeline
+            for pipeline in get_available_pipelines()
+            if pipeline not in SKIP_PIPELINES
+        ],
+    )
+    parser.add_argument("--provider", type=str, default="CPUExecutionProvider")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scheduler", type=str, default="ddim")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--size", type=int, default=128)
+    parser.add_argument("--steps", type=int, default=20)
+    args = parser.parse_args()
+
+    for pipeline, reason in SKIP_PIPELINES.items():
+        if pipeline not in args.pipelines:
+            print("skipping %s pipeline: %s" % (pipeline, reason))
+
+    optimizations = [opt for opt in args.optimizations.split(",") if opt != ""]
+    device = DeviceParams("cpu", args.provider, optimizations=optimizations)
+
+    with TemporaryDirectory() as model_path, TemporaryDirectory() as output_path:
+        write_models(model_path, args.seed)
+        server = ServerContext(
+            model_path=model_path,
+            output_path=output_path,
+            optimizations=optimizations,
+            show_progress=False,
+        )
+
+        results: Dict[str, Any] = {
+            "settings": vars(args),
+            "versions": {
+                "diffusers": diffusers_version,
+                "numpy": np.__version__,
+                "onnxruntime": onnxruntime.__version__,
+                "python": python_version(),
+                "torch": torch.__version__,
+            },
+            "pipelines": {},
+        }
+
+        for pipeline in args.pipelines:
+            try:
+                results["pipelines"][pipeline] = time_pipeline(
+                    server, device, pipeline, args
+                )
+            except Exception as err:
+                results["pipelines"][pipeline] = {"error": repr(err)}
+
+        decoder = path.join(model_path, DEFAULT_MODEL, "vae_decoder", "model.onnx")
+        results["blend"] = [time_blend(size, args.repeat) for size in BLEND_SIZES]
+        results["vae"] = [
+            time_vae(server, decoder, size, args.repeat) for size in VAE_SIZES
+        ]
+        results["save"] = []
+        for format in SAVE_FORMATS:
+            try:
+                results["save"].append(time_save(server, format, args.repeat))
+            except Exception as err:
+                results["save"].append({"format": format, "error": repr(err)})
+
+    with open(args.output, "w") as f:
+        dump(results, f, indent=2)
+
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from onnx_web.chain.utils import (
+  TileBlender,
+  blend_tiles,
+  get_batch_size,
+  get_tile_grads,
+  get_tile_ramp,
+  process_tile_grid,
+)
+
+
+def blend_reference(tiles, scale, width, height, tile, overlap):
+  """
+  Blend tiles one pixel at a time in float64, like blend_tiles did before it used a TileBlender.
+  """
+  adj_tile = int(float(tile) * (1.0 - overlap))
+  count = np.zeros((height * scale, width * scale))
+  value = np.zeros((height * scale, width * scale, 3))
+
+  for left, top, tile_image in tiles:
+    pixels = np.asarray(tile_image, dtype=np.float64)
+    mask = np.ones(pixels.shape[:2])
+
+    if adj_tile < tile:
+      p1 = adj_tile * scale
+      p2 = (tile - adj_tile) * scale
+      points = [0, min(p1, p2), max(p1, p2), tile * scale]
+      grad_x, grad_y = get_tile_grads(left, top, adj_tile, width, height)
+
+      for y in range(mask.shape[0]):
+        for x in range(mask.shape[1]):
+          mask[y, x] = np.interp(x, points, grad_x) * np.interp(y, points, grad_y)
+
+    top, left = top * scale, left * scale
+    bottom = min(top + pixels.shape[0], value.shape[0])
+    right = min(left + pixels.shape[1], value.shape[1])
+    value[top:bottom, left:right] += (pixels * mask[:, :, np.newaxis])[:bottom - top, :right - left]
+    count[top:bottom, left:right] += mask[:bottom - top, :right - left]
+
+  count = count[:, :, np.newaxis]
+  return Image.fromarray(np.uint8(np.where(count > 0, value / count, value)))
+
+
+class TestTileBlending(unittest.TestCase):
+  def test_ramp_edges(self):
+    ramp = get_tile_ramp(64, 64, 48, 1, True, False)
+    self.assertEqual(ramp.dtype, np.float32)
+    self.assertEqual(ramp[0], 1.0)
+    self.assertEqual(ramp[32], 1.0)
+    self.assertLess(ramp[-1], 0.1)
+
+  def test_uniform_tiles(self):
+    blender = TileBlender(2, 96, 96, 64, 0.5)
+    for top in [0, 32, 64]:
+      for left in [0, 32, 64]:
+        blender.add(left, top, Image.new("RGB", (128, 128), (200, 100, 50)))
+
+    pixels = np.asarray(blender.result(), dtype=int)
+    self.assertEqual(pixels.shape, (192, 192, 3))
+    self.assertLessEqual(np.abs(pixels - [200, 100, 50]).max(), 1)
+
+  def test_matches_reference(self):
+    rng = np.random.default_rng(0)
+    for width, height, tile, scale, overlap in [(96, 64, 32, 1, 0.25), (80, 52, 32, 2, 0.5), (64, 64, 32, 2, 0.0)]:
+      adj_tile = int(tile * (1.0 - overlap))
+      tiles = [
+        (left, top, Image.fromarray(rng.integers(0, 255, (tile * scale, tile * scale, 3), dtype=np.uint8)))
+        for top in range(0, height, adj_tile)
+        for left in range(0, width, adj_tile)
+      ]
+
+      expected = np.asarray(blend_reference(tiles, scale, width, height, tile, overlap), dtype=int)
+      output = np.asarray(blend_tiles(tiles, scale, width, height, tile, overlap), dtype=int)
+
+      # the blender accumulates in float32, so pixels that land close to an integer can truncate differently
+      self.assertEqual(output.shape, expected.shape)
+      self.assertLessEqual(np.abs(output - expected).max(), 1)
+      self.assertGreater(np.mean(output == expected), 0.99)
+
+  def test_grid_identity(self):
+    source = Image.fromarray(
+      np.random.default_rng(0).integers(0, 255, (100, 140, 3), dtype=np.uint8)
+    )
+    output = process_tile_grid(source, 64, 1, [lambda tile, dims: tile], overlap=0.25)
+
+    diff = np.abs(np.asarray(output, dtype=int) - np.asarray(source, dtype=int))
+    self.assertLessEqual(diff.max(), 1)
+
+
+class TestTileBatching(unittest.TestCase):
+  def test_batch_size(self):
+    def single(tile, dims):
+      return tile
+
+    def batch(tiles, dims):
+      return tiles
+
+    batch.batch_limit = 4
+
+    self.assertEqual(get_batch_size([single], 64, 1, 2**30), 1)
+    self.assertEqual(get_batch_size([single, batch], 64, 1, 2**30), 4)
+    self.assertEqual(get_batch_size([batch], 512, 4, 2**20), 1)
+
+  def test_batch_grid(self):
+    sizes = []
+
+    def upscale(tiles, dims):
+      sizes.append(len(dims))
+      return tiles.repeat(2, axis=2).repeat(2, axis=3)
+
+    upscale.batch_limit = 0
+
+    source = Image.new("RGB", (128, 96), (10, 20, 30))
+    output = process_tile_grid(source, 32, 2, [upscale])
+
+    self.assertEqual(output.size, (256, 192))
+    self.assertEqual(sum(sizes), 12)
+    self.assertLess(len(sizes), 12)
+    self.assertLessEqual(np.abs(np.asarray(output, dtype=int) - [10, 20, 30]).max(), 1)
@@ -0,0 +1,47 @@
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from onnx_web.image.noise_source import (
+  noise_source_gaussian,
+  noise_source_histogram,
+  noise_source_normal,
+  noise_source_uniform,
+)
+
+NOISE_SOURCES = [
+  noise_source_gaussian,
+  noise_source_histogram,
+  noise_source_normal,
+  noise_source_uniform,
+]
+
+
+class TestNoiseSources(unittest.TestCase):
+  def test_size(self):
+    source = Image.new("RGB", (32, 16), "red")
+    for noise_source in NOISE_SOURCES:
+      noise = noise_source(source, (64, 48), (0, 0), seed=1)
+      self.assertEqual(noise.size, (64, 48))
+      self.assertEqual(noise.mode, "RGB")
+
+  def test_same_seed(self):
+    source = Image.effect_noise((32, 32), 64).convert("RGB")
+    for noise_source in NOISE_SOURCES:
+      first = noise_source(source, (64, 64), (0, 0), seed=42)
+      second = noise_source(source, (64, 64), (0, 0), seed=42)
+      self.assertTrue(np.array_equal(np.array(first), np.array(second)))
+
+  def test_different_seed(self):
+    source = Image.effect_noise((32, 32), 64).convert("RGB")
+    for noise_source in NOISE_SOURCES:
+      first = noise_source(source, (64, 64), (0, 0), seed=1)
+      second = noise_source(source, (64, 64), (0, 0), seed=2)
+      self.assertFalse(np.array_equal(np.array(first), np.array(second)))
+
+  def test_histogram_colors(self):
+    source = Image.new("RGB", (8, 8), (10, 20, 30))
+    noise = np.array(noise_source_histogram(source, (16, 16), (0, 0), seed=1))
+
+    self.assertTrue(np.all(noise == [10, 20, 30]))
@@ -0,0 +1,64 @@
+import unittest
+from os import path, utime
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from onnx_web.server.hash_index import HashIndex, hash_file
+
+
+def write_file(name: str, data: bytes) -> str:
+  with open(name, "wb") as f:
+    f.write(data)
+
+  return name
+
+
+class TestHashIndex(unittest.TestCase):
+  def test_hash_once(self):
+    with TemporaryDirectory() as temp:
+      name = write_file(path.join(temp, "lora.safetensors"), b"weights")
+      index = HashIndex()
+
+      with patch("onnx_web.server.hash_index.hash_file", wraps=hash_file) as hasher:
+        first = index.hash(name)
+        second = index.hash(name)
+
+      self.assertEqual(first, second)
+      self.assertEqual(hasher.call_count, 1)
+
+  def test_changed_file(self):
+    with TemporaryDirectory() as temp:
+      name = write_file(path.join(temp, "lora.safetensors"), b"weights")
+      index = HashIndex()
+      first = index.hash(name)
+
+      write_file(name, b"new weights")
+      utime(name, (1, 1))
+
+      self.assertIsNone(index.get(name))
+      self.assertNotEqual(index.hash(name), first)
+
+  def test_persist(self):
+    with TemporaryDirectory() as temp:
+      name = write_file(path.join(temp, "lora.safetensors"), b"weights")
+      db_path = path.join(temp, "cache", "hashes.db")
+
+      index = HashIndex(db_path)
+      file_hash = index.hash(name)
+      index.close()
+
+      reloaded = HashIndex(db_path)
+      self.assertEqual(reloaded.get(name), file_hash)
+      reloaded.close()
+
+  def test_update_background(self):
+    with TemporaryDirectory() as temp:
+      names = [
+        write_file(path.join(temp, f"lora-{i}.safetensors"), bytes([i]))
+        for i in range(3)
+      ]
+      index = HashIndex()
+      index.update_background(names + [path.join(temp, "missing.safetensors")]).join()
+
+      for name in names:
+        self.assertEqual(index.get(name), hash_file(name))
@@ -0,0 +1,54 @@
+import unittest
+
+from onnx_web.server.metrics import MetricsRegistry, TimingBuffer
+
+
+class TestTimingBuffer(unittest.TestCase):
+  def test_drain(self):
+    buffer = TimingBuffer()
+    buffer.record("stage", ("foo",), 1.0)
+    buffer.record("tile", ("foo",), 0.5)
+
+    self.assertEqual(buffer.drain(), [("stage", ("foo",), 1.0), ("tile", ("foo",), 0.5)])
+    self.assertEqual(buffer.drain(), [])
+
+  def test_limit(self):
+    buffer = TimingBuffer(limit=2)
+    for i in range(3):
+      buffer.record("stage", (str(i),), 1.0)
+
+    self.assertEqual([labels for _metric, labels, _duration in buffer.drain()], [("1",), ("2",)])
+
+  def test_timer_error(self):
+    buffer = TimingBuffer()
+    with self.assertRaises(ValueError):
+      with buffer.timer("session", "unet"):
+        raise ValueError()
+
+    timings = buffer.drain()
+    self.assertEqual(len(timings), 1)
+    self.assertEqual(timings[0][:2], ("session", ("unet",)))
+
+
+class TestMetricsRegistry(unittest.TestCase):
+  def test_observe(self):
+    metrics = MetricsRegistry()
+    metrics.observe_all([
+      ("load_pipeline", ("txt2img", "miss"), 10.0),
+      ("load_pipeline", ("txt2img", "hit"), 0.01),
+      ("load_pipeline", ("txt2img", "hit"), 0.02),
+    ])
+
+    result = metrics.export().decode("utf-8")
+    self.assertIn('onnx_web_load_pipeline_seconds_count{cache="miss",pipeline="txt2img"} 1.0', result)
+    self.assertIn('onnx_web_load_pipeline_seconds_count{cache="hit",pipeline="txt2img"} 2.0', result)
+
+  def test_invalid_timings(self):
+    metrics = MetricsRegistry()
+    metrics.observe_all([
+      ("unknown", ("foo",), 1.0),
+      ("stage", ("foo", "bar"), 1.0),
+    ])
+    metrics.observe_all(None)
+
+    self.assertNotIn("_count{", metrics.export().decode("utf-8"))
@@ -32,3 +32,76 @@ class TestStringMethods(unittest.TestCase):
     cache.set("foo", ("bar",), value)
     self.assertGreater(cache.size, 0)
     self.assertIs(cache.get("foo", ("bin",)), None)
+
+  def test_set_multiple_per_tag(self):
+    cache = ModelCache(10)
+    first = {}
+    second = {}
+    cache.set("foo", ("bar",), first)
+    cache.set("foo", ("bin",), second)
+    self.assertEqual(cache.size, 2)
+    self.assertIs(cache.get("foo", ("bar",)), first)
+    self.assertIs(cache.get("foo", ("bin",)), second)
+
+  def test_set_list_key(self):
+    cache = ModelCache(10)
+    value = {}
+    cache.set("foo", ("bar", [("lora", 1.0)]), value)
+    self.assertIs(cache.get("foo", ("bar", [("lora", 1.0)])), value)
+
+  def test_prune_least_recent(self):
+    cache = ModelCache(2)
+    cache.set("foo", ("bar",), {})
+    cache.set("foo", ("bin",), {})
+    cache.get("foo", ("bar",))
+    cache.set("foo", ("bun",), {})
+    self.assertEqual(cache.size, 2)
+    self.assertIsNotNone(cache.get("foo", ("bar",)))
+    self.assertIsNone(cache.get("foo", ("bin",)))
+    self.assertEqual(cache.evictions, 1)
+
+  def test_prune_memory_limit(self):
+    cache = ModelCache(10, memory_limit=100)
+    cache.set("foo", ("bar",), {}, size=60)
+    cache.set("foo", ("bin",), {}, size=60)
+    self.assertEqual(cache.size, 1)
+    self.assertEqual(cache.memory, 60)
+    self.assertIsNotNone(cache.get("foo", ("bin",)))
+
+  def test_memory_total(self):
+    cache = ModelCache(10)
+    cache.set("foo", ("bar",), {}, size=10)
+    cache.set("foo", ("bin",), {}, size=20)
+    cache.set("foo", ("bar",), {}, size=30)
+    self.assertEqual(cache.memory, 50)
+
+    cache.drop("foo", ("bin",))
+    self.assertEqual(cache.memory, 30)
+
+    cache.clear()
+    self.assertEqual(cache.memory, 0)
+
+  def test_keep_oversized(self):
+    cache = ModelCache(10, memory_limit=100)
+    value = {}
+    cache.set("foo", ("bar",), value, size=200)
+    self.assertIs(cache.get("foo", ("bar",)), value)
+
+  def test_stats(self):
+    cache = ModelCache(10)
+    cache.set("foo", ("bar",), {}, size=10)
+    cache.get("foo", ("bar",))
+    cache.get("foo", ("bin",))
+    stats = cache.stats()
+    self.assertEqual(stats["hits"], 1)
+    self.assertEqual(stats["misses"], 1)
+    self.assertEqual(stats["memory"], 10)
+
+  def test_find_most_recent(self):
+    cache = ModelCache(10)
+    first = {}
+    second = {}
+    cache.set("foo", ("bar", 1), first)
+    cache.set("foo", ("bar", 2), second)
+    self.assertIs(cache.find("foo", lambda key: key[0] == "bar"), second)
+    self.assertIsNone(cache.find("foo", lambda key: key[0] == "bin"))
@@ -0,0 +1,92 @@
+import unittest
+from threading import Event
+
+from onnx_web.server.writer import OutputWriter
+
+
+class TestOutputWriter(unittest.TestCase):
+  def test_done_after_writes(self):
+    writer = OutputWriter(2, 4)
+    writer.start("test")
+
+    started = Event()
+    written = []
+    done = []
+
+    def write(name):
+      started.wait(1.0)
+      written.append(name)
+
+    writer.submit(write, "a")
+    writer.submit(write, "b")
+    writer.on_done(done.append)
+
+    self.assertEqual(done, [])
+
+    started.set()
+    writer.shutdown()
+
+    self.assertEqual(sorted(written), ["a", "b"])
+    self.assertEqual(done, [None])
+
+  def test_done_without_writes(self):
+    writer = OutputWriter(1, 1)
+    writer.start("test")
+
+    done = []
+    writer.on_done(done.append)
+    writer.shutdown()
+
+    self.assertEqual(done, [None])
+
+  def test_done_with_error(self):
+    writer = OutputWriter(1, 1)
+    writer.start("test")
+
+    def write():
+      raise ValueError("disk full")
+
+    done = []
+    writer.submit(write)
+    writer.on_done(done.append)
+    writer.shutdown()
+
+    self.assertEqual(len(done), 1)
+    self.assertIsInstance(done[0], ValueError)
+
+  def test_next_job(self):
+    writer = OutputWriter(1, 2)
+    writer.start("first")
+
+    release = Event()
+    writer.submit(release.wait, 1.0)
+
+    first = []
+    writer.on_done(first.append)
+
+    # writes for the next job should not hold up the first
+    writer.start("second")
+    second = []
+    writer.submit(lambda: None)
+    writer.on_done(second.append)
+
+    release.set()
+    writer.shutdown()
+
+    self.assertEqual(first, [None])
+    self.assertEqual(second, [None])
+
+  def test_backpressure(self):
+    writer = OutputWriter(1, 1)
+    writer.start("test")
+
+    release = Event()
+    writer.submit(release.wait, 1.0)
+
+    # the only slot is taken, so the next write has to wait for it
+    self.assertFalse(writer.slots.acquire(blocking=False))
+
+    release.set()
+    writer.shutdown()
+
+    self.assertTrue(writer.slots.acquire(blocking=False))
@@ -0,0 +1,80 @@
+import unittest
+
+import numpy as np
+from onnx import TensorProto, helper
+from onnxruntime import InferenceSession
+
+from onnx_web.diffusers.patches.binding import BINDING_OUTPUT_BUFFERS, SessionBinding
+
+
+def make_session():
+  # out_sample = sample * timestep + mean(encoder_hidden_states)
+  graph = helper.make_graph(
+    [
+      helper.make_node("Mul", ["sample", "timestep"], ["scaled"]),
+      helper.make_node("ReduceMean", ["encoder_hidden_states"], ["mean"], keepdims=0),
+      helper.make_node("Add", ["scaled", "mean"], ["out_sample"]),
+    ],
+    "unet",
+    [
+      helper.make_tensor_value_info("sample", TensorProto.FLOAT, ["batch", 4, 8, 8]),
+      helper.make_tensor_value_info("timestep", TensorProto.FLOAT, [1]),
+      helper.make_tensor_value_info("encoder_hidden_states", TensorProto.FLOAT, ["batch", 77, 8]),
+    ],
+    [
+      helper.make_tensor_value_info("out_sample", TensorProto.FLOAT, ["batch", 4, 8, 8]),
+    ],
+  )
+  model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)], ir_version=8)
+  return InferenceSession(model.SerializeToString(), providers=["CPUExecutionProvider"])
+
+
+def run_binding(binding, sample, timestep, hidden):
+  binding.bind_input("sample", sample)
+  binding.bind_input("timestep", timestep)
+  binding.bind_constant("encoder_hidden_states", hidden)
+  return binding.run({"out_sample": sample.shape})
+
+
+class TestSessionBinding(unittest.TestCase):
+  def test_matches_session(self):
+    session = make_session()
+    binding = SessionBinding(session)
+
+    rng = np.random.default_rng(1)
+    hidden = rng.standard_normal((2, 77, 8)).astype(np.float32)
+    for step in range(3):
+      sample = rng.standard_normal((2, 4, 8, 8)).astype(np.float32)
+      timestep = np.array([step + 1], dtype=np.float32)
+
+      expected = session.run(None, {
+        "sample": sample,
+        "timestep": timestep,
+        "encoder_hidden_states": hidden,
+      })
+      result = run_binding(binding, sample, timestep, hidden)
+      self.assertTrue(np.allclose(result[0], expected[0]))
+
+    # the hidden states are only bound once
+    self.assertEqual(len(binding.constants), 1)
+
+  def test_convert_dtype(self):
+    binding = SessionBinding(make_session())
+    sample = np.ones((1, 4, 8, 8), dtype=np.float64)
+    hidden = np.zeros((1, 77, 8), dtype=np.float16)
+
+    result = run_binding(binding, sample, np.array([2], dtype=np.int64), hidden)
+    self.assertEqual(result[0].dtype, np.float32)
+    self.assertTrue(np.all(result[0] == 2))
+
+  def test_reuse_outputs(self):
+    binding = SessionBinding(make_session())
+    sample = np.ones((1, 4, 8, 8), dtype=np.float32)
+    timestep = np.array([1], dtype=np.float32)
+    hidden = np.zeros((1, 77, 8), dtype=np.float32)
+
+    first = run_binding(binding, sample, timestep, hidden)[0]
+    outputs = [run_binding(binding, sample, timestep, hidden)[0] for _i in range(BINDING_OUTPUT_BUFFERS)]
+
+    self.assertFalse(any(output is first for output in outputs[:-1]))
+    self.assertIs(outputs[-1], first)
@@ -0,0 +1,166 @@
+import unittest
+
+import numpy as np
+import torch
+from diffusers import (
+  DDIMScheduler,
+  DPMSolverMultistepScheduler,
+  EulerAncestralDiscreteScheduler,
+  EulerDiscreteScheduler,
+  UniPCMultistepScheduler,
+)
+
+from onnx_web.diffusers.numpy_schedulers import (
+  NumpyDDIMScheduler,
+  NumpyDPMSolverMultistepScheduler,
+  NumpyEulerAncestralDiscreteScheduler,
+  NumpyEulerDiscreteScheduler,
+  NumpyUniPCMultistepScheduler,
+)
+
+SD_CONFIG = {
+  "beta_end": 0.012,
+  "beta_schedule": "scaled_linear",
+  "beta_start": 0.00085,
+  "num_train_timesteps": 1000,
+}
+
+SHAPE = (2, 4, 8, 8)
+
+
+def run_loop(scheduler, steps, use_generator=False, **kwargs):
+  """
+  Run a denoising loop the way the ONNX pipelines do, with a fake UNet and torch tensors at the boundary.
+  """
+  rng = np.random.default_rng(42)
+  generator = torch.Generator().manual_seed(7) if use_generator else None
+  if use_generator:
+    kwargs["generator"] = generator
+
+  scheduler.set_timesteps(steps)
+  latents = rng.standard_normal(SHAPE).astype(np.float32) * np.float32(scheduler.init_noise_sigma)
+
+  results = []
+  for t in scheduler.timesteps:
+    model_input = scheduler.scale_model_input(torch.from_numpy(latents), t).numpy()
+    noise_pred = (model_input * 0.1 + rng.standard_normal(SHAPE)).astype(np.float32)
+    latents = scheduler.step(torch.from_numpy(noise_pred), t, torch.from_numpy(latents), **kwargs).prev_sample.numpy()
+    results.append(latents)
+
+  return results
+
+
+class SchedulerComparison:
+  def assert_matches(self, numpy_type, torch_type, config, steps=20, **kwargs):
+    expected = run_loop(torch_type(**SD_CONFIG, **config), steps, **kwargs)
+    results = run_loop(numpy_type(**SD_CONFIG, **config), steps, **kwargs)
+
+    self.assertEqual(len(results), len(expected))
+    for result, target in zip(results, expected):
+      self.assertEqual(result.dtype, target.dtype)
+      self.assertTrue(np.allclose(result, target, rtol=1e-4, atol=1e-4))
+
+
+class TestNumpyDDIMScheduler(unittest.TestCase, SchedulerComparison):
+  def test_matches_diffusers(self):
+    config = {
+      "clip_sample": False,
+      "set_alpha_to_one": False,
+      "steps_offset": 1,
+    }
+    self.assert_matches(NumpyDDIMScheduler, DDIMScheduler, config)
+
+  def test_matches_diffusers_eta(self):
+    self.assert_matches(NumpyDDIMScheduler, DDIMScheduler, {}, eta=0.5, use_generator=True)
+
+  def test_numpy_inputs(self):
+    scheduler = NumpyDDIMScheduler(**SD_CONFIG)
+    scheduler.set_timesteps(10)
+
+    sample = np.ones(SHAPE, dtype=np.float32)
+    result = scheduler.step(sample, scheduler.timesteps[0], sample).prev_sample
+    self.assertIsInstance(result, np.ndarray)
+
+    result = scheduler.step(torch.from_numpy(sample), scheduler.timesteps[0], torch.from_numpy(sample)).prev_sample
+    self.assertIsInstance(result, torch.Tensor)
+
+  def test_add_noise(self):
+    numpy_scheduler = NumpyDDIMScheduler(**SD_CONFIG)
+    torch_scheduler = DDIMScheduler(**SD_CONFIG)
+
+    rng = np.random.default_rng(3)
+    samples = torch.from_numpy(rng.standard_normal(SHAPE).astype(np.float32))
+    noise = torch.from_numpy(rng.standard_normal(SHAPE).astype(np.float32))
+    timesteps = torch.from_numpy(np.array([900, 100], dtype=np.int64))
+
+    result = numpy_scheduler.add_noise(samples, noise, timesteps).numpy()
+    expected = torch_scheduler.add_noise(samples, noise, timesteps).numpy()
+    self.assertTrue(np.allclose(result, expected, rtol=1e-5, atol=1e-5))
+
+
+class TestNumpyEulerDiscreteScheduler(unittest.TestCase, SchedulerComparison):
+  def test_matches_diffusers(self):
+    self.assert_matches(NumpyEulerDiscreteScheduler, EulerDiscreteScheduler, {})
+
+  def test_matches_diffusers_v_prediction(self):
+    self.assert_matches(NumpyEulerDiscreteScheduler, EulerDiscreteScheduler, {
+      "prediction_type": "v_prediction",
+    })
+
+  def test_integer_timestep(self):
+    scheduler = NumpyEulerDiscreteScheduler(**SD_CONFIG)
+    scheduler.set_timesteps(10)
+
+    sample = np.ones(SHAPE, dtype=np.float32)
+    with self.assertRaises(ValueError):
+      scheduler.step(sample, 1, sample)
+
+
+class TestNumpyEulerAncestralDiscreteScheduler(unittest.TestCase, SchedulerComparison):
+  def test_matches_diffusers(self):
+    self.assert_matches(
+      NumpyEulerAncestralDiscreteScheduler,
+      EulerAncestralDiscreteScheduler,
+      {},
+      use_generator=True,
+    )
+
+
+class TestNumpyDPMSolverMultistepScheduler(unittest.TestCase, SchedulerComparison):
+  def test_matches_diffusers(self):
+    self.assert_matches(NumpyDPMSolverMultistepScheduler, DPMSolverMultistepScheduler, {})
+
+  def test_matches_diffusers_lower_order_final(self):
+    self.assert_matches(NumpyDPMSolverMultistepScheduler, DPMSolverMultistepScheduler, {}, steps=10)
+
+  def test_matches_diffusers_third_order(self):
+    self.assert_matches(NumpyDPMSolverMultistepScheduler, DPMSolverMultistepScheduler, {
+      "solver_order": 3,
+      "solver_type": "heun",
+    })
+
+  def test_matches_diffusers_dpmsolver(self):
+    self.assert_matches(NumpyDPMSolverMultistepScheduler, DPMSolverMultistepScheduler, {
+      "algorithm_type": "dpmsolver",
+      "solver_order": 3,
+    })
+
+
+class TestNumpyUniPCMultistepScheduler(unittest.TestCase, SchedulerComparison):
+  def test_matches_diffusers(self):
+    self.assert_matches(NumpyUniPCMultistepScheduler, UniPCMultistepScheduler, {})
+
+  def test_matches_diffusers_lower_order_final(self):
+    self.assert_matches(NumpyUniPCMultistepScheduler, UniPCMultistepScheduler, {}, steps=10)
+
+  def test_matches_diffusers_third_order(self):
+    self.assert_matches(NumpyUniPCMultistepScheduler, UniPCMultistepScheduler, {
+      "solver_order": 3,
+      "solver_type": "bh1",
+    })
+
+  def test_matches_diffusers_predict_epsilon(self):
+    self.assert_matches(NumpyUniPCMultistepScheduler, UniPCMultistepScheduler, {
+      "predict_x0": False,
+      "solver_order": 3,
+    })
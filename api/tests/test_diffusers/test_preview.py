@@ -0,0 +1,32 @@
+import unittest
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from onnx_web.diffusers.preview import decode_latent_preview, encode_latent_preview
+
+
+class TestLatentPreview(unittest.TestCase):
+  def test_batch_size(self):
+    latents = np.zeros((2, 4, 64, 96), dtype=np.float32)
+    preview = decode_latent_preview(latents)
+
+    self.assertEqual(preview.size, (192, 64))
+
+  def test_zero_latents(self):
+    latents = np.zeros((1, 4, 8, 8), dtype=np.float32)
+    preview = np.array(decode_latent_preview(latents))
+
+    self.assertTrue(np.all(preview == 127))
+
+  def test_invalid_channels(self):
+    with self.assertRaises(ValueError):
+      decode_latent_preview(np.zeros((1, 9, 8, 8)))
+
+  def test_encode_jpeg(self):
+    preview = encode_latent_preview(np.random.randn(4, 64, 64))
+    image = Image.open(BytesIO(preview))
+
+    self.assertEqual(image.format, "JPEG")
+    self.assertEqual(image.size, (64, 64))
@@ -0,0 +1,96 @@
+import unittest
+
+import numpy as np
+from onnx import TensorProto, helper
+from onnxruntime import InferenceSession
+
+from onnx_web.diffusers.patches.binding import BINDING_OUTPUT_BUFFERS
+from onnx_web.diffusers.patches.unet import UNetWrapper, get_output_shape
+from onnx_web.server.context import ServerContext
+
+
+def make_session():
+  # inpainting UNets take 9 input channels and return 4: out_sample = sample[:, :4] * timestep + mean(hidden)
+  graph = helper.make_graph(
+    [
+      helper.make_node("Slice", ["sample", "starts", "ends", "axes"], ["latents"]),
+      helper.make_node("Mul", ["latents", "timestep"], ["scaled"]),
+      helper.make_node("ReduceMean", ["encoder_hidden_states"], ["mean"], keepdims=0),
+      helper.make_node("Add", ["scaled", "mean"], ["out_sample"]),
+    ],
+    "unet",
+    [
+      helper.make_tensor_value_info("sample", TensorProto.FLOAT, ["batch", 9, "height", "width"]),
+      helper.make_tensor_value_info("timestep", TensorProto.FLOAT, [1]),
+      helper.make_tensor_value_info("encoder_hidden_states", TensorProto.FLOAT, ["batch", 77, 8]),
+    ],
+    [
+      helper.make_tensor_value_info("out_sample", TensorProto.FLOAT, ["batch", 4, "height", "width"]),
+    ],
+    [
+      helper.make_tensor("starts", TensorProto.INT64, [1], [0]),
+      helper.make_tensor("ends", TensorProto.INT64, [1], [4]),
+      helper.make_tensor("axes", TensorProto.INT64, [1], [1]),
+    ],
+  )
+  model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)], ir_version=8)
+  return InferenceSession(model.SerializeToString(), providers=["CPUExecutionProvider"])
+
+
+class FakeModel:
+  def __init__(self, session):
+    self.model = session
+
+  def __call__(self, **kwargs):
+    return self.model.run(None, kwargs)
+
+
+class TestUNetBinding(unittest.TestCase):
+  def test_output_channels(self):
+    session = make_session()
+    wrapper = UNetWrapper(ServerContext(optimizations=["onnx-iobinding"]), FakeModel(session))
+    self.assertIsNotNone(wrapper.binding)
+
+    rng = np.random.default_rng(1)
+    hidden = rng.standard_normal((2, 77, 8)).astype(np.float32)
+    for size in [8, 16]:
+      sample = rng.standard_normal((2, 9, size, size)).astype(np.float32)
+      timestep = np.array([2], dtype=np.float32)
+
+      expected = session.run(None, {
+        "sample": sample,
+        "timestep": timestep,
+        "encoder_hidden_states": hidden,
+      })
+      result = wrapper(sample=sample, timestep=timestep, encoder_hidden_states=hidden)
+
+      self.assertEqual(result[0].shape, (2, 4, size, size))
+      self.assertTrue(np.allclose(result[0], expected[0]))
+
+    # the wrapper should not have fallen back to the session inputs
+    self.assertIsNotNone(wrapper.binding)
+
+  def test_reuse_outputs(self):
+    wrapper = UNetWrapper(ServerContext(optimizations=["onnx-iobinding"]), FakeModel(make_session()))
+    hidden = np.zeros((1, 77, 8), dtype=np.float32)
+    sample = np.ones((1, 9, 8, 8), dtype=np.float32)
+
+    results = [
+      wrapper(sample=sample, timestep=np.array([step], dtype=np.float32), encoder_hidden_states=hidden)[0]
+      for step in range(BINDING_OUTPUT_BUFFERS + 1)
+    ]
+
+    # the outputs from the last few steps are kept, like the PNDM scheduler needs
+    for step, result in enumerate(results[1:], start=1):
+      self.assertTrue(np.all(result == step))
+
+    # then the output buffers are reused rather than copied
+    self.assertIs(results[0], results[-1])
+
+
+class TestOutputShape(unittest.TestCase):
+  def test_symbolic_dims(self):
+    self.assertEqual(get_output_shape(["batch", 4, "height", "width"], (2, 9, 64, 32)), (2, 4, 64, 32))
+
+  def test_fixed_dims(self):
+    self.assertEqual(get_output_shape([1, 4, 64, 64], (2, 9, 32, 32)), (1, 4, 64, 64))
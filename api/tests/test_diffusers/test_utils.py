@@ -0,0 +1,182 @@
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from onnx_web.diffusers.utils import (
+  encode_tokens,
+  expand_prompts,
+  merge_prompt_embeds,
+)
+from onnx_web.server.model_cache import ModelCache
+
+
+class CountingEncoder:
+  def __init__(self):
+    self.calls = 0
+
+  def __call__(self, input_ids):
+    self.calls += 1
+    batch, tokens = input_ids.shape
+
+    # each embedding depends on the tokens before it, like a causal mask
+    last_state = np.repeat(
+      np.cumsum(input_ids, axis=1)[..., np.newaxis], 8, axis=2
+    ).astype(np.float32)
+    return [last_state, np.zeros((batch, 8), dtype=np.float32)]
+
+
+class WordTokenizer:
+  model_max_length = 77
+
+  def __call__(self, prompt, max_length, truncation, **kwargs):
+    prompts = prompt if isinstance(prompt, list) else [prompt]
+    ids = [[len(word) for word in p.split()] for p in prompts]
+    length = max(max_length, max(len(i) for i in ids))
+    if truncation:
+      length = max_length
+
+    input_ids = np.zeros((len(prompts), length), dtype=np.int64)
+    for row, tokens in enumerate(ids):
+      tokens = tokens[:length]
+      input_ids[row, : len(tokens)] = tokens
+
+    return SimpleNamespace(input_ids=input_ids)
+
+
+def make_pipe(encoder_key="model", cache=None):
+  return SimpleNamespace(
+    prompt_cache=cache if cache is not None else ModelCache(10),
+    text_encoder=CountingEncoder(),
+    text_encoder_key=encoder_key,
+    tokenizer=WordTokenizer(),
+  )
+
+
+class TestEncodeTokens(unittest.TestCase):
+  def test_cache_hit(self):
+    pipe = make_pipe()
+    tokens = np.arange(77).reshape((1, 77))
+
+    first = encode_tokens(pipe, [(tokens, 0)])
+    second = encode_tokens(pipe, [(tokens, 0)])
+
+    self.assertEqual(pipe.text_encoder.calls, 1)
+    self.assertTrue(np.array_equal(first[0], second[0]))
+    self.assertEqual(pipe.prompt_cache.stats()["hits"], 1)
+
+  def test_different_encoder(self):
+    cache = ModelCache(10)
+    tokens = np.zeros((1, 77))
+
+    first = make_pipe("model", cache)
+    encode_tokens(first, [(tokens, 0)])
+    second = make_pipe(("model", (("lora", 1.0),)), cache)
+    encode_tokens(second, [(tokens, 0)])
+
+    self.assertEqual(first.text_encoder.calls, 1)
+    self.assertEqual(second.text_encoder.calls, 1)
+
+  def test_memory_limit(self):
+    # each embedding is 77 * 8 * 4 bytes
+    pipe = make_pipe(cache=ModelCache(10, memory_limit=77 * 8 * 4))
+    encode_tokens(pipe, [(np.zeros((1, 77)), 0)])
+    encode_tokens(pipe, [(np.ones((1, 77)), 0)])
+    encode_tokens(pipe, [(np.zeros((1, 77)), 0)])
+
+    self.assertEqual(pipe.text_encoder.calls, 3)
+    self.assertEqual(pipe.prompt_cache.size, 1)
+
+  def test_no_cache(self):
+    pipe = make_pipe()
+    pipe.text_encoder_key = None
+    tokens = np.zeros((1, 77))
+
+    encode_tokens(pipe, [(tokens, 0)])
+    encode_tokens(pipe, [(tokens, 0)])
+
+    self.assertEqual(pipe.text_encoder.calls, 2)
+    self.assertEqual(pipe.prompt_cache.size, 0)
+
+  def test_batch_groups(self):
+    pipe = make_pipe()
+    groups = [
+      (np.arange(77).reshape((1, 77)), 0),
+      (np.arange(3).reshape((1, 3)) + 1, 0),
+      (np.ones((1, 77)), 0),
+    ]
+
+    batched = encode_tokens(pipe, groups)
+    self.assertEqual(pipe.text_encoder.calls, 1)
+
+    for (input_ids, _skip), embeds in zip(groups, batched):
+      single = CountingEncoder()(input_ids.astype(np.int32))[0]
+      self.assertEqual(embeds.shape, single.shape)
+      self.assertTrue(np.array_equal(embeds, single))
+
+  def test_duplicate_groups(self):
+    pipe = make_pipe()
+    pipe.text_encoder_key = None
+    tokens = np.ones((1, 77))
+
+    embeds = encode_tokens(pipe, [(tokens, 0), (tokens, 0)])
+
+    self.assertEqual(pipe.text_encoder.calls, 1)
+    self.assertTrue(np.array_equal(embeds[0], embeds[1]))
+
+
+class TestExpandPrompts(unittest.TestCase):
+  def test_alternative_prompts(self):
+    pipe = make_pipe()
+    embeds = expand_prompts(
+      pipe,
+      [("a red cat", "blurry"), ("a blue cat", "blurry")],
+      num_images_per_prompt=2,
+      do_classifier_free_guidance=True,
+    )
+
+    self.assertEqual(pipe.text_encoder.calls, 1)
+    self.assertEqual(len(embeds), 2)
+    self.assertEqual(embeds[0].shape, (4, 77, 8))
+    self.assertFalse(np.array_equal(embeds[0], embeds[1]))
+
+  def test_long_prompt(self):
+    pipe = make_pipe()
+    prompt = " ".join(["word"] * 100)
+    embeds = expand_prompts(pipe, [(prompt, None)], 1, True)
+
+    self.assertEqual(pipe.text_encoder.calls, 1)
+    self.assertEqual(embeds[0].shape, (2, 100, 8))
+
+    # the negative prompt is padded with zeros to the length of the prompt
+    self.assertTrue(np.all(embeds[0][0, 77:] == 0))
+
+
+def make_embeds(value, batch=1, tokens=77):
+  # negative rows are negative, positive rows are positive
+  embeds = np.full((batch * 2, tokens, 8), value, dtype=np.float32)
+  embeds[:batch] *= -1
+  return embeds
+
+
+class TestMergePromptEmbeds(unittest.TestCase):
+  def test_cfg_order(self):
+    merged = merge_prompt_embeds([[make_embeds(1, batch=2)], [make_embeds(2)]])
+
+    self.assertEqual(len(merged), 1)
+    self.assertEqual(list(merged[0][:, 0, 0]), [-1, -1, -2, 1, 1, 2])
+
+  def test_alternatives(self):
+    merged = merge_prompt_embeds(
+      [[make_embeds(1), make_embeds(2)], [make_embeds(3), make_embeds(4), make_embeds(5)]]
+    )
+
+    self.assertEqual(len(merged), 6)
+    self.assertEqual([list(m[2:, 0, 0]) for m in merged], [
+      [1, 3], [2, 4], [1, 5], [2, 3], [1, 4], [2, 5],
+    ])
+
+  def test_mismatched_length(self):
+    self.assertIsNone(
+      merge_prompt_embeds([[make_embeds(1)], [make_embeds(2, tokens=154)]])
+    )
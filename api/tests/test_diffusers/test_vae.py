@@ -0,0 +1,105 @@
+import unittest
+
+import numpy as np
+
+from onnx_web.diffusers.patches.vae import VAEWrapper
+from onnx_web.server.context import ServerContext
+
+
+class FakeDecoder:
+  def __init__(self):
+    self.shapes = []
+
+  def __call__(self, latent_sample=None, **kwargs):
+    self.shapes.append(latent_sample.shape)
+    return [latent_sample[:, :3].repeat(8, axis=2).repeat(8, axis=3)]
+
+
+class MixDecoder:
+  def __call__(self, latent_sample=None, **kwargs):
+    pixels = latent_sample[:, :3] * 1.3 + latent_sample[:, 3:4]
+    return [np.tanh(pixels.repeat(8, axis=2).repeat(8, axis=3))]
+
+
+def blend_reference(a, b, blend_extent, axis):
+  """
+  Blend one row or column at a time, like the diffusers AutoencoderKL. This modifies b, so the blended tile is
+  used when blending the next row.
+  """
+  for i in range(min(a.shape[axis], b.shape[axis], blend_extent)):
+    weight = i / blend_extent
+    a_index = [slice(None)] * 4
+    a_index[axis] = -blend_extent + i
+    b_index = [slice(None)] * 4
+    b_index[axis] = i
+    b[tuple(b_index)] = a[tuple(a_index)] * (1 - weight) + b[tuple(b_index)] * weight
+
+  return b
+
+
+def decode_reference(decoder, latents, window, overlap):
+  """
+  Decode and blend one tile at a time, like tiled_decode did before it batched tiles.
+  """
+  sample_size = window * 8
+  overlap_size = int(window * (1 - overlap))
+  blend_extent = int(sample_size * overlap)
+  row_limit = sample_size - blend_extent
+
+  rows = [
+    [
+      decoder(latent_sample=latents[:, :, i : i + window, j : j + window])[0]
+      for j in range(0, latents.shape[3], overlap_size)
+    ]
+    for i in range(0, latents.shape[2], overlap_size)
+  ]
+
+  result_rows = []
+  for i, row in enumerate(rows):
+    result_row = []
+    for j, tile in enumerate(row):
+      if i > 0:
+        tile = blend_reference(rows[i - 1][j], tile, blend_extent, 2)
+      if j > 0:
+        tile = blend_reference(row[j - 1], tile, blend_extent, 3)
+      result_row.append(tile[:, :, :row_limit, :row_limit])
+    result_rows.append(np.concatenate(result_row, axis=3))
+
+  return np.concatenate(result_rows, axis=2)
+
+
+class TestVAEWrapper(unittest.TestCase):
+  def test_blend_v(self):
+    wrapper = VAEWrapper(ServerContext(), FakeDecoder(), True, 64, 0.25)
+    a = np.ones((1, 3, 8, 8), dtype=np.float32)
+    b = np.zeros((1, 3, 8, 8), dtype=np.float32)
+    wrapper.blend_v(a, b, 4)
+
+    self.assertEqual(b[0, 0, :, 0].tolist(), [1.0, 0.75, 0.5, 0.25, 0, 0, 0, 0])
+
+  def test_batch_tiles(self):
+    decoder = FakeDecoder()
+    wrapper = VAEWrapper(ServerContext(vae_batch_size=4), decoder, True, 32, 0.25)
+    wrapper.set_tiled()
+
+    latents = np.ones((1, 4, 64, 64), dtype=np.float32)
+    output = wrapper.tiled_decode(latents, return_dict=False)[0]
+
+    self.assertEqual(output.shape, (1, 3, 512, 512))
+    self.assertTrue(np.allclose(output, 1.0))
+    self.assertEqual(len(decoder.shapes), 4)
+    self.assertEqual(decoder.shapes[0], (4, 4, 32, 32))
+
+  def test_matches_reference(self):
+    rng = np.random.default_rng(0)
+    for height, width, window, overlap in [(96, 128, 64, 0.25), (100, 150, 32, 0.5)]:
+      latents = rng.standard_normal((1, 4, height, width)).astype(np.float32)
+      wrapper = VAEWrapper(ServerContext(vae_batch_size=4), MixDecoder(), True, window, overlap)
+      wrapper.set_tiled()
+
+      output = wrapper.tiled_decode(latents, return_dict=False)[0]
+      expected = decode_reference(MixDecoder(), latents, window, overlap)
+
+      # the ramps are cast to float32 while the reference weights are Python floats, so allow for rounding
+      self.assertEqual(output.shape, expected.shape)
+      self.assertLessEqual(np.abs(output - expected).max(), 1e-6)
@@ -0,0 +1,68 @@
+import unittest
+
+from onnx_web.params import ImageParams, Size
+from onnx_web.server.model_cache import ModelCache
+from onnx_web.worker.affinity import (
+  get_cache_affinities,
+  get_cache_affinity,
+  get_job_coalesce_key,
+  score_affinity,
+)
+
+
+class TestCacheAffinity(unittest.TestCase):
+  def test_diffusion_key(self):
+    key = ("txt2img", "/models/diffusion-a", "cuda", "CUDAExecutionProvider", None, (), (("lora-a", 1.0),))
+    self.assertEqual(
+      get_cache_affinity("diffusion", key),
+      ("diffusion", "/models/diffusion-a", "txt2img", None, (), (("lora-a", 1.0),)),
+    )
+
+  def test_model_path_key(self):
+    self.assertEqual(
+      get_cache_affinity("resrgan", ("/models/upscaling-a.onnx", "onnx")),
+      ("model", "upscaling-a"),
+    )
+
+  def test_skip_scheduler(self):
+    self.assertIsNone(get_cache_affinity("scheduler", ("ddim", "/models/diffusion-a")))
+
+  def test_cache_affinities(self):
+    cache = ModelCache(10)
+    cache.set("gfpgan", ("/models/correction-a.pth",), {})
+    cache.set("scheduler", ("ddim", "/models/diffusion-a"), {})
+    self.assertEqual(get_cache_affinities(cache), [("model", "correction-a")])
+
+
+class TestScoreAffinity(unittest.TestCase):
+  def test_exact_match(self):
+    wanted = [("diffusion", "a", "txt2img", None, (), ())]
+    self.assertEqual(score_affinity(wanted, wanted), 2)
+
+  def test_partial_match(self):
+    wanted = [("diffusion", "a", "txt2img", None, (), ())]
+    cached = [("diffusion", "a", "img2img", None, (), ())]
+    self.assertEqual(score_affinity(wanted, cached), 1)
+
+  def test_no_match(self):
+    wanted = [("diffusion", "a"), ("model", "b")]
+    cached = [("diffusion", "c"), ("model", "d")]
+    self.assertEqual(score_affinity(wanted, cached), 0)
+
+
+class TestCoalesceKey(unittest.TestCase):
+  def test_same_settings(self):
+    size = Size(512, 512)
+    a = ImageParams("model-a", "txt2img", "ddim", "a cat", 7.0, 20, 1)
+    b = ImageParams("model-a", "txt2img", "ddim", "a dog", 7.0, 20, 2, batch=2)
+    self.assertEqual(get_job_coalesce_key(a, size), get_job_coalesce_key(b, size))
+
+  def test_different_networks(self):
+    size = Size(512, 512)
+    a = ImageParams("model-a", "txt2img", "ddim", "a cat", 7.0, 20, 1)
+    b = ImageParams("model-a", "txt2img", "ddim", "a cat <lora:foo:1.0>", 7.0, 20, 1)
+    self.assertNotEqual(get_job_coalesce_key(a, size), get_job_coalesce_key(b, size))
+
+  def test_lpw(self):
+    params = ImageParams("model-a", "lpw", "ddim", "a cat", 7.0, 20, 1)
+    self.assertIsNone(get_job_coalesce_key(params, Size(512, 512)))
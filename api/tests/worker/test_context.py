@@ -0,0 +1,84 @@
+import unittest
+from io import BytesIO
+from multiprocessing import Value
+from queue import Queue
+
+import numpy as np
+from PIL import Image
+
+from onnx_web.params import DeviceParams
+from onnx_web.worker.context import WorkerContext
+
+
+def make_context(preview_steps=1):
+  return WorkerContext(
+    "test",
+    DeviceParams("cpu", "CPUExecutionProvider"),
+    cancel=Value("B", False),
+    logs=Queue(),
+    pending=Queue(),
+    progress=Queue(),
+    active_pid=Value("L", 0),
+    idle=Value("B", True),
+    preview_steps=preview_steps,
+  )
+
+
+class TestWorkerPreviews(unittest.TestCase):
+  def test_preview_steps(self):
+    context = make_context(preview_steps=2)
+    latents = np.zeros((1, 4, 8, 8), dtype=np.float32)
+
+    self.assertIn("test", context.get_previews(0, latents))
+    self.assertEqual(context.get_previews(1, latents), {})
+
+  def test_split_batch(self):
+    context = make_context()
+    context.start("a", ["a", "b"])
+    context.set_batches([1, 2])
+
+    latents = np.zeros((3, 4, 8, 8), dtype=np.float32)
+    previews = context.get_previews(0, latents)
+
+    # each job only sees its own images, which are placed side by side
+    self.assertEqual(Image.open(BytesIO(previews["a"])).size, (8, 8))
+    self.assertEqual(Image.open(BytesIO(previews["b"])).size, (16, 8))
+
+    context.set_progress(0, previews=previews)
+    sent = [context.progress.get_nowait() for _i in range(2)]
+    self.assertEqual([p.preview for p in sent], [previews["a"], previews["b"]])
+
+  def test_unknown_batches(self):
+    context = make_context()
+    context.start("a", ["a", "b"])
+
+    # the members are running one at a time, or their sizes are not known
+    self.assertEqual(context.get_previews(0, np.zeros((3, 4, 8, 8), dtype=np.float32)), {})
+
+
+class PendingWriter:
+  def __init__(self):
+    self.callbacks = []
+
+  def on_done(self, callback):
+    self.callbacks.append(callback)
+
+
+class TestWorkerFinishAfter(unittest.TestCase):
+  def test_wake_pool(self):
+    context = make_context()
+    context.start("a")
+    context.set_idle(False)
+
+    writer = PendingWriter()
+    context.finish_after(writer)
+
+    # the worker is idle and the pool has been woken before the outputs are written
+    self.assertTrue(context.is_idle())
+    self.assertIsNone(context.progress.get_nowait())
+    self.assertTrue(context.progress.empty())
+
+    writer.callbacks[0](None)
+    finished = context.progress.get_nowait()
+    self.assertEqual(finished.job, "a")
+    self.assertTrue(finished.finished)
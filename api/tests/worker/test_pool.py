@@ -0,0 +1,248 @@
+import unittest
+from queue import Queue
+
+from onnx_web.server.context import ServerContext
+from onnx_web.worker.command import JobPriority, ProgressCommand
+from onnx_web.worker.pool import DevicePoolExecutor
+
+
+class FakeContext:
+  def __init__(self, idle: bool = True):
+    self.cancel = False
+    self.idle = idle
+
+  def set_cancel(self, cancel: bool = True):
+    self.cancel = cancel
+
+  def is_idle(self):
+    return self.idle
+
+  def set_idle(self, idle: bool = True):
+    self.idle = idle
+
+
+def noop(*args, **kwargs):
+  pass
+
+
+def make_pool(devices):
+  pool = DevicePoolExecutor(ServerContext(), [])
+  for device in devices:
+    pool.context[device] = FakeContext()
+    pool.pending[device] = Queue()
+    pool.ready_jobs[device] = []
+
+  return pool
+
+
+class TestDevicePoolScheduler(unittest.TestCase):
+  def test_late_binding(self):
+    pool = make_pool(["cpu", "cuda"])
+    pool.context["cpu"].set_idle(False)
+    pool.submit("foo", noop)
+    pool.schedule()
+
+    self.assertEqual(pool.pending["cpu"].qsize(), 0)
+    self.assertEqual(pool.pending["cuda"].get().name, "foo")
+
+  def test_priority(self):
+    pool = make_pool(["cpu"])
+    pool.submit("batch", noop, priority=JobPriority.batch)
+    pool.submit("interactive", noop, priority=JobPriority.interactive)
+    pool.schedule()
+
+    self.assertEqual(pool.pending["cpu"].get().name, "interactive")
+
+  def test_affinity(self):
+    pool = make_pool(["cpu", "cuda"])
+    pool.set_warm("cuda", [("diffusion", "model-b")])
+    pool.submit("a", noop, needs_models=[("diffusion", "model-a")])
+    pool.submit("b", noop, needs_models=[("diffusion", "model-b")])
+    pool.schedule()
+
+    self.assertEqual(pool.pending["cpu"].get().name, "a")
+    self.assertEqual(pool.pending["cuda"].get().name, "b")
+
+  def test_affinity_timeout(self):
+    pool = make_pool(["cpu"])
+    pool.affinity_timeout = 0
+    pool.set_warm("cpu", [("diffusion", "model-b")])
+    pool.submit("a", noop, needs_models=[("diffusion", "model-a")])
+    pool.submit("b", noop, needs_models=[("diffusion", "model-b")])
+    pool.ready_jobs["any"][0].queued -= 1
+    pool.schedule()
+
+    self.assertEqual(pool.pending["cpu"].get().name, "a")
+
+  def test_cancel_ready(self):
+    pool = make_pool(["cpu"])
+    pool.context["cpu"].set_idle(False)
+    pool.submit("foo", noop)
+
+    self.assertTrue(pool.cancel("foo"))
+    self.assertEqual(len(pool.ready_jobs["any"]), 0)
+
+    pool.context["cpu"].set_idle(True)
+    pool.schedule()
+    self.assertEqual(pool.pending["cpu"].qsize(), 0)
+
+  def test_affinity_report(self):
+    pool = make_pool(["cpu", "cuda"])
+    pool.set_warm("cpu", [("diffusion", "model-a")])
+    pool.finish_job(ProgressCommand("foo", "cpu", True, 10, models=[("diffusion", "model-b")]))
+    pool.submit("b", noop, needs_models=[("diffusion", "model-b")])
+    pool.context["cuda"].set_idle(False)
+    pool.schedule()
+
+    self.assertEqual(pool.warm_models["cpu"], [("diffusion", "model-b")])
+    self.assertEqual(pool.pending["cpu"].get().name, "b")
+
+  def test_finish_idle(self):
+    pool = make_pool(["cpu"])
+    pool.submit("foo", noop)
+    pool.schedule()
+    self.assertFalse(pool.context["cpu"].is_idle())
+
+    pool.update_job(ProgressCommand("foo", "cpu", True, 10))
+    self.assertTrue(pool.context["cpu"].is_idle())
+
+  def test_requeue_pending(self):
+    pool = make_pool(["cpu"])
+    pool.submit("foo", noop)
+    pool.schedule()
+
+    # the worker is replaced before it takes the job
+    pool.requeue_pending("cpu")
+    pool.context["cpu"].set_idle()
+    self.assertEqual(pool.pending["cpu"].qsize(), 0)
+    self.assertEqual([job.name for job in pool.ready_jobs["cpu"]], ["foo"])
+    self.assertNotIn("cpu", pool.dispatched_jobs)
+
+    pool.schedule()
+    self.assertEqual(pool.pending["cpu"].get().name, "foo")
+
+  def test_metrics(self):
+    pool = make_pool(["cpu"])
+    pool.submit("foo", noop)
+    pool.schedule()
+
+    progress = ProgressCommand("foo", "cpu", False, 1, timings=[("stage", ("source-txt2img",), 2.0)])
+    pool.update_job(progress)
+    self.assertIsNone(progress.timings)
+
+    metrics = pool.metrics.export().decode("utf-8")
+    self.assertIn('onnx_web_queue_wait_seconds_count{device="cpu"} 1.0', metrics)
+    self.assertIn('onnx_web_stage_seconds_sum{stage="source-txt2img"} 2.0', metrics)
+
+  def test_preview_between_steps(self):
+    pool = make_pool(["cpu"])
+    pool.submit("foo", noop)
+    pool.schedule()
+
+    pool.update_job(ProgressCommand("foo", "cpu", False, 4, preview=b"step-4"))
+    self.assertEqual(pool.get_preview("foo"), b"step-4")
+
+    # polling between preview steps still returns the last preview
+    pool.update_job(ProgressCommand("foo", "cpu", False, 5))
+    _pending, progress = pool.done("foo")
+    self.assertEqual(progress.progress, 5)
+    self.assertIsNone(progress.preview)
+    self.assertEqual(pool.get_preview("foo"), b"step-4")
+
+  def test_submit_wakes(self):
+    pool = make_pool(["cpu"])
+    pool.submit("foo", noop)
+    self.assertIsNone(pool.events.get_nowait())
+
+  def test_subscribe_limit(self):
+    pool = make_pool(["cpu"])
+    listener = pool.subscribe(["foo"], limit=1)
+    self.assertIsNotNone(listener)
+    self.assertIsNone(pool.subscribe(["bar"], limit=1))
+
+    pool.unsubscribe(listener)
+    self.assertIsNotNone(pool.subscribe(["bar"], limit=1))
+
+  def test_subscribe(self):
+    pool = make_pool(["cpu"])
+    listener = pool.subscribe(["foo"])
+    pool.update_job(ProgressCommand("bar", "cpu", False, 1))
+    pool.update_job(ProgressCommand("foo", "cpu", False, 2))
+    pool.update_job(ProgressCommand("foo", "cpu", True, 10))
+
+    self.assertEqual(listener.get_nowait().progress, 2)
+    self.assertTrue(listener.get_nowait().finished)
+    self.assertTrue(listener.empty())
+
+    pool.unsubscribe(listener)
+    self.assertEqual(len(pool.listeners), 0)
+
+  def test_subscribe_cancel(self):
+    pool = make_pool(["cpu"])
+    pool.context["cpu"].set_idle(False)
+    listener = pool.subscribe()
+    pool.submit("foo", noop)
+    pool.cancel("foo")
+
+    progress = listener.get_nowait()
+    self.assertTrue(progress.cancelled)
+    self.assertEqual(pool.done("foo"), (False, progress))
+
+  def test_coalesce(self):
+    pool = make_pool(["cpu"])
+    pool.coalesce_window = 10
+    pool.coalesce_limit = 2
+    pool.submit("a", noop, coalesce_key="foo", coalesce_fn=noop)
+    pool.schedule()
+    self.assertEqual(pool.pending["cpu"].qsize(), 0)
+
+    pool.submit("b", noop, coalesce_key="foo", coalesce_fn=noop)
+    pool.submit("c", noop, coalesce_key="bar", coalesce_fn=noop)
+    pool.schedule()
+
+    job = pool.pending["cpu"].get()
+    self.assertEqual(job.members, ["a", "b"])
+    self.assertEqual([member.name for member in job.args[0]], ["a", "b"])
+    self.assertEqual(len(pool.ready_jobs["any"]), 1)
+
+  def test_coalesce_window(self):
+    pool = make_pool(["cpu"])
+    pool.coalesce_window = 10
+    pool.submit("a", noop, coalesce_key="foo", coalesce_fn=noop)
+    pool.ready_jobs["any"][0].queued -= 10
+    pool.schedule()
+
+    job = pool.pending["cpu"].get()
+    self.assertEqual(job.name, "a")
+    self.assertEqual(job.members, ["a"])
+
+  def test_coalesce_cancel(self):
+    pool = make_pool(["cpu"])
+    pool.coalesce_window = 10
+    pool.coalesce_limit = 2
+    pool.submit("a", noop, coalesce_key="foo", coalesce_fn=noop)
+    pool.submit("b", noop, coalesce_key="foo", coalesce_fn=noop)
+    pool.schedule()
+
+    pool.cancel("b")
+    pool.update_job(ProgressCommand("a", "cpu", False, 1))
+    pool.update_job(ProgressCommand("b", "cpu", False, 1))
+    self.assertTrue(pool.jobs.get("b").progress.cancelled)
+    self.assertFalse(pool.context["cpu"].cancel)
+
+    pool.update_job(ProgressCommand("a", "cpu", True, 10))
+    self.assertTrue(pool.jobs.get("b").progress.cancelled)
+    self.assertTrue(pool.context["cpu"].is_idle())
+
+  def test_coalesce_cancel_all(self):
+    pool = make_pool(["cpu"])
+    pool.coalesce_window = 10
+    pool.coalesce_limit = 2
+    pool.submit("a", noop, coalesce_key="foo", coalesce_fn=noop)
+    pool.submit("b", noop, coalesce_key="foo", coalesce_fn=noop)
+    pool.schedule()
+
+    pool.cancel("a")
+    pool.cancel("b")
+    pool.update_job(ProgressCommand("a", "cpu", False, 1))
+    self.assertTrue(pool.context["cpu"].cancel)
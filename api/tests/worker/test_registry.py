@@ -0,0 +1,87 @@
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+
+from onnx_web.worker.command import ProgressCommand
+from onnx_web.worker.registry import JobRegistry, JobState
+
+
+class TestJobRegistry(unittest.TestCase):
+  def test_states(self):
+    registry = JobRegistry()
+    registry.add("foo")
+    self.assertEqual(registry.get("foo").state, JobState.pending)
+
+    registry.update(ProgressCommand("foo", "cpu", False, 1))
+    self.assertEqual(registry.get("foo").state, JobState.running)
+
+    registry.update(ProgressCommand("foo", "cpu", True, 10, failed=True))
+    self.assertEqual(registry.get("foo").state, JobState.failed)
+
+  def test_ignore_final(self):
+    registry = JobRegistry()
+    registry.add("foo")
+    registry.update(ProgressCommand("foo", "cpu", True, 0, cancelled=True))
+
+    self.assertIsNone(registry.update(ProgressCommand("foo", "cpu", False, 1)))
+    self.assertEqual(registry.get("foo").state, JobState.cancelled)
+
+  def test_unknown(self):
+    registry = JobRegistry()
+    self.assertIsNone(registry.update(ProgressCommand("foo", "cpu", False, 1)))
+    self.assertIsNone(registry.get("foo"))
+
+    registry.update(ProgressCommand("foo", "cpu", True, 10))
+    self.assertEqual(registry.get("foo").state, JobState.finished)
+    self.assertIn("foo", registry.final_jobs)
+
+  def test_keep_preview(self):
+    registry = JobRegistry()
+    registry.add("foo")
+    registry.update(ProgressCommand("foo", "cpu", False, 2, preview=b"preview"))
+    registry.update(ProgressCommand("foo", "cpu", False, 3))
+    self.assertEqual(registry.get("foo").preview, b"preview")
+
+    registry.update(ProgressCommand("foo", "cpu", True, 10))
+    self.assertIsNone(registry.get("foo").preview)
+
+  def test_retry(self):
+    registry = JobRegistry()
+    registry.update(ProgressCommand("foo", "cpu", True, 10))
+    registry.add("foo")
+
+    self.assertEqual(registry.get("foo").state, JobState.pending)
+    self.assertEqual(len(registry.final_jobs), 0)
+
+  def test_limit(self):
+    registry = JobRegistry(limit=2)
+    registry.add("running")
+    for name in ["a", "b", "c"]:
+      registry.update(ProgressCommand(name, "cpu", True, 10))
+
+    self.assertIsNone(registry.get("a"))
+    self.assertIsNotNone(registry.get("c"))
+    self.assertIsNotNone(registry.get("running"))
+
+  def test_ttl(self):
+    registry = JobRegistry(ttl=60)
+    registry.update(ProgressCommand("foo", "cpu", True, 10))
+    registry.get("foo").updated -= 120
+    registry.prune()
+
+    self.assertIsNone(registry.get("foo"))
+
+  def test_persist(self):
+    with TemporaryDirectory() as temp:
+      history = path.join(temp, "history.db")
+      registry = JobRegistry(path=history)
+      registry.add("foo")
+      registry.update(ProgressCommand("foo", "cpu", True, 10, failed=True))
+      registry.add("bar")
+      registry.close()
+
+      registry = JobRegistry(path=history)
+      self.assertEqual(registry.get("foo").state, JobState.failed)
+      self.assertTrue(registry.get("foo").progress.failed)
+      self.assertIsNone(registry.get("bar"))
+      registry.close()
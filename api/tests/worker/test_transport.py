@@ -0,0 +1,98 @@
+import unittest
+from os import listdir, path
+from tempfile import TemporaryDirectory
+
+from PIL import Image
+
+from onnx_web.worker.command import JobCommand
+from onnx_web.worker.transport import (
+  ImageTransport,
+  SharedImage,
+  load_job_images,
+)
+
+
+def test_job(*args, **kwargs):
+  pass
+
+
+class ChainStub:
+  def __init__(self, stages):
+    self.stages = stages
+
+
+class TestImageTransport(unittest.TestCase):
+  def test_share_args(self):
+    transport = ImageTransport()
+    source = Image.effect_noise((64, 32), 32).convert("RGB")
+    mask = Image.new("L", (64, 32), 128)
+    job = JobCommand(
+      "test", None, test_job, ("text", source, [mask]), {"stage_mask": mask}
+    )
+
+    transport.share(job)
+    self.assertEqual(job.args[0], "text")
+    self.assertIsInstance(job.args[1], SharedImage)
+    self.assertIsInstance(job.args[2][0], SharedImage)
+    self.assertIsInstance(job.kwargs["stage_mask"], SharedImage)
+
+    load_job_images(job)
+    self.assertEqual(job.args[1].tobytes(), source.tobytes())
+    self.assertEqual(job.args[1].mode, "RGB")
+    self.assertEqual(job.args[2][0].size, (64, 32))
+    self.assertEqual(job.kwargs["stage_mask"].tobytes(), mask.tobytes())
+
+    transport.close()
+
+  def test_share_stages(self):
+    transport = ImageTransport()
+    source = Image.new("RGBA", (16, 16), "red")
+    pipeline = ChainStub([(test_job, None, {"stage_source": source})])
+    job = JobCommand("test", None, pipeline, (), {})
+
+    transport.share(job)
+    self.assertIsInstance(pipeline.stages[0][2]["stage_source"], SharedImage)
+
+    load_job_images(job)
+    self.assertEqual(pipeline.stages[0][2]["stage_source"].tobytes(), source.tobytes())
+
+    transport.close()
+
+  def test_release(self):
+    transport = ImageTransport()
+    job = JobCommand("test", None, test_job, (Image.new("RGB", (8, 8)),), {})
+    transport.share(job)
+
+    shared = job.args[0]
+    self.assertTrue(path.exists(shared.file))
+
+    transport.release("test")
+    self.assertFalse(path.exists(shared.file))
+
+    root = transport.root
+    transport.close()
+    self.assertFalse(path.exists(root))
+
+  def test_other_modes(self):
+    transport = ImageTransport()
+    palette = Image.new("P", (8, 8))
+    job = JobCommand("test", None, test_job, (palette,), {})
+
+    transport.share(job)
+    self.assertIs(job.args[0], palette)
+
+    transport.close()
+
+  def test_write_error(self):
+    class BrokenImage:
+      mode = "RGB"
+      size = (8, 8)
+
+      def tobytes(self):
+        raise OSError("no space left on device")
+
+    with TemporaryDirectory() as root:
+      with self.assertRaises(OSError):
+        SharedImage.from_image(BrokenImage(), root)
+
+      self.assertEqual(listdir(root), [])